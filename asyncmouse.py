@@ -0,0 +1,487 @@
+#!/usr/bin/env python3
+# asyncmouse.py - an asyncio API for embedding lgmpm, ex. in a game launcher
+#   or an overlay, that never blocks the event loop and returns results
+#       instead of printing them
+#
+#   usage:
+#       mouse = await AsyncMouse.connect()
+#       result = await mouse.apply("gaming", timeout=5)
+#       if not result.ok:
+#           print(result.error)
+
+import asyncio
+import contextlib
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from backends import DeviceBackendError, RatbagctlBackend, get_backend
+from executor import CommandResult, get_breaker, is_transient
+from identity import DeviceIdentity
+from locks import FileLock
+from mouse import get_next_profile_name
+from mouseprofile import MouseProfile
+from plan import InvalidProfileError
+from snapshot import SNAPSHOT_ATTRS, parse_info, query_setting
+from store import ProfileStoreError, get_store
+
+# how often a waiting apply() checks whether the store lock was released
+LOCK_POLL_S = 0.02
+
+
+class ApplyResult:
+    """
+    A class representing the outcome of writing a profile to a mouse
+
+        Attributes:
+            profile (str): the name of the profile
+            alias (str): the mouse it was written to
+            commands (list(list(str))): the settings that differed,
+                ex. [["rate", "set", "1000"]]
+            results (list(CommandResult)): the calls that ran, if the backend runs any
+            dry_run (bool): nothing was written, commands is what would have been
+            error (str): why the profile could not be written, or None
+            duration (float): how long it took, in seconds
+    """
+
+    def __init__(self, profile, alias, commands=(), results=(), dry_run=False):
+        self.profile = profile
+        self.alias = alias
+        self.commands = list(commands)
+        self.results = list(results)
+        self.dry_run = dry_run
+        self.error = None
+        self.duration = 0.0
+        return
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def written(self):
+        """
+        True if settings were actually written to the mouse
+        """
+        return self.ok and not self.dry_run and bool(self.commands)
+
+    def __repr__(self):
+        status = "ok" if self.ok else f"failed: {self.error}"
+        return (
+            f"ApplyResult({self.profile!r} on {self.alias!r}, "
+            f"{len(self.commands)} command(s), {status})"
+        )
+
+
+async def run_command_async(argv, timeout=None, merge_stderr=True):
+    """
+    Runs one command as an asyncio subprocess, see executor.run_command()
+        Params:
+            argv (list(str)): the command to run, ex. ["ratbagctl", "list"]
+            timeout (float): seconds to wait before killing it, None to wait forever
+            merge_stderr (bool): keep stderr in the output, or drop it
+        Returns:
+            (CommandResult): the outcome, with a returncode of None if the
+                command could not be started, timed out, or was skipped
+                because the circuit breaker is open
+    """
+    # NOTE shares the circuit breaker with lgmpm.py, but doesn't retry,
+    #   since the caller already bounds the whole call with its own timeout
+    breaker = get_breaker()
+    wait = breaker.get_wait()
+    if wait:
+        output = (
+            f"skipped, ratbagd failed {breaker.threshold} times in a row"
+            f" (trying again in {wait:.0f} s)"
+        )
+        return CommandResult(argv, None, 0.0, output)
+    start = time.perf_counter()
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *argv,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=(
+                asyncio.subprocess.STDOUT if merge_stderr else asyncio.subprocess.PIPE
+            ),
+        )
+    except OSError as e:
+        # ex. ratbagctl is not installed
+        return CommandResult(argv, None, time.perf_counter() - start, str(e))
+    try:
+        stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        breaker.record(False)
+        output = f"timed out after {timeout} s"
+        return CommandResult(argv, None, time.perf_counter() - start, output)
+    except asyncio.CancelledError:
+        # never leave ratbagctl running behind a cancelled call
+        proc.kill()
+        await proc.wait()
+        raise
+    output = stdout.decode(errors="replace")
+    errors = output if merge_stderr else stderr.decode(errors="replace")
+    breaker.record(not is_transient(proc.returncode, errors))
+    return CommandResult(argv, proc.returncode, time.perf_counter() - start, output)
+
+
+class AsyncRatbagctlBackend:
+    """
+    A backend that runs ratbagctl as asyncio subprocesses, see RatbagctlBackend
+
+        Attributes:
+            timeout (float): seconds each ratbagctl call may take
+            semaphore (asyncio.Semaphore): bounds how many reads run at once
+    """
+
+    name = "ratbagctl"
+
+    def __init__(self, timeout=10.0, max_concurrency=4):
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        return
+
+    async def _read(self, args):
+        """
+        Runs a read-only ratbagctl call, at most max_concurrency at a time
+            Params:
+                args (list(str)): the arguments after 'ratbagctl', ex. ["list"]
+            Returns:
+                (str): the decoded stdout, empty if the call failed
+        """
+        async with self.semaphore:
+            result = await run_command_async(
+                ["ratbagctl"] + args, self.timeout, merge_stderr=False
+            )
+        if result.returncode is None:
+            raise DeviceBackendError(f"'{' '.join(result.argv)}': {result.output}")
+        # NOTE like get_bash_stdout(), a failed read is just empty/unparsable
+        #   output, ex. when asking for one resolution past the last one
+        return result.output
+
+    async def list_devices(self):
+        """
+        Lists the connected mice, see RatbagctlBackend.list_devices()
+        """
+        return RatbagctlBackend.parse_list(await self._read(["list"]))
+
+    async def get_device_name(self, alias):
+        """
+        Returns the 'long form' name of the mouse, see RatbagctlBackend.get_device_name()
+        """
+        return (await self._read([alias, "name"])).strip()
+
+    async def snapshot(self, alias):
+        """
+        Reads the current settings of the mouse, see RatbagctlBackend.snapshot()
+        """
+        snapshot = parse_info(await self._read([alias, "info"]))
+        # whatever 'info' didn't have is queried field by field, all at once
+        missing = [attr for attr in SNAPSHOT_ATTRS if attr not in snapshot]
+        values = await asyncio.gather(*(self._query(alias, attr) for attr in missing))
+        snapshot.update(zip(missing, values))
+        return {attr: snapshot[attr] for attr in SNAPSHOT_ATTRS}
+
+    async def apply(self, alias, commands):
+        """
+        Writes the settings to the mouse in order and commits them once,
+            see RatbagctlBackend.apply()
+        """
+        results = []
+        for argv in RatbagctlBackend.get_plan(alias, commands):
+            result = await run_command_async(argv, self.timeout)
+            results.append(result)
+            if not result.ok:
+                raise DeviceBackendError(
+                    f"'{' '.join(argv)}' failed, nothing was committed", results
+                )
+        return results
+
+    async def _query(self, alias, attr):
+        """
+        Queries one setting of the mouse on its own, see snapshot.query_setting(),
+            the calls of one step (ex. every button) run at once
+        """
+        query = query_setting(attr)
+        try:
+            calls = next(query)
+            while True:
+                outs = await asyncio.gather(
+                    *(self._read([alias] + args) for args in calls)
+                )
+                calls = query.send(list(outs))
+        except StopIteration as stop:
+            return stop.value
+
+
+class ThreadedBackend:
+    """
+    A class running a synchronous backend (ex. dbus or fake) in worker threads,
+        so it can be awaited like AsyncRatbagctlBackend
+
+        Attributes:
+            backend: the wrapped backend, ex. DBusBackend()
+            timeout (float): seconds each call may take
+            semaphore (asyncio.Semaphore): bounds how many calls run at once
+    """
+
+    def __init__(self, backend, timeout=10.0, max_concurrency=4):
+        self.backend = backend
+        self.name = backend.name
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        return
+
+    async def _call(self, method, *args):
+        """
+        Runs one backend method in a worker thread
+        """
+        async with self.semaphore:
+            try:
+                return await asyncio.wait_for(
+                    asyncio.to_thread(getattr(self.backend, method), *args),
+                    self.timeout,
+                )
+            except asyncio.TimeoutError:
+                # NOTE the thread itself can't be stopped, only stop waiting on it
+                raise DeviceBackendError(f"{method} timed out after {self.timeout} s")
+
+    async def list_devices(self):
+        return await self._call("list_devices")
+
+    async def get_device_name(self, alias):
+        return await self._call("get_device_name", alias)
+
+    async def snapshot(self, alias):
+        return await self._call("snapshot", alias)
+
+    async def apply(self, alias, commands):
+        return await self._call("apply", alias, commands)
+
+
+def get_async_backend(backend=None, timeout=10.0, max_concurrency=4):
+    """
+    Returns an awaitable version of a backend, defaults to get_backend()
+    """
+    backend = backend or get_backend()
+    if isinstance(backend, RatbagctlBackend):
+        return AsyncRatbagctlBackend(timeout, max_concurrency)
+    return ThreadedBackend(backend, timeout, max_concurrency)
+
+
+class AsyncMouse:
+    """
+    A class to represent one Logitech G mouse in an asyncio program, see Mouse
+
+        Attributes:
+            identity (DeviceIdentity): the mouse
+            alias (str): the ratbagctl 'short name' of the mouse, ex. 'dancing-puppy'
+            model (str): a short version of the mouse model, ex. 'g403'
+            store (JsonProfileStore): where the profiles of this mouse model are saved
+            backend (AsyncRatbagctlBackend): how the mouse is read and written
+            last_active_profile (str): the last profile written, once loaded
+            store_thread (ThreadPoolExecutor): the one thread the store is used from,
+                since a sqlite connection can't be shared between threads
+    """
+
+    def __init__(self, identity, backend=None):
+        """
+        Sets up the mouse, nothing is read until a method is awaited
+            Params:
+                identity (DeviceIdentity): the mouse, see AsyncMouse.connect()
+                backend: an awaitable backend, defaults to get_async_backend()
+        """
+        self.identity = identity
+        self.alias = identity.alias
+        self.model = identity.model
+        self.store = get_store(identity.model)
+        self.backend = backend or get_async_backend()
+        self.store_thread = ThreadPoolExecutor(max_workers=1)
+        self.last_active_profile = None
+        return
+
+    async def _in_store_thread(self, func, *args):
+        """
+        Runs a (blocking) store call without blocking the event loop
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.store_thread, func, *args)
+
+    @classmethod
+    async def connect(cls, alias=None, backend=None, timeout=10.0, max_concurrency=4):
+        """
+        Finds a connected mouse
+            Params:
+                alias (str): the mouse to use, defaults to the first one listed
+                backend: a synchronous backend to wrap, defaults to get_backend()
+                timeout (float): seconds each call to the mouse may take
+                max_concurrency (int): the most reads that run at once
+            Returns:
+                (AsyncMouse): the mouse
+        """
+        async_backend = get_async_backend(backend, timeout, max_concurrency)
+        devices = await async_backend.list_devices()
+        for device_alias, model in devices:
+            if alias is None or device_alias == alias:
+                return cls(DeviceIdentity(device_alias, model), async_backend)
+        raise DeviceBackendError(f"No supported Logitech G mouse '{alias or ''}' found")
+
+    @classmethod
+    async def connect_all(cls, backend=None, timeout=10.0, max_concurrency=4):
+        """
+        Finds every connected mouse, see connect()
+            Returns:
+                (list(AsyncMouse)): one AsyncMouse per connected mouse
+        """
+        async_backend = get_async_backend(backend, timeout, max_concurrency)
+        devices = await async_backend.list_devices()
+        return [
+            cls(DeviceIdentity(alias, model), async_backend) for alias, model in devices
+        ]
+
+    async def snapshot(self, name="current"):
+        """
+        Reads the settings currently on the mouse
+            Returns:
+                (MouseProfile): the settings, named name
+        """
+        settings = await self.backend.snapshot(self.alias)
+        return MouseProfile(name=name, attrs=dict(settings, name=name))
+
+    async def load_profiles(self):
+        """
+        Reads the stored profiles, saving the mouse's settings as 'default'
+            if none were stored yet, see Mouse()
+            Returns:
+                (last_active_profile, profiles) (tuple): as returned by store.load()
+        """
+        try:
+            return await self._in_store_thread(self.store.load)
+        except FileNotFoundError:
+            mp = await self.snapshot("default")
+            profiles = {mp.name: mp.__dict__}
+            await self._in_store_thread(self._save_new, profiles, mp.name)
+            return (mp.name, profiles)
+
+    def _save_new(self, profiles, last_active_profile):
+        """
+        Saves the profiles of a new store
+        """
+        self.store.save_profiles(profiles, changed=profiles)
+        self.store.save_active(last_active_profile)
+        return
+
+    @contextlib.asynccontextmanager
+    async def locked(self):
+        """
+        Holds the store lock, like Mouse.locked(), so lgmpm.py and other
+            AsyncMouse objects don't change the same mouse at the same time
+        """
+        lock = FileLock(self.store.lock_path)
+        # NOTE poll instead of blocking a thread on flock(), so a cancelled
+        #   wait can't go on to take the lock after nobody wants it
+        while not lock.acquire(blocking=False):
+            await asyncio.sleep(LOCK_POLL_S)
+        try:
+            yield
+        finally:
+            lock.release()
+
+    async def apply(self, profile, dry_run=False, timeout=None):
+        """
+        Writes a profile to the mouse, only the settings that differ, and
+            saves it as the last active profile
+            Params:
+                profile (str or MouseProfile): a stored profile name, or the settings
+                dry_run (bool): only work out what would be written
+                timeout (float): seconds the whole write may take, None to wait
+            Returns:
+                (ApplyResult): what was written and how it went, it never raises
+                    for a mouse error, but does on cancellation
+        """
+        name = profile if isinstance(profile, str) else profile.name
+        return await self._run(name, dry_run, timeout, lambda profiles: profile)
+
+    async def cycle(self, steps=1, dry_run=False, timeout=None):
+        """
+        Writes the profile a number of steps after the last active one,
+            sorted alphabetically, see apply()
+            Returns:
+                (ApplyResult): what was written and how it went
+        """
+
+        def pick(profiles):
+            return get_next_profile_name(profiles, self.last_active_profile, steps)
+
+        return await self._run(None, dry_run, timeout, pick)
+
+    async def _run(self, name, dry_run, timeout, pick):
+        """
+        Does the work of apply() and cycle(), under the store lock
+            Params:
+                name (str): the profile name reported if picking it fails
+                pick (function): takes the stored profiles, returns the
+                    profile name or MouseProfile to write
+        """
+        start = time.perf_counter()
+        result = ApplyResult(name, self.alias, dry_run=dry_run)
+        try:
+            await asyncio.wait_for(self._write(pick, result), timeout)
+        except asyncio.TimeoutError:
+            result.error = f"timed out after {timeout} s"
+        except (
+            DeviceBackendError,
+            InvalidProfileError,
+            ProfileStoreError,
+            OSError,
+            ValueError,
+        ) as e:
+            result.error = str(e)
+        result.duration = time.perf_counter() - start
+        return result
+
+    async def _write(self, pick, result):
+        """
+        Writes the picked profile, filling in result as it goes
+        """
+        async with self.locked():
+            self.last_active_profile, profiles = await self.load_profiles()
+            profile = pick(profiles)
+            if isinstance(profile, str):
+                if profile not in profiles:
+                    raise ValueError(
+                        f"No stored {self.model.upper()} profile '{profile}'"
+                    )
+                profile = MouseProfile(name=profile, attrs=profiles[profile])
+            result.profile = profile.name
+            current = await self.snapshot()
+            # the same fingerprint means there's nothing to write
+            if current.get_fingerprint() != profile.get_fingerprint():
+                plan = await self._in_store_thread(
+                    self.store.get_plan, profile.__dict__
+                )
+                result.commands = profile.get_commands(current, plan)
+            if result.dry_run:
+                return
+            if result.commands:
+                try:
+                    results = await self.backend.apply(self.alias, result.commands)
+                except DeviceBackendError as e:
+                    result.results = e.results
+                    raise
+                result.results = results or []
+            await self._in_store_thread(self.store.save_active, profile.name)
+            self.last_active_profile = profile.name
+        return
+
+    async def detect(self):
+        """
+        Finds which stored profiles have the settings on the mouse right now
+            Returns:
+                (list(str)): the names of the matching profiles, sorted
+        """
+        await self.load_profiles()
+        current = await self.snapshot()
+        return await self._in_store_thread(
+            self.store.find_profiles, current.get_fingerprint()
+        )
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+# backends.py - the ways lgmpm can read from and write to a mouse
+#
+#   every backend takes the same ratbagctl-style settings,
+#       ex. ["rate", "set", "1000"], as compiled by plan.compile_plan(),
+#           so a profile can be written through any of them
+
+import functools
+import os
+import re
+
+from snapshot import SNAPSHOT_ATTRS, parse_info, query_setting
+from utils import get_bash_stdout
+
+MOUSE_RE = re.compile(r"([a-z-]+):.*(G\d{3}|G Pro).*")
+
+
+class DeviceBackendError(Exception):
+    """
+    Raised when a backend can't read from or write to the mouse
+
+        Attributes:
+            results (list(CommandResult)): the commands that ran before the
+                failure, if the backend runs commands
+    """
+
+    def __init__(self, message, results=None):
+        super().__init__(message)
+        self.results = results or []
+        return
+
+
+def bounded(method):
+    """
+    Runs a backend method under a single operation deadline, see executor.Deadline,
+        so a hung ratbagd can't block it for longer, and turns a read that
+            timed out or was skipped into a DeviceBackendError
+    """
+
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        # only imported here, so that importing a backend doesn't import it
+        from executor import CommandError, Deadline
+
+        with Deadline():
+            try:
+                return method(*args, **kwargs)
+            except CommandError as e:
+                raise DeviceBackendError(str(e), [e.result])
+
+    return wrapper
+
+
+class RatbagctlBackend:
+    """
+    A backend that runs the ratbagctl CLI for every read and write
+    """
+
+    name = "ratbagctl"
+
+    @bounded
+    def list_devices(self):
+        """
+        Parses the connected mice out of 'ratbagctl list'
+            Returns:
+                devices (list(tuple)): (alias, model) of each supported mouse,
+                    ex. [("sleeping-puppy", "g403")]
+        """
+        return self.parse_list(get_bash_stdout("ratbagctl list"))
+
+    @staticmethod
+    def parse_list(list_out):
+        """
+        Parses the supported mice out of the output of 'ratbagctl list'
+            Returns:
+                devices (list(tuple)): (alias, model) of each supported mouse
+        """
+        devices = []
+        for line in list_out.splitlines():
+            mouse_mo = MOUSE_RE.match(line)
+            if mouse_mo:
+                devices.append((mouse_mo.group(1).lower(), mouse_mo.group(2).lower()))
+        return devices
+
+    @staticmethod
+    def get_plan(alias, commands):
+        """
+        Builds the ratbagctl calls that write settings to the mouse
+            Params:
+                alias (str): the ratbagctl alias of the mouse
+                commands (list(list(str))): the settings to write,
+                    ex. [["rate", "set", "1000"]]
+            Returns:
+                plan (list(list(str))): the argument vector of each call
+        """
+        # every command but the last uses '--nocommit',
+        #   so the whole profile is sent to the mouse at once
+        #       and nothing is committed if an earlier command fails
+        plan = [["ratbagctl", "--nocommit", alias] + words for words in commands]
+        plan[-1].remove("--nocommit")
+        return plan
+
+    @bounded
+    def get_device_name(self, alias):
+        """
+        Returns the 'long form' name of the mouse, ex. 'Logitech G403 Prodigy Gaming Mouse'
+        """
+        return get_bash_stdout(f"ratbagctl {alias} name").strip()
+
+    @bounded
+    def snapshot(self, alias):
+        """
+        Reads the current settings of the mouse
+            Params:
+                alias (str): the ratbagctl alias of the mouse
+            Returns:
+                (dict): report_rate, resolutions, default_resolution, buttons, and leds
+        """
+        # read everything we can from a single 'info' call, then only
+        #   query ratbagctl field by field for whatever could not be parsed
+        snapshot = parse_info(get_bash_stdout(f"ratbagctl {alias} info"))
+        for attr in SNAPSHOT_ATTRS:
+            if attr not in snapshot:
+                snapshot[attr] = self._query(alias, attr)
+        return {attr: snapshot[attr] for attr in SNAPSHOT_ATTRS}
+
+    @bounded
+    def apply(self, alias, commands):
+        """
+        Writes the settings to the mouse and commits them once
+            Params:
+                alias (str): the ratbagctl alias of the mouse
+                commands (list(list(str))): the settings to write,
+                    ex. [["rate", "set", "1000"]]
+            Returns:
+                results (list(CommandResult)): the status and timing of each command
+        """
+        from executor import run_plan
+
+        results = run_plan(self.get_plan(alias, commands))
+        if not results[-1].ok:
+            raise DeviceBackendError(
+                f"'{' '.join(results[-1].argv)}' failed, nothing was committed",
+                results,
+            )
+        return results
+
+    @staticmethod
+    def _query(alias, attr):
+        """
+        Queries one setting of the mouse on its own, see snapshot.query_setting()
+            Params:
+                alias (str): the ratbagctl alias of the mouse
+                attr (str): the setting, ex. "resolutions"
+            Returns:
+                the setting, ex. [400, 800, 1600]
+        """
+        query = query_setting(attr)
+        try:
+            calls = next(query)
+            while True:
+                outs = [
+                    get_bash_stdout(" ".join(["ratbagctl", alias] + args))
+                    for args in calls
+                ]
+                calls = query.send(outs)
+        except StopIteration as stop:
+            return stop.value
+
+
+def get_button_action(action):
+    """
+    Turns the arguments after 'button N action set' back into a 'command-ified'
+        action, ex. ["special", "resolution-cycle-up"] -> 'resolution-cycle-up'
+    """
+    if action[:1] in (["macro"], ["special"]):
+        action = action[1:]
+    return " ".join(action)
+
+
+BACKENDS = ("ratbagctl", "dbus", "fake")
+
+_backend = None
+
+
+def get_backend():
+    """
+    Returns the backend selected by $LGMPM_BACKEND (default 'ratbagctl'),
+        created once per process
+    """
+    global _backend
+    if _backend is None:
+        name = os.environ.get("LGMPM_BACKEND", "ratbagctl")
+        # only imported here, so that a backend is only compiled when it is picked
+        if name == "ratbagctl":
+            _backend = RatbagctlBackend()
+        elif name == "dbus":
+            from dbusbackend import DBusBackend
+
+            _backend = DBusBackend()
+        elif name == "fake":
+            from fakebackend import FakeBackend
+
+            _backend = FakeBackend(state_path=os.environ.get("LGMPM_FAKE_STATE"))
+        else:
+            raise DeviceBackendError(
+                f"Unknown backend '{name}', expected one of {', '.join(BACKENDS)}"
+            )
+    return _backend
+
+
+def set_backend(backend):
+    """
+    Replaces the process-wide backend, ex. with a FakeBackend in tests
+        Params:
+            backend: a RatbagctlBackend, DBusBackend, or FakeBackend
+    """
+    global _backend
+    _backend = backend
+    return
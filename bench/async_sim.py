@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+# async_sim.py - runs asyncmouse.AsyncMouse against bench/fake_ratbagctl.py,
+#   checks what apply() and cycle() write, and that a timed-out or cancelled
+#       apply() commits nothing, saves nothing, and lets go of the store lock
+#
+#   usage: python3 bench/async_sim.py
+#       exits with 1 if a result is wrong, or a stopped apply() leaves
+#           anything behind
+
+import asyncio
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from benchutil import ALIAS, MODEL, REPO_DIR, Checks, seed_profiles
+
+FAKE_RATBAGCTL = REPO_DIR / "bench" / "fake_ratbagctl.py"
+
+DEVICE = {
+    "name": "Logitech G403 Prodigy Gaming Mouse",
+    "report_rate": 1000,
+    "resolutions": [400, 800, 0, 3200],
+    "default_resolution": 1,
+    "buttons": ["button 1", "button 2", "KEY_A", "resolution-cycle-up"],
+    "leds": [
+        {"mode": "off", "color": "000000", "duration": None, "brightness": 255},
+        {"mode": "breathing", "color": "00ff00", "duration": 2000, "brightness": 128},
+    ],
+}
+
+
+def get_running(bin_dir):
+    """
+    Returns the cmdlines of every fake ratbagctl call still running
+    """
+    running = []
+    for cmdline_fp in Path("/proc").glob("[0-9]*/cmdline"):
+        try:
+            cmdline = cmdline_fp.read_bytes().replace(b"\0", b" ").decode()
+        except OSError:
+            continue
+        if str(bin_dir) in cmdline:
+            running.append(cmdline)
+    return running
+
+
+async def run_checks(check, tmp_dir, log_fp):
+    # only imported here, after the environment points at the temp dirs
+    from asyncmouse import AsyncMouse
+    from backends import RatbagctlBackend
+
+    active_fp = tmp_dir / "models" / f"{MODEL}.active"
+
+    def read_calls():
+        calls = log_fp.read_text().splitlines() if log_fp.exists() else []
+        log_fp.unlink(missing_ok=True)
+        return calls
+
+    def read_device():
+        return json.loads((tmp_dir / "mice.json").read_text())[ALIAS]
+
+    async def take_lock():
+        async with mouse.locked():
+            return True
+
+    print("snapshot():")
+    backend = RatbagctlBackend()
+    expected = backend.snapshot(ALIAS)
+    mouse = await AsyncMouse.connect(backend=backend)
+    current = await mouse.snapshot()
+    check(
+        "reads the same settings as RatbagctlBackend",
+        {attr: getattr(current, attr) for attr in expected} == expected,
+    )
+    # every field is queried on its own when 'info' fails
+    os.environ["FAKE_RATBAGCTL_FAIL"] = " info$"
+    read_calls()
+    fallback = await mouse.backend.snapshot(ALIAS)
+    calls = read_calls()
+    check("  and field by field without 'info'", fallback == expected)
+    check("    like RatbagctlBackend does", backend.snapshot(ALIAS) == expected)
+    check(
+        "    one call per button, LED, and resolution past the last",
+        sum("button" in call for call in calls) == 1 + len(DEVICE["buttons"])
+        and sum(" led " in call for call in calls) == 1 + len(DEVICE["leds"])
+        and sum(" resolution " in call for call in calls)
+        == 2 + len(DEVICE["resolutions"]),
+    )
+    del os.environ["FAKE_RATBAGCTL_FAIL"]
+
+    # profiles shaped like the fake mouse, that differ in two settings
+    seed_profiles(
+        tmp_dir / "models",
+        {
+            "default": expected,
+            "gaming": dict(expected, report_rate=500, default_resolution=3),
+        },
+        active="default",
+    )
+
+    print("apply():")
+    read_calls()
+    result = await mouse.apply("gaming")
+    calls = read_calls()
+    check("writes a stored profile", result.ok and result.written)
+    check(
+        "  only its differing settings",
+        read_device()["report_rate"] == 500
+        and read_device()["default_resolution"] == 3
+        and not any("led" in words or "button" in words for words in result.commands),
+    )
+    check(
+        "  committed by the last call only",
+        [call.startswith("--nocommit") for call in calls if " set " in call]
+        == [True] * (len(result.commands) - 1) + [False],
+    )
+    check(
+        "  and saves it as the last active profile",
+        active_fp.read_text().strip() == "gaming",
+    )
+    result = await mouse.apply("gaming")
+    check(
+        "writes nothing when it is already on the mouse",
+        result.ok and not result.written,
+    )
+    result = await mouse.apply("missing")
+    check(
+        "reports a profile that isn't stored",
+        not result.ok and "missing" in result.error,
+    )
+
+    print("cycle():")
+    result = await mouse.cycle()
+    check(
+        "writes the next profile",
+        result.ok
+        and result.profile == "default"
+        and read_device()["report_rate"] == 1000,
+    )
+    result = await mouse.cycle(dry_run=True)
+    check(
+        "  or only works out what it would write",
+        result.ok
+        and result.profile == "gaming"
+        and result.commands
+        and not result.written
+        and read_device()["report_rate"] == 1000
+        and active_fp.read_text().strip() == "default",
+    )
+
+    # every write but the commit hangs, like ratbagd after a resume
+    os.environ["FAKE_RATBAGCTL_HANG"] = "^--nocommit"
+    for how in ("timed out", "cancelled"):
+        print(f"a {how} apply():")
+        read_calls()
+        if how == "timed out":
+            result = await mouse.apply("gaming", timeout=0.5)
+            stopped = not result.ok and "timed out" in result.error
+        else:
+            task = asyncio.create_task(mouse.apply("gaming"))
+            await asyncio.sleep(0.5)
+            task.cancel()
+            try:
+                await task
+                stopped = False
+            except asyncio.CancelledError:
+                stopped = True
+        calls = read_calls()
+        check("  stops", stopped)
+        check("  kills the hung ratbagctl", not get_running(tmp_dir / "bin"))
+        check(
+            "  never commits",
+            any(call.startswith("--nocommit") for call in calls)
+            and not any(
+                " set " in call and not call.startswith("--") for call in calls
+            ),
+        )
+        check(
+            "  keeps the last active profile",
+            active_fp.read_text().strip() == "default"
+            and mouse.last_active_profile == "default",
+        )
+        try:
+            released = await asyncio.wait_for(take_lock(), 1.0)
+        except asyncio.TimeoutError:
+            released = False
+        check("  releases locked()", released)
+    del os.environ["FAKE_RATBAGCTL_HANG"]
+
+    result = await mouse.apply("gaming")
+    check(
+        "the next apply() writes the whole profile",
+        result.ok
+        and read_device()["report_rate"] == 500
+        and active_fp.read_text().strip() == "gaming",
+    )
+    return
+
+
+def main():
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        bin_dir = tmp_dir / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "ratbagctl").symlink_to(FAKE_RATBAGCTL)
+        (tmp_dir / "run").mkdir()
+        log_fp = tmp_dir / "ratbagctl.log"
+        (tmp_dir / "mice.json").write_text(json.dumps({ALIAS: DEVICE}))
+        os.environ.update(
+            PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            LGMPM_BACKEND="ratbagctl",
+            LGMPM_MODELS_DIR=str(tmp_dir / "models"),
+            XDG_CACHE_HOME=str(tmp_dir / "cache"),
+            # an empty runtime dir, so the breaker starts closed
+            XDG_RUNTIME_DIR=str(tmp_dir / "run"),
+            FAKE_RATBAGCTL_STATE=str(tmp_dir / "mice.json"),
+            FAKE_RATBAGCTL_LOG=str(log_fp),
+        )
+        asyncio.run(run_checks(check, tmp_dir, log_fp))
+
+    check.exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# benchutil.py - what the bench scripts share: the fake mouse (and hidraw
+#   nodes) they run against, the profiles they start from, and their ok/FAIL checks
+#
+#   usage: from benchutil import REPO_DIR, Checks, seed_profiles
+#       also puts the repo on sys.path, so the bench can import lgmpm's modules
+
+import json
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_DIR))
+
+from fakebackend import FakeBackend  # noqa: E402
+
+# the fake mouse every bench runs against
+MODEL = "g403"
+ALIAS = "sleeping-puppy"
+# the HID_ID of a Logitech unifying receiver, as the kernel reports it
+LOGITECH_HID_ID = "0003:0000046D:0000C539"
+
+
+class Checks:
+    """
+    A class printing each check of a bench as ok or FAIL, called like a function,
+        ex. check = Checks(); check("a press writes once", applies == 1)
+
+        Attributes:
+            failures (list(str)): what each failed check checked
+    """
+
+    def __init__(self):
+        self.failures = []
+        return
+
+    def __call__(self, what, ok):
+        print(f"  {'ok  ' if ok else 'FAIL'} {what}")
+        if not ok:
+            self.failures.append(what)
+        return
+
+    def exit(self):
+        """
+        Prints the outcome of every check, and exits with 1 if any failed
+        """
+        print("OK" if not self.failures else "FAIL")
+        sys.exit(1 if self.failures else 0)
+
+
+def seed_profiles(models_dir, changes, active):
+    """
+    Saves profiles of the fake mouse's model straight to its json store
+        Params:
+            models_dir (Path): where the profiles are saved
+            changes (dict): each profile name mapped to the settings it doesn't
+                share with FakeBackend.DEFAULT_SETTINGS, ex. {"gaming": {"report_rate": 500}}
+            active (str): the name of the last active profile
+        Returns:
+            profiles (dict): each profile name mapped to its settings
+    """
+    profiles = {}
+    for name, settings in changes.items():
+        settings = dict(FakeBackend.DEFAULT_SETTINGS, **settings, name=name)
+        # copied, so the benches can change them without touching the defaults
+        profiles[name] = json.loads(json.dumps(settings))
+    models_dir.mkdir(parents=True, exist_ok=True)
+    (models_dir / f"{MODEL}.json").write_text(json.dumps({"profiles": profiles}))
+    (models_dir / f"{MODEL}.active").write_text(active + "\n")
+    return profiles
+
+
+class FakeHidraw:
+    """
+    A class keeping a fake /sys/class/hidraw and /dev, one entry per hidraw node
+    """
+
+    def __init__(self, root):
+        self.sysfs = Path(root) / "sys"
+        self.dev = Path(root) / "dev"
+        self.sysfs.mkdir(parents=True)
+        self.dev.mkdir()
+        self.next_idx = 0
+        return
+
+    def plug(self, hid_id=LOGITECH_HID_ID, interfaces=3, make_nodes=True):
+        """
+        Adds the hidraw nodes of one device, ex. one per interface of a receiver,
+            returns their names
+        """
+        names = []
+        for _ in range(interfaces):
+            name = f"hidraw{self.next_idx}"
+            self.next_idx += 1
+            (self.sysfs / name / "device").mkdir(parents=True)
+            (self.sysfs / name / "device" / "uevent").write_text(
+                f"DRIVER=logitech-djreceiver\nHID_ID={hid_id}\nHID_UNIQ=\n"
+            )
+            if make_nodes:
+                self.make_node(name)
+            names.append(name)
+        return names
+
+    def make_node(self, name):
+        """
+        Creates the device node, like udev does shortly after the uevent
+        """
+        (self.dev / name).touch()
+        return
+
+    def unplug(self, names):
+        """
+        Removes hidraw nodes
+        """
+        for name in names:
+            (self.sysfs / name / "device" / "uevent").unlink()
+            (self.sysfs / name / "device").rmdir()
+            (self.sysfs / name).rmdir()
+            (self.dev / name).unlink(missing_ok=True)
+        return
@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# commands.py - times each lgmpm.py command against bench/fake_ratbagctl.py,
+#   both end to end (a fresh 'python3 lgmpm.py ...') and in-process
+#       (lgmpm.run_command() on a loaded Mice), and can save the results as json
+#
+#   usage: python3 bench/commands.py [--latency-ms N] [--buttons N] [--leds N]
+#               [--resolutions N] [--devices N] [--fail REGEX] [--fail-rate F]
+#               [--repeat N] [--output FILE] [--compare OLD_FILE]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+FAKE_RATBAGCTL = Path(__file__).resolve().parent / "fake_ratbagctl.py"
+
+# the arguments of each command, see prepare() for the profiles they run on
+COMMANDS = {
+    "new": ["--new", "bench-{mode}-{run}"],
+    "update": ["--update", "bench"],
+    "active": ["--active", "bench"],
+    "cycle": ["--cycle"],
+    "show": ["--show", "bench"],
+    "list": ["--list"],
+}
+
+MODES = ("end-to-end", "in-process")
+
+
+class BenchEnv:
+    """
+    A class holding the temp dirs and environment of one benchmark
+
+        Attributes:
+            tmp_dir (Path): everything the benchmark writes goes in here
+            models_dir (Path): where lgmpm.py saves the profiles
+            log_fp (Path): the fake ratbagctl's call log, one line per call
+            env (dict): the environment lgmpm.py and the fake ratbagctl run in
+    """
+
+    def __init__(self, tmp_dir, args):
+        self.tmp_dir = Path(tmp_dir)
+        self.models_dir = self.tmp_dir / "models"
+        self.log_fp = self.tmp_dir / "ratbagctl.log"
+        bin_dir = self.tmp_dir / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "ratbagctl").symlink_to(FAKE_RATBAGCTL)
+        (self.tmp_dir / "run").mkdir()
+        self.env = dict(
+            os.environ,
+            PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            LGMPM_BACKEND="ratbagctl",
+            LGMPM_MODELS_DIR=str(self.models_dir),
+            XDG_CACHE_HOME=str(self.tmp_dir / "cache"),
+            # an empty runtime dir, so no real daemon answers the commands
+            XDG_RUNTIME_DIR=str(self.tmp_dir / "run"),
+            FAKE_RATBAGCTL_STATE=str(self.tmp_dir / "mice.json"),
+            FAKE_RATBAGCTL_LOG=str(self.log_fp),
+            FAKE_RATBAGCTL_LATENCY_MS=str(args.latency_ms),
+            FAKE_RATBAGCTL_DEVICES=str(args.devices),
+            FAKE_RATBAGCTL_RESOLUTIONS=str(args.resolutions),
+            FAKE_RATBAGCTL_BUTTONS=str(args.buttons),
+            FAKE_RATBAGCTL_LEDS=str(args.leds),
+            FAKE_RATBAGCTL_FAIL=args.fail or "",
+            FAKE_RATBAGCTL_FAIL_RATE=str(args.fail_rate),
+        )
+        return
+
+    def count_calls(self):
+        """
+        Returns how many times the fake ratbagctl has been run so far
+        """
+        try:
+            return len(self.log_fp.read_text().splitlines())
+        except FileNotFoundError:
+            return 0
+
+    def get_model_files(self):
+        """
+        Returns each file in the models dir mapped to its (mtime_ns, size)
+        """
+        files = {}
+        for fp in self.models_dir.glob("*"):
+            stat = fp.stat()
+            files[fp] = (stat.st_mtime_ns, stat.st_size)
+        return files
+
+    def get_bytes_written(self, before):
+        """
+        Returns the size of every model file (re)written since before
+            Params:
+                before (dict): as returned by get_model_files()
+        """
+        # profiles are always written to a temp file and renamed over
+        #   the old one, so a changed file was rewritten as a whole
+        return sum(
+            size
+            for fp, (mtime, size) in self.get_model_files().items()
+            if before.get(fp, (None, None))[0] != mtime
+        )
+
+
+def run_lgmpm(bench_env, argv):
+    """
+    Runs 'python3 lgmpm.py argv' in the benchmark environment
+        Params:
+            bench_env (BenchEnv): the environment to run in
+            argv (list(str)): the CLI arguments
+        Returns:
+            (returncode, peak_kb) (tuple): the exit status of lgmpm.py and its
+                max resident set size (including any ratbagctl it waited on)
+    """
+    proc = subprocess.Popen(
+        [sys.executable, str(REPO_DIR / "lgmpm.py")] + argv,
+        cwd=REPO_DIR,
+        env=bench_env.env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    _, status, rusage = os.wait4(proc.pid, 0)
+    return (os.waitstatus_to_exitcode(status), rusage.ru_maxrss)
+
+
+def run_in_process(argv):
+    """
+    Runs lgmpm.run_command() on freshly loaded mice, in this process
+        Params:
+            argv (list(str)): the CLI arguments
+        Returns:
+            (returncode, peak_kb) (tuple): 0, or 1 if the command raised, and
+                the peak memory python allocated while it ran
+    """
+    import backends
+    import identity
+    import lgmpm
+    from utils import mouse_arg_parser
+
+    # forget the mice and backend a previous run resolved
+    identity._identities = None
+    backends._backend = None
+    returncode = 0
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            lgmpm.run_command(mouse_arg_parser(argv))
+    except Exception:
+        returncode = 1
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (returncode, peak // 1024)
+
+
+def prepare():
+    """
+    Makes sure the 'bench' profile differs from what is on the mice, and
+        that --cycle moves to it next, so --active and --cycle always write
+    """
+    # only imported here, after the environment points at the fake ratbagctl
+    import backends
+    import identity
+    from mouse import Mice
+
+    identity._identities = None
+    backends._backend = None
+    with contextlib.redirect_stdout(io.StringIO()):
+        for mouse in Mice().mice:
+            if "bench" not in mouse.profiles:
+                mouse.add_new_profile("bench")
+            # change the polling rate, ex. --update just saved the mouse's settings
+            current_rate = mouse.get_current_profile().report_rate
+            mouse.profiles["bench"]["report_rate"] = (
+                500 if current_rate != 500 else 1000
+            )
+            profile_list = sorted(mouse.profiles)
+            mouse.last_active_profile = profile_list[profile_list.index("bench") - 1]
+            mouse.save_profile("bench")
+    return
+
+
+def bench_command(bench_env, name, mode, repeat):
+    """
+    Times one command a number of times
+        Params:
+            bench_env (BenchEnv): the environment to run in
+            name (str): the command, a key of COMMANDS
+            mode (str): 'end-to-end' or 'in-process'
+            repeat (int): how many times to run it
+        Returns:
+            (dict): the median wall time, ratbagctl calls, model bytes written,
+                and peak memory, plus every run's wall time and failed runs
+    """
+    walls = []
+    calls = []
+    bytes_written = []
+    peaks = []
+    failures = 0
+    for run in range(repeat):
+        prepare()
+        argv = [arg.format(mode=mode, run=run) for arg in COMMANDS[name]]
+        calls_before = bench_env.count_calls()
+        files_before = bench_env.get_model_files()
+        start = time.perf_counter()
+        if mode == "end-to-end":
+            returncode, peak_kb = run_lgmpm(bench_env, argv)
+        else:
+            returncode, peak_kb = run_in_process(argv)
+        walls.append(time.perf_counter() - start)
+        calls.append(bench_env.count_calls() - calls_before)
+        bytes_written.append(bench_env.get_bytes_written(files_before))
+        peaks.append(peak_kb)
+        failures += returncode != 0
+    return {
+        "command": name,
+        "mode": mode,
+        "wall_ms": statistics.median(walls) * 1000,
+        "wall_ms_runs": [wall * 1000 for wall in walls],
+        "subprocesses": statistics.median(calls),
+        "models_bytes_written": statistics.median(bytes_written),
+        "peak_memory_kb": max(peaks),
+        "failures": failures,
+    }
+
+
+def get_git_version():
+    """
+    Returns 'git describe' of the repo, or None outside of a git checkout
+    """
+    proc = subprocess.run(
+        ["git", "describe", "--always", "--dirty"],
+        cwd=REPO_DIR,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+    )
+    return proc.stdout.decode().strip() or None
+
+
+def print_comparison(results, old_fp):
+    """
+    Prints how the wall times changed since an older results file
+    """
+    old = json.loads(Path(old_fp).read_text())
+    old_walls = {(r["command"], r["mode"]): r["wall_ms"] for r in old["results"]}
+    print(f"\ncompared to {old_fp} ({old.get('version')}):")
+    for result in results:
+        old_wall = old_walls.get((result["command"], result["mode"]))
+        if old_wall:
+            change = (result["wall_ms"] - old_wall) / old_wall * 100
+            print(
+                f"  {result['command']:>7} {result['mode']:>10}:"
+                f" {old_wall:8.1f} -> {result['wall_ms']:8.1f} ms ({change:+.0f}%)"
+            )
+    return
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--latency-ms", type=int, default=0, help="ms each ratbagctl call takes"
+    )
+    parser.add_argument(
+        "--resolutions", type=int, default=5, help="resolution slots per mouse"
+    )
+    parser.add_argument("--buttons", type=int, default=6, help="buttons per mouse")
+    parser.add_argument("--leds", type=int, default=2, help="LEDs per mouse")
+    parser.add_argument(
+        "--devices", type=int, default=1, help="connected mice, up to 3"
+    )
+    parser.add_argument("--fail", help="fail every ratbagctl call matching this regex")
+    parser.add_argument(
+        "--fail-rate",
+        type=float,
+        default=0.0,
+        help="fraction of ratbagctl calls that fail",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command")
+    parser.add_argument(
+        "--commands", nargs="+", choices=COMMANDS, default=list(COMMANDS)
+    )
+    parser.add_argument("--output", help="a file to save the results to")
+    parser.add_argument("--compare", help="an older results file to compare to")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bench_env = BenchEnv(tmp_dir, args)
+        # the in-process runs and prepare() use this process's environment
+        os.environ.update(bench_env.env)
+        sys.path.insert(0, str(REPO_DIR))
+        for name in args.commands:
+            for mode in MODES:
+                result = bench_command(bench_env, name, mode, args.repeat)
+                results.append(result)
+                print(
+                    f"{name:>7} {mode:>10}: {result['wall_ms']:8.1f} ms"
+                    f"  {result['subprocesses']:4g} ratbagctl"
+                    f"  {result['models_bytes_written']:7g} B written"
+                    f"  {result['peak_memory_kb']:6d} kB peak"
+                    + (f"  {result['failures']} failed" if result["failures"] else "")
+                )
+
+    report = {
+        "version": get_git_version(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "python": platform.python_version(),
+        "config": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "compare")
+        },
+        # the fake ratbagctl is a python script, so end-to-end peaks include it
+        "peak_memory_note": "end-to-end: max RSS in kB, in-process: tracemalloc peak in kB",
+        "results": results,
+    }
+    # only saved when asked for, so a run never leaves files in the cwd
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2) + "\n")
+        print(f"saved to {args.output}")
+    if args.compare:
+        print_comparison(results, args.compare)
+    return
+
+
+if __name__ == "__main__":
+    main()
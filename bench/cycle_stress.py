@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+# cycle_stress.py - fires many 'lgmpm.py --cycle' presses at once against a
+#   fake mouse, and checks that none of them were lost along the way
+#
+#   usage: python3 bench/cycle_stress.py [--presses N] [--profiles K]
+#       exits with 1 if the mouse or the last active profile end up wrong
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchutil import ALIAS, MODEL, REPO_DIR, FakeBackend, seed_profiles
+from locks import FileLock, read_counter
+
+
+def get_led_changes(count):
+    """
+    Returns the settings of profiles that only differ by the color of their
+        first LED, see benchutil.seed_profiles()
+    """
+    leds = FakeBackend.DEFAULT_SETTINGS["leds"]
+    changes = {}
+    for idx in range(count):
+        first_led = dict(leds[0], color=f"{idx * 16:02x}00ff")
+        changes[f"profile{idx:02d}"] = {"leds": [first_led] + leds[1:]}
+    return changes
+
+
+def run_presses(presses, profile_ct, hold=False):
+    """
+    Fires the presses at once, optionally while another process holds the
+        store lock until all of them were counted, ex. an '--active' or
+            a '--drift' poll reading the mouse
+        Returns:
+            (bool): True if every press was applied
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        models_dir = tmp_dir / "models"
+        state_fp = tmp_dir / "fake_mouse.json"
+        changes = get_led_changes(profile_ct)
+        profiles = seed_profiles(models_dir, changes, active=sorted(changes)[0])
+        env = dict(
+            os.environ,
+            LGMPM_BACKEND="fake",
+            LGMPM_FAKE_STATE=str(state_fp),
+            LGMPM_MODELS_DIR=str(models_dir),
+            LGMPM_IDENTITY_TTL="0",
+            XDG_CACHE_HOME=str(tmp_dir / "cache"),
+            # an empty runtime dir, so the presses can't reach a real daemon
+            XDG_RUNTIME_DIR=str(tmp_dir / "run"),
+        )
+        (tmp_dir / "run").mkdir()
+
+        lock = FileLock(models_dir / f"{MODEL}.lock")
+        if hold:
+            lock.acquire()
+        start = time.perf_counter()
+        procs = [
+            subprocess.Popen(
+                [sys.executable, "lgmpm.py", "--cycle"],
+                cwd=REPO_DIR,
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            for _ in range(presses)
+        ]
+        if hold:
+            # hold the lock until every press was counted
+            cycle_path = models_dir / f"{MODEL}.cycle"
+            while (
+                read_counter(cycle_path) < presses and time.perf_counter() - start < 30
+            ):
+                time.sleep(0.05)
+            lock.release()
+        outputs = [proc.communicate()[0].decode() for proc in procs]
+        elapsed = time.perf_counter() - start
+
+        profile_list = sorted(profiles)
+        expected = profile_list[presses % len(profile_list)]
+        last_active = (models_dir / f"{MODEL}.active").read_text().strip()
+        device = json.loads(state_fp.read_text())[ALIAS]
+        queued = sum("press queued" in output for output in outputs)
+        pending = (models_dir / f"{MODEL}.cycle").read_text().strip()
+
+    held_str = " while the store lock is held" if hold else ""
+    print(f"{presses} presses over {profile_ct} profiles{held_str} in {elapsed:.2f} s")
+    print(f"  {device['applies']} writes to the mouse, {queued} presses queued")
+    print(f"  last active: {last_active} (expected {expected})")
+    failed = [proc for proc in procs if proc.returncode != 0]
+    ok = (
+        not failed
+        and last_active == expected
+        and device["leds"] == profiles[expected]["leds"]
+        and pending in ("", "0")
+    )
+    if failed:
+        print(f"  {len(failed)} presses exited with an error")
+    if device["leds"] != profiles[expected]["leds"]:
+        print("  the mouse does not match the last active profile")
+    if pending not in ("", "0"):
+        print(f"  {pending} presses were left in the counter")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--presses", type=int, default=20)
+    parser.add_argument("--profiles", type=int, default=3)
+    args = parser.parse_args()
+
+    ok = run_presses(args.presses, args.profiles)
+    ok = run_presses(args.presses, args.profiles, hold=True) and ok
+    print("OK" if ok else "FAIL")
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+# drift_sim.py - runs the --drift watcher against a fake mouse whose settings
+#   are changed behind its back, like Piper or an onboard profile button would,
+#       and checks that each policy acts on a drift once, and only once confirmed
+#
+#   usage: python3 bench/drift_sim.py
+#       exits with 1 if a drift was missed, acted on too often, or a poll
+#           costs more CPU than the default budget allows at the default interval
+
+import contextlib
+import io
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from benchutil import ALIAS, MODEL, Checks, FakeBackend, seed_profiles
+
+# polls timed to measure the CPU cost of one
+COST_POLLS = 50
+
+
+def main():
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        models_dir = tmp_dir / "models"
+        os.environ.update(
+            LGMPM_MODELS_DIR=str(models_dir),
+            XDG_CACHE_HOME=str(tmp_dir / "cache"),
+        )
+        seed_profiles(
+            models_dir,
+            {"default": {"report_rate": 1000}, "gaming": {"report_rate": 500}},
+            active="gaming",
+        )
+
+        # only imported here, after the environment points at the temp dirs
+        import backends
+        from drift import DRIFT_CPU_BUDGET, DRIFT_INTERVAL_S, DriftWatcher
+        from locks import FileLock
+        from mouse import MiceCache
+        from store import get_store
+
+        backend = FakeBackend({ALIAS: {"model": MODEL, "report_rate": 500}})
+        backends.set_backend(backend)
+        cache = MiceCache()
+
+        def applies():
+            return backend.devices[ALIAS]["applies"]
+
+        def rate():
+            return backend.devices[ALIAS]["report_rate"]
+
+        def set_rate(report_rate):
+            # ex. Piper, or the profile button under the wheel
+            backend.devices[ALIAS]["report_rate"] = report_rate
+            return
+
+        def poll(watcher, count=1):
+            handled = []
+            with contextlib.redirect_stdout(io.StringIO()):
+                for _ in range(count):
+                    handled += watcher.poll()
+            return handled
+
+        def stored():
+            return get_store(MODEL).load()
+
+        print("log policy:")
+        watcher = DriftWatcher(cache.get, policy="log")
+        check(
+            "a mouse running its last active profile is left alone", not poll(watcher)
+        )
+        set_rate(1000)
+        check("a drift isn't acted on after a single poll", not poll(watcher))
+        check("  but is once the next poll confirms it", poll(watcher) == [ALIAS])
+        check("  and never again while it stays", not poll(watcher, 3))
+        check("  with nothing written", applies() == 0 and rate() == 1000)
+        check("  or stored", stored()[0] == "gaming")
+
+        print("restore policy:")
+        set_rate(500)
+        watcher = DriftWatcher(cache.get, policy="restore")
+        set_rate(250)
+        poll(watcher)
+        set_rate(500)
+        check(
+            "a drift that is undone before it is confirmed is ignored",
+            not poll(watcher),
+        )
+        set_rate(250)
+        lock = FileLock(cache.get().mice[0].store.lock_path)
+        lock.acquire()
+        check(
+            "a mouse whose profiles are being written isn't read", not poll(watcher, 3)
+        )
+        check("  so a half-written mouse never counts as a drift", watcher.seen == {})
+        lock.release()
+        snapshot = backend.snapshot
+        writable = []
+
+        def snapshot_while_writing(alias):
+            # ex. a --cycle press that comes in while the poll reads the mouse
+            writer = FileLock(lock.path)
+            writable.append(writer.acquire(blocking=False))
+            writer.release()
+            return snapshot(alias)
+
+        backend.snapshot = snapshot_while_writing
+        poll(watcher)
+        backend.snapshot = snapshot
+        check("  and a poll reading the mouse doesn't hold it", writable == [True])
+        check("a confirmed drift is restored", poll(watcher) == [ALIAS])
+        check("  with a single write of the last active profile", applies() == 1)
+        check("  back to its settings", rate() == 500)
+        check("  and then left alone", not poll(watcher, 3) and applies() == 1)
+
+        print("record policy:")
+        watcher = DriftWatcher(cache.get, policy="record")
+        set_rate(1000)
+        poll(watcher, 2)
+        check(
+            "settings of a stored profile make it the last active",
+            stored()[0] == "default",
+        )
+        check("  without a new profile", sorted(stored()[1]) == ["default", "gaming"])
+        check("  and without a write", applies() == 1)
+        check("  after which it is no longer a drift", not poll(watcher, 3))
+        set_rate(125)
+        poll(watcher, 2)
+        last_active_profile, profiles = stored()
+        check("new settings are saved as a new profile", len(profiles) == 3)
+        check("  named after the time", last_active_profile.startswith("drift-"))
+        check(
+            "  with the settings of the mouse",
+            profiles.get(last_active_profile, {}).get("report_rate") == 125,
+        )
+        check("  and it is no longer a drift", not poll(watcher, 3))
+
+        print("CPU budget:")
+        watcher = DriftWatcher(
+            cache.get, interval=DRIFT_INTERVAL_S, cpu_budget=DRIFT_CPU_BUDGET
+        )
+        check("the interval is kept while a poll is cheap", watcher.get_wait() == 5.0)
+        watcher.poll_cpu = 0.2
+        check(
+            "  and stretched to stay within budget when it isn't",
+            watcher.get_wait() == 0.2 / DRIFT_CPU_BUDGET,
+        )
+        start = time.process_time()
+        poll(watcher, COST_POLLS)
+        cost = (time.process_time() - start) / COST_POLLS
+        print(
+            f"  a poll costs {cost * 1000:.2f} ms of CPU in-process, the budget allows"
+            f" {DRIFT_INTERVAL_S * DRIFT_CPU_BUDGET * 1000:.0f} ms"
+        )
+        check(
+            "  which fits the default budget",
+            cost < DRIFT_INTERVAL_S * DRIFT_CPU_BUDGET,
+        )
+
+    check.exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# export_scale.py - times 'lgmpm.py --export' over more and more stored
+#   profiles and model files, and checks that its peak memory stays flat
+#
+#   usage: python3 bench/export_scale.py [--profiles N]
+#       exits with 1 if the peak memory grows with the number of profiles
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+sys.path.insert(0, str(REPO_DIR))
+
+from fakebackend import FakeBackend  # noqa: E402
+
+# how much the peak may grow from the smallest to the largest run
+MAX_GROWTH = 1.5
+
+
+def seed_models(models_dir, model_ct, profile_ct, store_name):
+    """
+    Saves profile_ct profiles for each of model_ct models
+    """
+    # only imported here, after the environment points at the temp dir
+    from store import get_store
+
+    for model_idx in range(model_ct):
+        profiles = {}
+        for idx in range(profile_ct):
+            settings = json.loads(json.dumps(FakeBackend.DEFAULT_SETTINGS))
+            settings["name"] = f"profile{idx:05d}"
+            settings["leds"][0]["color"] = f"{idx % 256:02x}00ff"
+            profiles[settings["name"]] = settings
+        model = f"g{model_idx:03d}"
+        if store_name == "json":
+            # written directly, the plans and index don't matter here
+            models_dir.mkdir(parents=True, exist_ok=True)
+            (models_dir / f"{model}.json").write_text(
+                json.dumps({"profiles": profiles})
+            )
+            (models_dir / f"{model}.active").write_text("profile00000\n")
+        else:
+            store = get_store(model)
+            store.save_profiles(profiles, changed=profiles)
+            store.save_active("profile00000")
+    return
+
+
+def measure(fmt):
+    """
+    Exports every stored profile to nowhere
+        Returns:
+            (tuple): the profiles exported, seconds taken, and peak kB allocated
+    """
+    from export import export_profiles
+
+    out = io.StringIO()
+    # a StringIO would keep the whole export, so only keep its size
+    out.write = lambda text: len(text)
+    # warm up first, so one-time costs (ex. imports) aren't counted
+    export_profiles(fmt, out)
+    tracemalloc.start()
+    start = time.perf_counter()
+    count = export_profiles(fmt, out)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (count, elapsed, peak // 1024)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--profiles", type=int, default=2000, help="profiles of the largest run"
+    )
+    args = parser.parse_args()
+
+    failed = False
+    # json files are parsed whole, so only more model files must stay flat,
+    #   while sqlite reads one row at a time, so more profiles must too
+    runs = (
+        ("json", [(1, 50), (10, 50), (100, 50)]),
+        ("sqlite", [(1, args.profiles // 10), (1, args.profiles)]),
+    )
+    for store_name, sizes in runs:
+        print(f"{store_name} store:")
+        peaks = {"json": [], "csv": []}
+        for model_ct, profile_ct in sizes:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                os.environ.update(
+                    LGMPM_MODELS_DIR=str(Path(tmp_dir) / "models"),
+                    LGMPM_STORE=store_name,
+                )
+                seed_models(Path(tmp_dir) / "models", model_ct, profile_ct, store_name)
+                for fmt in ("json", "csv"):
+                    count, elapsed, peak = measure(fmt)
+                    peaks[fmt].append(peak)
+                    print(
+                        f"  {model_ct:>3} model(s) x {profile_ct:>5} profiles, {fmt:>4}:"
+                        f" {count:>5} exported in {elapsed * 1000:7.1f} ms,"
+                        f" {peak:>5} kB peak"
+                    )
+        for fmt, fmt_peaks in peaks.items():
+            if fmt_peaks[-1] > fmt_peaks[0] * MAX_GROWTH:
+                print(
+                    f"  FAIL the {fmt} export's peak memory grew from"
+                    f" {fmt_peaks[0]} kB to {fmt_peaks[-1]} kB"
+                )
+                failed = True
+    print("OK" if not failed else "FAIL")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
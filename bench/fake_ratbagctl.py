@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# fake_ratbagctl.py - a stand-in for the ratbagctl CLI, so lgmpm.py can be
+#   run (and timed) without a mouse or ratbagd
+#
+#   usage: put it on PATH as 'ratbagctl', ex. see bench/commands.py
+#
+#   configured with environment variables:
+#       FAKE_RATBAGCTL_STATE        the json file the fake mice are kept in
+#       FAKE_RATBAGCTL_LOG          append every call's arguments to this file
+#       FAKE_RATBAGCTL_LATENCY_MS   sleep this long on every call (default 0)
+#       FAKE_RATBAGCTL_DEVICES      how many mice are connected (default 1)
+#       FAKE_RATBAGCTL_RESOLUTIONS  resolution slots of a new fake mouse (default 5)
+#       FAKE_RATBAGCTL_BUTTONS      buttons of a new fake mouse (default 6)
+#       FAKE_RATBAGCTL_LEDS         LEDs of a new fake mouse (default 2)
+#       FAKE_RATBAGCTL_FAIL         fail every call whose arguments match this regex
+#       FAKE_RATBAGCTL_FAIL_RATE    fail this fraction of calls at random (default 0)
+#       FAKE_RATBAGCTL_FLAKY        fail the first N calls like a busy ratbagd,
+#                                       with a D-Bus NoReply error (default 0)
+#       FAKE_RATBAGCTL_HANG         hang on every call whose arguments match this
+#                                       regex, like ratbagd after a resume
+#       FAKE_RATBAGCTL_HANG_S       how long a hung call sleeps (default 3600)
+
+import fcntl
+import json
+import os
+import random
+import re
+import sys
+import time
+from pathlib import Path
+
+DEVICES = (
+    ("sleeping-puppy", "Logitech G403 Prodigy Gaming Mouse"),
+    ("dancing-kitten", "Logitech G502 HERO Gaming Mouse"),
+    ("singing-gundi", "Logitech G703 Wired/Wireless Gaming Mouse"),
+)
+
+LED_MODES = ("breathing", "on", "cycle", "off")
+
+
+def get_int_env(name, default):
+    """
+    Returns an integer environment variable, or default if it isn't set
+    """
+    return int(os.environ.get(name) or default)
+
+
+def new_device(name):
+    """
+    Builds the settings of a fake mouse, sized by the FAKE_RATBAGCTL_* counts
+        Params:
+            name (str): the 'long form' name of the mouse
+        Returns:
+            (dict): the name, report_rate, resolutions, default_resolution,
+                buttons, and leds of the mouse
+    """
+    res_ct = get_int_env("FAKE_RATBAGCTL_RESOLUTIONS", 5)
+    btn_ct = get_int_env("FAKE_RATBAGCTL_BUTTONS", 6)
+    led_ct = get_int_env("FAKE_RATBAGCTL_LEDS", 2)
+    buttons = [f"button {idx + 1}" for idx in range(btn_ct)]
+    if buttons:
+        buttons[-1] = "resolution-cycle-up"
+    leds = []
+    for idx in range(led_ct):
+        mode = LED_MODES[idx % 2]
+        leds.append(
+            {
+                "mode": mode,
+                "color": f"{idx * 32 % 256:02x}00ff",
+                "duration": 10000 if mode == "breathing" else None,
+                "brightness": 255,
+            }
+        )
+    return {
+        "name": name,
+        "report_rate": 1000,
+        "resolutions": [400 * 2**idx for idx in range(res_ct)],
+        "default_resolution": 1 if res_ct > 1 else 0,
+        "buttons": buttons,
+        "leds": leds,
+    }
+
+
+def format_button(idx, btn):
+    """
+    Formats a button mapping like 'ratbagctl {alias} button N get'
+    """
+    if btn.startswith(("KEY_", "+KEY_", "-KEY_", "t")):
+        macro = btn.replace("+KEY_", "↓").replace("-KEY_", "↑").replace("KEY_", "↕")
+        return f"Button: {idx} is mapped to macro '{macro}'"
+    return f"Button: {idx} is mapped to '{btn}'"
+
+
+def format_led(idx, led):
+    """
+    Formats an LED like 'ratbagctl {alias} led N get'
+    """
+    led_str = f"LED: {idx}, depth: rgb, mode: {led['mode']}"
+    if led["mode"] in ("on", "breathing"):
+        led_str += f", color: {led['color']}"
+    if led["mode"] in ("cycle", "breathing"):
+        led_str += f", duration: {led['duration']}, brightness: {led['brightness']}"
+    return led_str
+
+
+def format_resolution(idx, dpi, device):
+    """
+    Formats a resolution like 'ratbagctl {alias} resolution N get'
+    """
+    if not dpi:
+        return f"{idx}: 0dpi (disabled)"
+    res_str = f"{idx}: {dpi}dpi"
+    if idx == device["default_resolution"]:
+        res_str += " (default)"
+    return res_str
+
+
+def format_info(alias, device):
+    """
+    Formats everything like 'ratbagctl {alias} info', with a second
+        (inactive) onboard profile as real mice have
+    """
+    lines = [
+        f"{alias} - {device['name']}",
+        "             Model: usb:046d:c083:0",
+        f" Number of Buttons: {len(device['buttons'])}",
+        f"    Number of Leds: {len(device['leds'])}",
+        "Number of Profiles: 2",
+        "Profile 0: (active)",
+        "  Name: n/a",
+        f"  Report Rate: {device['report_rate']}Hz",
+        "  Resolutions:",
+    ]
+    for idx, dpi in enumerate(device["resolutions"]):
+        lines.append("    " + format_resolution(idx, dpi, device))
+    for idx, btn in enumerate(device["buttons"]):
+        lines.append("  " + format_button(idx, btn))
+    for idx, led in enumerate(device["leds"]):
+        lines.append("  " + format_led(idx, led))
+    lines += [
+        "Profile 1:",
+        "  Name: n/a",
+        "  Report Rate: 500Hz",
+        "  Resolutions:",
+        "    0: 100dpi (default)",
+        "  Button: 0 is mapped to 'button 9'",
+    ]
+    return "\n".join(lines)
+
+
+def run(args, devices):
+    """
+    Runs one ratbagctl command against the fake mice
+        Params:
+            args (list(str)): the arguments, without '--nocommit'
+            devices (dict): each alias mapped to its settings, changed in place
+        Returns:
+            (str): what ratbagctl would print
+    """
+    if args == ["list"]:
+        return "\n".join(
+            f"{alias}:       {device['name']}" for alias, device in devices.items()
+        )
+    alias, cmd = args[0], args[1:]
+    if alias not in devices:
+        raise ValueError(f"Unable to find device {alias}")
+    device = devices[alias]
+    if cmd == ["info"]:
+        return format_info(alias, device)
+    if cmd == ["name"]:
+        return device["name"]
+    if cmd == ["rate", "get"]:
+        return str(device["report_rate"])
+    if cmd[:2] == ["rate", "set"]:
+        device["report_rate"] = int(cmd[2])
+        return ""
+    if cmd == ["resolution", "default", "get"]:
+        return str(device["default_resolution"])
+    if cmd[:3] == ["resolution", "default", "set"]:
+        device["default_resolution"] = int(cmd[3])
+        return ""
+    if cmd[:1] == ["resolution"] and cmd[2:3] == ["get"]:
+        idx = int(cmd[1])
+        return format_resolution(idx, device["resolutions"][idx], device)
+    if cmd[:1] == ["resolution"] and cmd[2:4] == ["dpi", "set"]:
+        device["resolutions"][int(cmd[1])] = int(cmd[4])
+        return ""
+    if cmd[:2] == ["dpi", "set"]:
+        device["resolutions"][device["default_resolution"]] = int(cmd[2])
+        return ""
+    if cmd == ["button", "count"]:
+        return str(len(device["buttons"]))
+    if cmd[:1] == ["button"] and cmd[2:3] == ["get"]:
+        idx = int(cmd[1])
+        return format_button(idx, device["buttons"][idx])
+    if cmd[:1] == ["button"] and cmd[2:4] == ["action", "set"]:
+        action = cmd[4:]
+        if action[:1] in (["macro"], ["special"]):
+            action = action[1:]
+        device["buttons"][int(cmd[1])] = " ".join(action)
+        return ""
+    if cmd[:1] == ["led"] and cmd[2:3] == ["get"]:
+        idx = int(cmd[1])
+        return format_led(idx, device["leds"][idx])
+    if cmd[:1] == ["led"] and cmd[2:3] == ["set"]:
+        led = device["leds"][int(cmd[1])]
+        for key, value in zip(cmd[3::2], cmd[4::2]):
+            led[key] = int(value) if key in ("duration", "brightness") else value
+        return ""
+    raise ValueError(f"Unknown command '{' '.join(cmd)}'")
+
+
+def main():
+    args = sys.argv[1:]
+    log_fp = os.environ.get("FAKE_RATBAGCTL_LOG")
+    if log_fp:
+        with open(log_fp, "a") as log_file:
+            log_file.write(" ".join(args) + "\n")
+    time.sleep(get_int_env("FAKE_RATBAGCTL_LATENCY_MS", 0) / 1000)
+
+    hang_re = os.environ.get("FAKE_RATBAGCTL_HANG")
+    if hang_re and re.search(hang_re, " ".join(args)):
+        time.sleep(get_int_env("FAKE_RATBAGCTL_HANG_S", 3600))
+
+    state_fp = Path(os.environ.get("FAKE_RATBAGCTL_STATE", "/tmp/fake_ratbagctl.json"))
+    flaky_ct = get_int_env("FAKE_RATBAGCTL_FLAKY", 0)
+    if flaky_ct:
+        # the calls failed so far are counted next to the state file
+        with open(state_fp.with_name(state_fp.name + ".flaky"), "a+") as flaky_file:
+            fcntl.flock(flaky_file, fcntl.LOCK_EX)
+            flaky_file.seek(0)
+            failed_ct = len(flaky_file.read())
+            if failed_ct < flaky_ct:
+                flaky_file.write(".")
+                print(
+                    "GDBus.Error:org.freedesktop.DBus.Error.NoReply:"
+                    " Did not receive a reply",
+                    file=sys.stderr,
+                )
+                sys.exit(1)
+
+    fail_re = os.environ.get("FAKE_RATBAGCTL_FAIL")
+    fail_rate = float(os.environ.get("FAKE_RATBAGCTL_FAIL_RATE") or 0)
+    if (fail_re and re.search(fail_re, " ".join(args))) or random.random() < fail_rate:
+        print(f"Error: injected failure of '{' '.join(args)}'", file=sys.stderr)
+        sys.exit(1)
+
+    # NOTE changes are written straight away, --nocommit only matters to a real mouse
+    if args[:1] == ["--nocommit"]:
+        args = args[1:]
+
+    with open(state_fp.with_name(state_fp.name + ".lock"), "w") as lock_file:
+        # lgmpm.py writes to several mice at once
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            devices = json.loads(state_fp.read_text())
+        except (OSError, ValueError):
+            device_ct = get_int_env("FAKE_RATBAGCTL_DEVICES", 1)
+            devices = {alias: new_device(name) for alias, name in DEVICES[:device_ct]}
+        try:
+            output = run(args, devices)
+        except (ValueError, IndexError, KeyError) as e:
+            print(f"Error: {e}", file=sys.stderr)
+            sys.exit(1)
+        state_fp.write_text(json.dumps(devices))
+    if output:
+        print(output)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+#!/usr/bin/env python3
+# fake_ratbagd.py - a stand-in for ratbagd on the D-Bus session bus, so the
+#   dbus backend can be exercised without a mouse or root access
+#
+#   usage: python3 bench/fake_ratbagd.py &
+#          LGMPM_BACKEND=dbus LGMPM_DBUS_BUS=session python3 lgmpm.py --show
+#
+#   needs PyGObject ('pip install PyGObject'), like the dbus backend itself
+
+import sys
+from pathlib import Path
+
+from gi.repository import Gio, GLib
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from dbusbackend import DBusBackend  # noqa: E402
+from fakebackend import FakeBackend  # noqa: E402
+
+SERVICE = DBusBackend.SERVICE
+ROOT = DBusBackend.MANAGER_PATH
+
+INTROSPECTION_XML = f"""
+<node>
+  <interface name="{SERVICE}.Manager">
+    <property name="APIVersion" type="i" access="read"/>
+    <property name="Devices" type="ao" access="read"/>
+  </interface>
+  <interface name="{SERVICE}.Device">
+    <property name="Model" type="s" access="read"/>
+    <property name="Name" type="s" access="read"/>
+    <property name="Profiles" type="ao" access="read"/>
+    <method name="Commit"/>
+  </interface>
+  <interface name="{SERVICE}.Profile">
+    <property name="Index" type="u" access="read"/>
+    <property name="IsActive" type="b" access="read"/>
+    <property name="ReportRate" type="u" access="readwrite"/>
+    <property name="Resolutions" type="ao" access="read"/>
+    <property name="Buttons" type="ao" access="read"/>
+    <property name="Leds" type="ao" access="read"/>
+  </interface>
+  <interface name="{SERVICE}.Resolution">
+    <property name="Index" type="u" access="read"/>
+    <property name="IsActive" type="b" access="read"/>
+    <property name="IsDefault" type="b" access="read"/>
+    <property name="Resolution" type="v" access="readwrite"/>
+    <method name="SetActive"/>
+    <method name="SetDefault"/>
+  </interface>
+  <interface name="{SERVICE}.Button">
+    <property name="Index" type="u" access="read"/>
+    <property name="Mapping" type="(uv)" access="readwrite"/>
+  </interface>
+  <interface name="{SERVICE}.Led">
+    <property name="Index" type="u" access="read"/>
+    <property name="Mode" type="u" access="readwrite"/>
+    <property name="Color" type="(uuu)" access="readwrite"/>
+    <property name="EffectDuration" type="u" access="readwrite"/>
+    <property name="Brightness" type="u" access="readwrite"/>
+  </interface>
+</node>
+"""
+
+
+class FakeRatbagd:
+    """
+    A class holding the objects of one fake G403, as ratbagd would expose them
+
+        Attributes:
+            objects (dict): each object path mapped to (interface, properties)
+            commits (int): how many times Device.Commit() was called
+    """
+
+    def __init__(self, alias="hidraw0"):
+        settings = FakeBackend.DEFAULT_SETTINGS
+        device = f"{ROOT}/device/{alias}"
+        profile = f"{device}/p0"
+        self.objects = {
+            ROOT: ("Manager", {"APIVersion": ("i", 1), "Devices": ("ao", [device])}),
+        }
+        res_paths = []
+        for idx, dpi in enumerate(settings["resolutions"]):
+            path = f"{profile}/r{idx}"
+            res_paths.append(path)
+            is_default = idx == settings["default_resolution"]
+            self.objects[path] = (
+                "Resolution",
+                {
+                    "Index": ("u", idx),
+                    "IsActive": ("b", is_default),
+                    "IsDefault": ("b", is_default),
+                    "Resolution": ("v", GLib.Variant("u", dpi)),
+                },
+            )
+        btn_paths = []
+        for idx, btn in enumerate(settings["buttons"]):
+            path = f"{profile}/b{idx}"
+            btn_paths.append(path)
+            if btn.startswith("button"):
+                mapping = (DBusBackend.ACTION_BUTTON, int(btn.split()[1]))
+            else:
+                special = DBusBackend.SPECIAL_BASE + DBusBackend.SPECIALS.index(btn)
+                mapping = (DBusBackend.ACTION_SPECIAL, special)
+            self.objects[path] = (
+                "Button",
+                {
+                    "Index": ("u", idx),
+                    "Mapping": ("(uv)", (mapping[0], GLib.Variant("u", mapping[1]))),
+                },
+            )
+        led_paths = []
+        for idx, led in enumerate(settings["leds"]):
+            path = f"{profile}/l{idx}"
+            led_paths.append(path)
+            rgb = tuple(int(led["color"][i : i + 2], 16) for i in (0, 2, 4))
+            self.objects[path] = (
+                "Led",
+                {
+                    "Index": ("u", idx),
+                    "Mode": ("u", DBusBackend.LED_MODES.index(led["mode"])),
+                    "Color": ("(uuu)", rgb),
+                    "EffectDuration": ("u", led["duration"] or 0),
+                    "Brightness": ("u", led["brightness"]),
+                },
+            )
+        self.objects[profile] = (
+            "Profile",
+            {
+                "Index": ("u", 0),
+                "IsActive": ("b", True),
+                "ReportRate": ("u", settings["report_rate"]),
+                "Resolutions": ("ao", res_paths),
+                "Buttons": ("ao", btn_paths),
+                "Leds": ("ao", led_paths),
+            },
+        )
+        self.objects[device] = (
+            "Device",
+            {
+                "Model": ("s", "usb:046d:c083:0"),
+                "Name": ("s", "Logitech G403 Prodigy Gaming Mouse"),
+                "Profiles": ("ao", [profile]),
+            },
+        )
+        self.commits = 0
+        return
+
+    def get_property(self, conn, sender, path, iface, prop):
+        """
+        Answers a property read, as a GLib.Variant
+        """
+        signature, value = self.objects[path][1][prop]
+        if signature == "v":
+            return GLib.Variant("v", value)
+        return GLib.Variant(signature, value)
+
+    def set_property(self, conn, sender, path, iface, prop, value):
+        """
+        Stores a property write, keeping the property's D-Bus signature
+        """
+        props = self.objects[path][1]
+        signature = props[prop][0]
+        if signature == "v":
+            props[prop] = (signature, value.get_variant())
+        elif signature == "(uv)":
+            action_type, inner = value.get_child_value(0), value.get_child_value(1)
+            props[prop] = (signature, (action_type.get_uint32(), inner.get_variant()))
+        else:
+            props[prop] = (signature, value.unpack())
+        return True
+
+    def method_call(self, conn, sender, path, iface, method, params, invocation):
+        """
+        Handles Device.Commit() and Resolution.SetDefault()/SetActive()
+        """
+        kind, props = self.objects[path]
+        if method == "Commit":
+            self.commits += 1
+        elif method in ("SetDefault", "SetActive"):
+            flag = "IsDefault" if method == "SetDefault" else "IsActive"
+            # only one resolution of the profile can be the default/active one
+            parent = path.rsplit("/", 1)[0]
+            for other_path, (other_kind, other_props) in self.objects.items():
+                if other_kind == "Resolution" and other_path.startswith(parent + "/"):
+                    other_props[flag] = ("b", other_path == path)
+        invocation.return_value(None)
+        return
+
+    def register(self, conn):
+        """
+        Exports every object on the connection
+        """
+        node_info = Gio.DBusNodeInfo.new_for_xml(INTROSPECTION_XML)
+        for path, (kind, _) in self.objects.items():
+            iface_info = node_info.lookup_interface(f"{SERVICE}.{kind}")
+            conn.register_object(
+                path,
+                iface_info,
+                self.method_call,
+                self.get_property,
+                self.set_property,
+            )
+        return
+
+
+def main():
+    fake = FakeRatbagd()
+    loop = GLib.MainLoop()
+
+    def on_bus_acquired(conn, name):
+        fake.register(conn)
+
+    def on_name_lost(conn, name):
+        print(f"Could not own {name} on the session bus")
+        loop.quit()
+
+    Gio.bus_own_name(
+        Gio.BusType.SESSION,
+        SERVICE,
+        Gio.BusNameOwnerFlags.NONE,
+        on_bus_acquired,
+        None,
+        on_name_lost,
+    )
+    print(f"fake ratbagd serving {SERVICE} on the session bus")
+    try:
+        loop.run()
+    except KeyboardInterrupt:
+        pass
+    return
+
+
+if __name__ == "__main__":
+    main()
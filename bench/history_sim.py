@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# history_sim.py - saves many small edits of a profile, like tuning one DPI
+#   or LED at a time, and checks that every version can be rebuilt, that the
+#       history stays small, and that a rollback writes the mouse once
+#
+#   usage: python3 bench/history_sim.py [--versions N]
+#       exits with 1 if a version is rebuilt wrong, the history is too large,
+#           or a rollback doesn't write its version in a single write
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from benchutil import ALIAS, MODEL, Checks, FakeBackend
+
+# how large the history may be, compared to a full copy of every version
+MAX_SIZE_RATIO = 0.3
+# the profiles and versions of each of them in a long history
+LONG_PROFILES = 300
+LONG_VERSIONS = 41
+# how long saving one profile may take with a long history
+MAX_LONG_SAVE_MS = 50
+
+
+def edit(settings, rng):
+    """
+    Changes one setting, the way most tuning goes
+    """
+    edited = json.loads(json.dumps(settings))
+    # picked again until something changed, so every edit is a new version
+    while edited == settings:
+        choice = rng.randrange(4)
+        if choice == 0:
+            idx = rng.randrange(len(edited["resolutions"]) - 1)
+            edited["resolutions"][idx] = rng.randrange(4, 64) * 100
+        elif choice == 1:
+            edited["leds"][rng.randrange(2)]["color"] = f"{rng.randrange(1 << 24):06x}"
+        elif choice == 2:
+            edited["report_rate"] = rng.choice((125, 250, 500, 1000))
+        else:
+            edited["default_resolution"] = rng.randrange(4)
+    return edited
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--versions", type=int, default=500, help="versions of the edited profile"
+    )
+    args = parser.parse_args()
+
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        os.environ.update(
+            LGMPM_MODELS_DIR=str(tmp_dir / "models"),
+            XDG_CACHE_HOME=str(tmp_dir / "cache"),
+        )
+
+        # only imported here, after the environment points at the temp dirs
+        import backends
+        import history
+        from mouse import Mice
+        from store import get_store
+
+        print(f"{args.versions} versions of one profile:")
+        rng = random.Random(403)
+        store = get_store(MODEL)
+        settings = json.loads(json.dumps(FakeBackend.DEFAULT_SETTINGS))
+        settings["name"] = "tuned"
+        saved = []
+        full_size = 0
+        start = time.perf_counter()
+        for _ in range(args.versions):
+            saved.append(settings)
+            full_size += len(json.dumps(settings)) + 1
+            store.save_profiles({"tuned": settings}, changed=["tuned"])
+            settings = edit(settings, rng)
+        save_ms = (time.perf_counter() - start) * 1000 / args.versions
+        log_size = store.history_path.stat().st_size
+        print(
+            f"  history: {log_size / 1024:.1f} kB, full copies:"
+            f" {full_size / 1024:.1f} kB, {save_ms:.2f} ms per save"
+        )
+        check(
+            "the history is much smaller than full copies",
+            log_size < full_size * MAX_SIZE_RATIO,
+        )
+
+        profile_history = store.get_history()
+        rebuilt = profile_history.get_versions("tuned")
+        check(
+            "every version is rebuilt exactly",
+            [settings for _, settings in rebuilt] == saved,
+        )
+        apply_delta = history.apply_delta
+        applied = []
+
+        def counting_apply_delta(settings, delta):
+            applied.append(True)
+            return apply_delta(settings, delta)
+
+        history.apply_delta = counting_apply_delta
+        worst = 0
+        start = time.perf_counter()
+        for version in range(1, args.versions + 1):
+            applied.clear()
+            ok = profile_history.get_version("tuned", version) == saved[version - 1]
+            worst = max(worst, len(applied))
+            if not ok:
+                break
+        rebuild_ms = (time.perf_counter() - start) * 1000 / args.versions
+        history.apply_delta = apply_delta
+        check("  one at a time, too", ok)
+        check(
+            f"  from at most {history.HISTORY_CHECKPOINT - 1} deltas each"
+            f" ({rebuild_ms:.2f} ms per version)",
+            worst <= history.HISTORY_CHECKPOINT - 1,
+        )
+        store.save_profiles({"tuned": saved[-1]}, changed=["tuned"])
+        check(
+            "saving the same settings again adds no version",
+            len(profile_history.get_versions("tuned")) == args.versions,
+        )
+
+        print(f"{LONG_PROFILES} profiles x {LONG_VERSIONS} versions:")
+        long_history = history.ProfileHistory(tmp_dir / "long.history.jsonl")
+        profiles = {}
+        for idx in range(LONG_PROFILES):
+            profiles[f"p{idx:03d}"] = dict(saved[0], name=f"p{idx:03d}")
+        for version in range(LONG_VERSIONS):
+            profiles = {
+                name: dict(settings, report_rate=125 * (version % 8 + 1))
+                for name, settings in profiles.items()
+            }
+            long_history.record(profiles, changed=profiles)
+        profiles["p150"] = edit(profiles["p150"], rng)
+        start = time.perf_counter()
+        long_history.record(profiles, changed=["p150"])
+        long_save_ms = (time.perf_counter() - start) * 1000
+        check(
+            f"saving one profile takes {long_save_ms:.1f} ms,"
+            f" under {MAX_LONG_SAVE_MS} ms",
+            long_save_ms < MAX_LONG_SAVE_MS,
+        )
+        check(
+            "  and adds its version",
+            long_history.get_version("p150", LONG_VERSIONS + 1) == profiles["p150"],
+        )
+
+        print("rollback:")
+        backend = FakeBackend({ALIAS: {"model": MODEL, "report_rate": 1000}})
+        backends.set_backend(backend)
+
+        def applies():
+            return backend.devices[ALIAS]["applies"]
+
+        def run(func, *args, **kwargs):
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                func(*args, **kwargs)
+            return out.getvalue()
+
+        mice = Mice()
+        run(mice.add_new_profile, "gaming")
+        backend.devices[ALIAS]["resolutions"][1] = 1200
+        backend.devices[ALIAS]["leds"][0]["color"] = "00ff00"
+        run(mice.update_profile, "gaming")
+        backend.devices[ALIAS]["report_rate"] = 500
+        run(mice.update_profile, "gaming")
+        run(mice.delete_profile, "gaming")
+        versions = store.get_history().get_versions("gaming")
+        check(
+            "--new, --update, and --delete each add a version",
+            [record["version"] for record, _ in versions] == [1, 2, 3, 4],
+        )
+        check(
+            "  the updates only as what changed",
+            all("delta" in record for record, _ in versions[1:3]),
+        )
+        listing = run(mice.list_history, "gaming")
+        check("--history shows what changed", "resolutions[1]: 800 -> 1200" in listing)
+        diff = run(mice.diff_versions, "gaming", [2, 3])
+        check(
+            "--diff shows the settings between two versions",
+            "report_rate: 1000 -> 500" in diff,
+        )
+
+        check(
+            "a deleted version can't be rolled back to",
+            "deletion" in run(mice.rollback_profile, "gaming", 4),
+        )
+        run(mice.rollback_profile, "gaming", 2, dry_run=True)
+        check("a dry run writes nothing", applies() == 0)
+        before = applies()
+        run(mice.rollback_profile, "gaming", 2)
+        device = backend.devices[ALIAS]
+        check("a deleted profile is rolled back", "gaming" in Mice().mice[0].profiles)
+        check(
+            "  to the settings of that version",
+            device["report_rate"] == 1000
+            and device["resolutions"][1] == 1200
+            and device["leds"][0]["color"] == "00ff00",
+        )
+        check("  with a single write to the mouse", applies() == before + 1)
+        check("  as the last active profile", store.load_active() == "gaming")
+        listing = run(Mice().list_history, "gaming")
+        check(
+            "  and as a new version",
+            "v5" in listing and "same settings as v2" in listing,
+        )
+
+        print("sqlite store:")
+        os.environ["LGMPM_STORE"] = "sqlite"
+        mice = Mice()
+        check(
+            "  keeps the history it imports the json profiles with",
+            len(get_store(MODEL).get_history().get_versions("gaming")) == 5,
+        )
+        backend.devices[ALIAS]["report_rate"] = 250
+        run(mice.update_profile, "gaming")
+        check(
+            "  and adds to it",
+            len(get_store(MODEL).get_history().get_versions("gaming")) == 6,
+        )
+        del os.environ["LGMPM_STORE"]
+
+    check.exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# hotplug_sim.py - runs the --hotplug restorer against a fake sysfs/dev tree
+#   and a fake mouse on a simulated clock, and checks that each plug event
+#       writes the last active profile back exactly once
+#
+#   usage: python3 bench/hotplug_sim.py
+#       exits with 1 if a plug event wrote too often, or not at all
+
+import contextlib
+import io
+import os
+import tempfile
+from pathlib import Path
+
+from benchutil import ALIAS, MODEL, Checks, FakeBackend, FakeHidraw, seed_profiles
+
+
+def main():
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        os.environ.update(
+            LGMPM_MODELS_DIR=str(tmp_dir / "models"),
+            XDG_CACHE_HOME=str(tmp_dir / "cache"),
+        )
+        seed_profiles(
+            tmp_dir / "models",
+            {"default": {"report_rate": 1000}, "gaming": {"report_rate": 500}},
+            active="gaming",
+        )
+
+        # only imported here, after the environment points at the temp dirs
+        import backends
+        import identity
+        from hotplug import PlugRestorer
+        from mouse import Mice
+
+        backend = FakeBackend({ALIAS: {"model": MODEL}})
+        backends.set_backend(backend)
+        hidraw = FakeHidraw(tmp_dir)
+        receiver = hidraw.plug()
+        hidraw.plug(hid_id="0003:000004F2:00000833", interfaces=1)
+        loaded = []
+
+        def get_mice():
+            loaded.append(True)
+            return Mice()
+
+        restorer = PlugRestorer(
+            get_mice, sysfs_hidraw=hidraw.sysfs, dev_root=hidraw.dev, settle=1.5
+        )
+
+        def applies():
+            return backend.devices[ALIAS]["applies"]
+
+        def rate():
+            return backend.devices[ALIAS]["report_rate"]
+
+        def reset_mouse():
+            # the mouse comes back with its onboard settings
+            backend.devices[ALIAS]["report_rate"] = 1000
+            return
+
+        def run_until(now, until):
+            with contextlib.redirect_stdout(io.StringIO()):
+                while now <= until:
+                    restorer.tick(now)
+                    now += 0.25
+            return now
+
+        def uevents(now, count):
+            # a burst of uevents, a few ms apart
+            for idx in range(count):
+                restorer.notify(now + idx * 0.01)
+            return now + count * 0.01
+
+        print("simulated timeline:")
+        now = run_until(0.0, 5.0)
+        check("the mice plugged in at start are left alone", not loaded)
+
+        hidraw.unplug(receiver)
+        now = run_until(uevents(now, 3), now + 5.0)
+        check("unplugging writes nothing", applies() == 0)
+
+        reset_mouse()
+        receiver = hidraw.plug()
+        now = uevents(now, 3)
+        run_until(now, now + 1.0)
+        check("nothing is written before the plug event settles", applies() == 0)
+        now = run_until(now, now + 3.0)
+        check("a replug writes the last active profile back", rate() == 500)
+        check("  with a single write for all 3 hidraw nodes", applies() == 1)
+
+        reset_mouse()
+        hidraw.unplug(receiver)
+        now = uevents(now, 3)
+        receiver = hidraw.plug(make_nodes=False)
+        now = uevents(now, 3)
+        now = run_until(now, now + 2.0)
+        check("  it waits for udev to make the device nodes", applies() == 1)
+        for name in receiver:
+            hidraw.make_node(name)
+        now = run_until(now, now + 2.0)
+        check("a receiver reset writes it back once the nodes are there", rate() == 500)
+        check("  again with a single write", applies() == 2)
+
+        hidraw.plug(hid_id="0003:000004F2:00000833", interfaces=1)
+        loaded.clear()
+        now = run_until(uevents(now, 1), now + 5.0)
+        check("a device from another vendor is ignored", not loaded)
+
+        # ratbagd doesn't list the mouse until the second try
+        reset_mouse()
+        hidraw.unplug(receiver)
+        receiver = hidraw.plug()
+        list_devices = backend.list_devices
+        tries = []
+
+        def slow_list_devices():
+            tries.append(True)
+            return list_devices() if len(tries) > 1 else []
+
+        backend.list_devices = slow_list_devices
+        identity._identities = None
+        now = run_until(uevents(now, 3), now + 5.0)
+        backend.list_devices = list_devices
+        check("a mouse ratbagd doesn't list yet is tried again", len(tries) == 2)
+        check("  and written back", rate() == 500)
+        check("  and still written only once", applies() == 3)
+
+        # the first write fails, ex. the mouse is still waking up
+        reset_mouse()
+        hidraw.unplug(receiver)
+        receiver = hidraw.plug()
+        apply = backend.apply
+        writes = []
+
+        def flaky_apply(alias, commands):
+            writes.append(True)
+            if len(writes) == 1:
+                raise backends.DeviceBackendError("the mouse didn't answer")
+            return apply(alias, commands)
+
+        backend.apply = flaky_apply
+        now = run_until(uevents(now, 3), now + 5.0)
+        backend.apply = apply
+        check("a failed write is tried again", len(writes) == 2)
+        check("  until it is written back", rate() == 500 and applies() == 4)
+
+    check.exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# importtime.py - checks the import cost of the hot lgmpm.py commands against
+#   a budget, using 'python -X importtime'
+#
+#   usage: python3 bench/importtime.py [--budget-ms N]
+#       exits with 1 if any command goes over budget or imports a banned module
+
+import argparse
+import subprocess
+import sys
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+
+# the modules each hot command imports, in the order lgmpm.py imports them
+HOT_COMMANDS = {
+    # forwarded to a running daemon
+    "client": "import lgmpm",
+    # run in-process: --active, --cycle, --list
+    "in-process": "import lgmpm, mouse",
+}
+
+# modules that must never be loaded by a hot command
+BANNED_MODULES = ("requests", "bs4", "urllib3", "numpy", "colors")
+
+# the budget is for lgmpm's own imports on top of a bare interpreter
+DEFAULT_BUDGET_MS = 40
+
+
+def get_import_times(code):
+    """
+    Runs code in a fresh interpreter with '-X importtime'
+        Params:
+            code (str): the python code to run, ex. "import lgmpm"
+        Returns:
+            import_times (dict): each imported module mapped to its self time in us
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=REPO_DIR,
+        stderr=subprocess.PIPE,
+        stdout=subprocess.DEVNULL,
+        check=True,
+    )
+    import_times = {}
+    for line in proc.stderr.decode().splitlines():
+        # ex. "import time:       242 |       8294 |   importlib.readers"
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, module = line[len("import time:") :].split("|")
+        import_times[module.strip()] = int(self_us)
+    return import_times
+
+
+def get_command_cost(code, runs=5):
+    """
+    Measures the imports a command adds on top of a bare interpreter
+        Params:
+            code (str): the python code to run, ex. "import lgmpm"
+            runs (int): how many times to measure, the fastest run is kept
+        Returns:
+            (cost_ms, modules) (tuple): the added import time in ms,
+                and the names of the modules that were added
+    """
+    baseline = set(get_import_times("pass"))
+    best_ms = None
+    for _ in range(runs):
+        import_times = get_import_times(code)
+        added = {m: us for m, us in import_times.items() if m not in baseline}
+        cost_ms = sum(added.values()) / 1000
+        if best_ms is None or cost_ms < best_ms:
+            best_ms = cost_ms
+    return (best_ms, sorted(added))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=DEFAULT_BUDGET_MS,
+        help=f"max added import time per command (default {DEFAULT_BUDGET_MS})",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for name, code in HOT_COMMANDS.items():
+        cost_ms, modules = get_command_cost(code)
+        banned = [m for m in modules if m.split(".")[0] in BANNED_MODULES]
+        status = "ok"
+        if cost_ms > args.budget_ms:
+            status = "OVER BUDGET"
+        if banned:
+            status = f"BANNED IMPORTS: {', '.join(banned)}"
+        if status != "ok":
+            failed = True
+        print(f"{name:>12}: {cost_ms:6.1f} ms / {args.budget_ms} ms  {status}")
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+# ratbagctl_calls.py - counts the ratbagctl calls lgmpm makes in the call log
+#   of bench/fake_ratbagctl.py, and checks what a snapshot parses out of them
+#       and that a '--cycle' hotkey only lists the mice after a replug
+#
+#   usage: python3 bench/ratbagctl_calls.py
+#       exits with 1 if a snapshot takes more than one 'info' call,
+#           'ratbagctl info' is parsed wrong, or a '--cycle' runs 'ratbagctl list'
+#               while the same mouse stays plugged in
+
+import contextlib
+import io
+import json
+import os
+import tempfile
+from pathlib import Path
+
+from benchutil import ALIAS, MODEL, REPO_DIR, Checks, FakeHidraw, seed_profiles
+
+FAKE_RATBAGCTL = REPO_DIR / "bench" / "fake_ratbagctl.py"
+
+# a fake mouse with a disabled resolution, and LEDs that show no color
+DEVICE = {
+    "name": "Logitech G403 Prodigy Gaming Mouse",
+    "report_rate": 1000,
+    "resolutions": [400, 800, 0, 3200],
+    "default_resolution": 1,
+    "buttons": ["button 1", "button 2", "button 3", "resolution-cycle-up"],
+    "leds": [
+        {"mode": "off", "color": "000000", "duration": None, "brightness": 255},
+        {"mode": "cycle", "color": "000000", "duration": 5000, "brightness": 128},
+        {"mode": "on", "color": "ff0000", "duration": None, "brightness": 255},
+    ],
+}
+
+# an 'info' whose active onboard profile isn't the first one
+SECOND_ACTIVE_INFO = """\
+sleeping-puppy - Logitech G403 Prodigy Gaming Mouse
+             Model: usb:046d:c083:0
+ Number of Buttons: 1
+    Number of Leds: 1
+Number of Profiles: 2
+Profile 0:
+  Name: n/a
+  Report Rate: 500Hz
+  Resolutions:
+    0: 100dpi (default)
+  Button: 0 is mapped to 'button 9'
+  LED: 0, depth: rgb, mode: on, color: 00ff00
+Profile 1: (active)
+  Name: n/a
+  Report Rate: 1000Hz
+  Resolutions:
+    0: 0dpi (disabled)
+    1: 1600dpi (default)
+  Button: 0 is mapped to 'button 1'
+  LED: 0, depth: rgb, mode: breathing, color: 0000ff, duration: 2000, brightness: 100
+"""
+
+
+def main():
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        bin_dir = tmp_dir / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "ratbagctl").symlink_to(FAKE_RATBAGCTL)
+        (tmp_dir / "run").mkdir()
+        log_fp = tmp_dir / "ratbagctl.log"
+        state_fp = tmp_dir / "mice.json"
+        state_fp.write_text(json.dumps({ALIAS: DEVICE}))
+        os.environ.update(
+            PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            LGMPM_BACKEND="ratbagctl",
+            LGMPM_MODELS_DIR=str(tmp_dir / "models"),
+            XDG_CACHE_HOME=str(tmp_dir / "cache"),
+            # an empty runtime dir, so the breaker starts closed
+            XDG_RUNTIME_DIR=str(tmp_dir / "run"),
+            FAKE_RATBAGCTL_STATE=str(state_fp),
+            FAKE_RATBAGCTL_LOG=str(log_fp),
+        )
+        os.environ.pop("LGMPM_IDENTITY_TTL", None)
+
+        # only imported here, after the environment points at the temp dirs
+        import identity
+        import lgmpm
+        from backends import get_backend
+        from snapshot import parse_info
+        from utils import mouse_arg_parser
+
+        def read_calls():
+            calls = log_fp.read_text().splitlines() if log_fp.exists() else []
+            log_fp.unlink(missing_ok=True)
+            return calls
+
+        print("a snapshot:")
+        snapshot = get_backend().snapshot(ALIAS)
+        calls = read_calls()
+        print(f"  calls: {calls}")
+        check(
+            "is read with a single 'ratbagctl info' call",
+            calls == [f"{ALIAS} info"],
+        )
+        check(
+            "  from the active profile",
+            snapshot["report_rate"] == DEVICE["report_rate"]
+            and snapshot["buttons"] == DEVICE["buttons"],
+        )
+        check(
+            "  with a disabled resolution as 0",
+            snapshot["resolutions"] == DEVICE["resolutions"]
+            and snapshot["default_resolution"] == DEVICE["default_resolution"],
+        )
+        check(
+            "  and LEDs that show no color without one",
+            [led["color"] for led in snapshot["leds"]] == [None, None, "ff0000"]
+            and [led["duration"] for led in snapshot["leds"]] == [None, 5000, None]
+            and snapshot["leds"][1]["brightness"] == 128,
+        )
+
+        print("parse_info():")
+        parsed = parse_info(SECOND_ACTIVE_INFO)
+        check(
+            "reads the active profile, even if it isn't the first",
+            parsed.get("report_rate") == 1000 and parsed.get("buttons") == ["button 1"],
+        )
+        check(
+            "  with its disabled resolution and default",
+            parsed.get("resolutions") == [0, 1600]
+            and parsed.get("default_resolution") == 1,
+        )
+        check(
+            "  and its LED",
+            parsed.get("leds")
+            == [
+                {
+                    "mode": "breathing",
+                    "color": "0000ff",
+                    "duration": 2000,
+                    "brightness": 100,
+                }
+            ],
+        )
+        parsed = parse_info(SECOND_ACTIVE_INFO.replace(" (active)", ""))
+        check(
+            "reads the first profile if none is active",
+            parsed.get("report_rate") == 500 and parsed.get("resolutions") == [100],
+        )
+        parsed = parse_info(
+            SECOND_ACTIVE_INFO.replace("Number of Leds: 1", "Number of Leds: 2")
+        )
+        check(
+            "leaves out LEDs that don't match the header's count",
+            "leds" not in parsed and parsed.get("report_rate") == 1000,
+        )
+        check("returns nothing without a profile", parse_info("Error: no device") == {})
+
+        print("--cycle:")
+        # profiles shaped like the fake mouse, ex. its 4 resolutions
+        seed_profiles(
+            tmp_dir / "models",
+            {
+                "default": dict(snapshot, report_rate=1000),
+                "gaming": dict(snapshot, report_rate=500),
+            },
+            active="default",
+        )
+        hidraw = FakeHidraw(tmp_dir / "hw")
+        receiver = hidraw.plug()
+        identity.SYSFS_HIDRAW = hidraw.sysfs
+        identity.DEV_ROOT = hidraw.dev
+
+        def press(fresh=True):
+            if fresh:
+                # like a new 'lgmpm.py --cycle', which only has the disk cache
+                identity._identities = None
+            with contextlib.redirect_stdout(io.StringIO()):
+                ok = lgmpm.run_command(mouse_arg_parser(["--cycle"]))
+            calls = read_calls()
+            return ok, sum(call == "list" for call in calls)
+
+        ok, list_ct = press()
+        check("the first press lists the mice once", ok and list_ct == 1)
+        ok, list_ct = press()
+        check("a press with a warm cache never lists them", ok and list_ct == 0)
+        ok, list_ct = press(fresh=False)
+        check("  nor does one in a long-running lgmpm", ok and list_ct == 0)
+        hidraw.unplug(receiver)
+        receiver = hidraw.plug()
+        ok, list_ct = press()
+        check("a replug lists them exactly once", ok and list_ct == 1)
+        ok, list_ct = press()
+        check("  and caches them again", ok and list_ct == 0)
+        hidraw.unplug(receiver)
+        receiver = hidraw.plug()
+        ok, list_ct = press(fresh=False)
+        check("  in a long-running lgmpm, too", ok and list_ct == 1)
+        check(
+            "  while every press was written",
+            (tmp_dir / "models" / f"{MODEL}.active").read_text().strip() == "default",
+        )
+
+    check.exit()
+
+
+if __name__ == "__main__":
+    main()
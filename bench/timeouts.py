@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+# timeouts.py - runs 'lgmpm.py --cycle' against a fake ratbagctl that fails
+#   like a busy ratbagd or hangs like one after a resume from suspend, and
+#       checks that the retries, timeouts, and circuit breaker kick in
+#
+#   usage: python3 bench/timeouts.py
+#       exits with 1 if a press hung, wasn't retried, or didn't fail fast
+
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchutil import REPO_DIR, Checks
+
+FAKE_RATBAGCTL = REPO_DIR / "bench" / "fake_ratbagctl.py"
+
+# short limits, so the hung calls don't make the check slow
+TIMEOUT_S = 0.5
+DEADLINE_S = 3.0
+
+
+def get_leftovers(bin_dir):
+    """
+    Returns the pids of fake ratbagctl calls still running, ex. a hung one
+        that wasn't killed once it timed out
+    """
+    pids = []
+    for proc_dir in Path("/proc").iterdir():
+        try:
+            cmdline = (proc_dir / "cmdline").read_bytes()
+        except OSError:
+            continue
+        if str(bin_dir).encode() in cmdline:
+            pids.append(proc_dir.name)
+    return pids
+
+
+def main():
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        bin_dir = tmp_dir / "bin"
+        bin_dir.mkdir()
+        (bin_dir / "ratbagctl").symlink_to(FAKE_RATBAGCTL)
+        (tmp_dir / "run").mkdir()
+        log_fp = tmp_dir / "ratbagctl.log"
+        breaker_fp = tmp_dir / "run" / "lgmpm.breaker.json"
+        env = dict(
+            os.environ,
+            PATH=f"{bin_dir}{os.pathsep}{os.environ.get('PATH', '')}",
+            LGMPM_BACKEND="ratbagctl",
+            LGMPM_MODELS_DIR=str(tmp_dir / "models"),
+            LGMPM_IDENTITY_TTL="0",
+            LGMPM_TIMEOUT=str(TIMEOUT_S),
+            LGMPM_DEADLINE=str(DEADLINE_S),
+            XDG_CACHE_HOME=str(tmp_dir / "cache"),
+            # an empty runtime dir, so no real daemon answers the presses
+            XDG_RUNTIME_DIR=str(tmp_dir / "run"),
+            FAKE_RATBAGCTL_STATE=str(tmp_dir / "mice.json"),
+            FAKE_RATBAGCTL_LOG=str(log_fp),
+        )
+
+        def lgmpm(argv, **fake_env):
+            start = time.perf_counter()
+            proc = subprocess.run(
+                [sys.executable, "lgmpm.py"] + argv,
+                cwd=REPO_DIR,
+                env=dict(env, **fake_env),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+            )
+            elapsed = time.perf_counter() - start
+            print(
+                f"lgmpm.py {' '.join(argv)}: exit {proc.returncode} in {elapsed:.2f} s"
+            )
+            return proc.returncode, proc.stdout.decode(), elapsed
+
+        def count_calls():
+            return len(log_fp.read_text().splitlines()) if log_fp.exists() else 0
+
+        lgmpm(["-n", "gaming"])
+
+        returncode, _, _ = lgmpm(["--cycle"], FAKE_RATBAGCTL_FLAKY="2")
+        check("a busy ratbagd is retried until it answers", returncode == 0)
+        check("  and the breaker stays closed", not breaker_fp.exists())
+
+        returncode, output, elapsed = lgmpm(["--cycle"], FAKE_RATBAGCTL_HANG=".")
+        check("a hung ratbagd fails the press", returncode == 1)
+        check("  with a timeout", "timed out" in output)
+        check(f"  within the {DEADLINE_S:.0f} s deadline", elapsed < DEADLINE_S + 1)
+        check("  without leaving ratbagctl running", not get_leftovers(bin_dir))
+        check("  and opens the breaker", breaker_fp.exists())
+
+        calls_before = count_calls()
+        returncode, output, elapsed = lgmpm(["--cycle"], FAKE_RATBAGCTL_HANG=".")
+        check("the next press fails fast", returncode == 1 and elapsed < TIMEOUT_S * 2)
+        check("  without calling ratbagctl", count_calls() == calls_before)
+        check("  and says when it tries again", "trying again in" in output)
+
+        # pretend the cooldown is over, and ratbagd has recovered
+        state = json.loads(breaker_fp.read_text())
+        state["last_failure"] = 0
+        breaker_fp.write_text(json.dumps(state))
+        returncode, _, _ = lgmpm(["--cycle"])
+        check("once the cooldown is over, a press goes through", returncode == 0)
+        check("  and closes the breaker", not breaker_fp.exists())
+
+    check.exit()
+
+
+if __name__ == "__main__":
+    main()
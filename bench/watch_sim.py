@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# watch_sim.py - runs the --watch application watcher against a fake /proc
+#   tree and a fake mouse on a simulated clock, checks when it switches, and
+#       times a scan of a big process table and of the real /proc
+#
+#   usage: python3 bench/watch_sim.py [--processes N]
+#       exits with 1 if the watcher switched when (or to what) it shouldn't
+
+import argparse
+import os
+import tempfile
+import time
+from pathlib import Path
+
+from benchutil import ALIAS, MODEL, Checks, FakeBackend, seed_profiles
+
+RULES = {
+    "hl2_linux": "gaming",
+    "steam_app_*": "gaming",
+    "blender*": "work",
+    "*.exe": "wine",
+}
+
+
+class FakeProc:
+    """
+    A class keeping a fake /proc tree, one dir with a cmdline per process
+    """
+
+    def __init__(self, root):
+        self.root = Path(root)
+        self.next_pid = 1000
+        return
+
+    def start(self, argv0):
+        """
+        Adds a process, returns its pid
+        """
+        pid = str(self.next_pid)
+        self.next_pid += 1
+        self.exec(pid, argv0)
+        return pid
+
+    def exec(self, pid, argv0):
+        """
+        Replaces the cmdline of a process, like exec()
+        """
+        (self.root / pid).mkdir(exist_ok=True)
+        (self.root / pid / "cmdline").write_bytes(argv0.encode() + b"\0--flag\0")
+        return
+
+    def exit(self, pid):
+        """
+        Removes a process
+        """
+        (self.root / pid / "cmdline").unlink()
+        (self.root / pid).rmdir()
+        return
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--processes", type=int, default=2000, help="idle processes for the scan timing"
+    )
+    args = parser.parse_args()
+
+    check = Checks()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tmp_dir = Path(tmp_dir)
+        os.environ.update(
+            LGMPM_MODELS_DIR=str(tmp_dir / "models"),
+            XDG_CACHE_HOME=str(tmp_dir / "cache"),
+        )
+        # a profile for every rule, each with its own polling rate
+        seed_profiles(
+            tmp_dir / "models",
+            {
+                name: {"report_rate": 125 * 2**idx}
+                for idx, name in enumerate(["default", "gaming", "wine", "work"])
+            },
+            active="default",
+        )
+        (tmp_dir / "proc").mkdir()
+
+        # only imported here, after the environment points at the temp dirs
+        import backends
+        import contextlib
+        import io
+        from mouse import Mice
+        from watcher import AppRules, AppWatcher
+
+        backend = FakeBackend({ALIAS: {"model": MODEL}})
+        backends.set_backend(backend)
+        mice = Mice()
+        proc = FakeProc(tmp_dir / "proc")
+        for idx in range(20):
+            proc.start(f"/usr/bin/idle{idx}")
+        watcher = AppWatcher(
+            AppRules(RULES), lambda: mice, proc_root=proc.root, debounce=2.0
+        )
+
+        def applies():
+            return backend.devices[ALIAS]["applies"]
+
+        def rate():
+            return backend.devices[ALIAS]["report_rate"]
+
+        def run_until(now, until):
+            with contextlib.redirect_stdout(io.StringIO()):
+                while now <= until:
+                    watcher.tick(now)
+                    now += 0.5
+            return now
+
+        print("simulated timeline:")
+        now = run_until(0.0, 5.0)
+        check("nothing is written while no watched application runs", applies() == 0)
+
+        pid = proc.start("/home/me/.steam/hl2_linux")
+        now = run_until(now, now + 1.0)
+        proc.exit(pid)
+        now = run_until(now, now + 5.0)
+        check(
+            "an application running under the debounce time writes nothing",
+            applies() == 0,
+        )
+
+        game = proc.start("/home/me/.steam/hl2_linux")
+        now = run_until(now, now + 3.0)
+        check("a watched application switches to its profile", rate() == 250)
+        check("  with a single write", applies() == 1)
+
+        # a launcher forks, and only exec()s the game after the first scan
+        launcher = proc.start("/usr/bin/python3")
+        now = run_until(now, now)
+        proc.exec(launcher, r"C:\Games\Witcher3.exe")
+        now = run_until(now, now + 3.0)
+        check("a fork caught before its exec() is picked up after it", rate() == 500)
+
+        proc.exit(launcher)
+        now = run_until(now, now + 3.0)
+        check("the previous application's profile comes back", rate() == 250)
+
+        proc.exit(game)
+        now = run_until(now, now + 3.0)
+        check("the profile from before is restored once all have exited", rate() == 125)
+        last_active = (tmp_dir / "models" / f"{MODEL}.active").read_text().strip()
+        check("  and saved as the last active profile", last_active == "default")
+        check("  in 4 writes overall", applies() == 4)
+
+        print("\nan unplugged mouse:")
+        plugged = [False]
+
+        def get_mice():
+            if not plugged[0]:
+                raise backends.DeviceBackendError("No mouse is connected")
+            return mice
+
+        sleeps = []
+
+        def sleep(seconds):
+            sleeps.append(seconds)
+            if len(sleeps) == 2:
+                plugged[0] = True
+            elif len(sleeps) == 3:
+                # unplugged again, then stopped, so the restore fails too
+                plugged[0] = False
+                raise KeyboardInterrupt
+
+        flaky_watcher = AppWatcher(
+            AppRules(RULES), get_mice, proc_root=proc.root, debounce=0.0
+        )
+        game = proc.start("/home/me/.steam/hl2_linux")
+        real_sleep = time.sleep
+        time.sleep = sleep
+        out = io.StringIO()
+        try:
+            with contextlib.redirect_stdout(out):
+                flaky_watcher.run()
+            stopped = True
+        except Exception:
+            stopped = False
+        finally:
+            time.sleep = real_sleep
+        proc.exit(game)
+        check("run() keeps watching while the mouse can't be read", len(sleeps) == 3)
+        check("  switches once it is back", rate() == 250)
+        check(
+            "  and stops cleanly when it can't restore",
+            stopped and "Could not restore" in out.getvalue(),
+        )
+
+        print(f"\nscan cost, {args.processes} idle processes:")
+        for idx in range(args.processes):
+            proc.start(f"/usr/lib/service{idx}")
+        name_reads = []
+        get_name = watcher.scanner.get_name
+        watcher.scanner.get_name = lambda pid: name_reads.append(pid) or get_name(pid)
+        start = time.perf_counter()
+        watcher.tick(now)
+        first_ms = (time.perf_counter() - start) * 1000
+        watcher.tick(now)
+        name_reads.clear()
+        start = time.perf_counter()
+        watcher.tick(now)
+        idle_ms = (time.perf_counter() - start) * 1000
+        print(f"  first scan {first_ms:.1f} ms, then {idle_ms:.2f} ms per scan")
+        check("an idle scan reads no process names", not name_reads)
+
+    # a debounce that never ends, so only the scans are timed
+    real_watcher = AppWatcher(AppRules(RULES), None, debounce=float("inf"))
+    real_watcher.tick()
+    start = time.perf_counter()
+    for _ in range(100):
+        real_watcher.tick()
+    real_ms = (time.perf_counter() - start) * 10
+    pid_ct = len(real_watcher.scanner.known)
+    print(f"  real /proc ({pid_ct} processes): {real_ms:.2f} ms per scan")
+
+    check.exit()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# colors.py - offline nearest-name lookup for LED color hex codes
+
+import os
+from functools import lru_cache
+
+from tracing import span
+
+# the CSS named colors, used as the bundled palette for nearest-color lookup
+PALETTE = (
+    ("alice blue", "f0f8ff"),
+    ("antique white", "faebd7"),
+    ("aqua", "00ffff"),
+    ("aquamarine", "7fffd4"),
+    ("azure", "f0ffff"),
+    ("beige", "f5f5dc"),
+    ("bisque", "ffe4c4"),
+    ("black", "000000"),
+    ("blanched almond", "ffebcd"),
+    ("blue", "0000ff"),
+    ("blue violet", "8a2be2"),
+    ("brown", "a52a2a"),
+    ("burlywood", "deb887"),
+    ("cadet blue", "5f9ea0"),
+    ("chartreuse", "7fff00"),
+    ("chocolate", "d2691e"),
+    ("coral", "ff7f50"),
+    ("cornflower blue", "6495ed"),
+    ("cornsilk", "fff8dc"),
+    ("crimson", "dc143c"),
+    ("dark blue", "00008b"),
+    ("dark cyan", "008b8b"),
+    ("dark goldenrod", "b8860b"),
+    ("dark gray", "a9a9a9"),
+    ("dark green", "006400"),
+    ("dark khaki", "bdb76b"),
+    ("dark magenta", "8b008b"),
+    ("dark olive green", "556b2f"),
+    ("dark orange", "ff8c00"),
+    ("dark orchid", "9932cc"),
+    ("dark red", "8b0000"),
+    ("dark salmon", "e9967a"),
+    ("dark sea green", "8fbc8f"),
+    ("dark slate blue", "483d8b"),
+    ("dark slate gray", "2f4f4f"),
+    ("dark turquoise", "00ced1"),
+    ("dark violet", "9400d3"),
+    ("deep pink", "ff1493"),
+    ("deep sky blue", "00bfff"),
+    ("dim gray", "696969"),
+    ("dodger blue", "1e90ff"),
+    ("firebrick", "b22222"),
+    ("floral white", "fffaf0"),
+    ("forest green", "228b22"),
+    ("fuchsia", "ff00ff"),
+    ("gainsboro", "dcdcdc"),
+    ("ghost white", "f8f8ff"),
+    ("gold", "ffd700"),
+    ("goldenrod", "daa520"),
+    ("gray", "808080"),
+    ("green", "008000"),
+    ("green yellow", "adff2f"),
+    ("honeydew", "f0fff0"),
+    ("hot pink", "ff69b4"),
+    ("indian red", "cd5c5c"),
+    ("indigo", "4b0082"),
+    ("ivory", "fffff0"),
+    ("khaki", "f0e68c"),
+    ("lavender", "e6e6fa"),
+    ("lavender blush", "fff0f5"),
+    ("lawn green", "7cfc00"),
+    ("lemon chiffon", "fffacd"),
+    ("light blue", "add8e6"),
+    ("light coral", "f08080"),
+    ("light cyan", "e0ffff"),
+    ("light goldenrod yellow", "fafad2"),
+    ("light gray", "d3d3d3"),
+    ("light green", "90ee90"),
+    ("light pink", "ffb6c1"),
+    ("light salmon", "ffa07a"),
+    ("light sea green", "20b2aa"),
+    ("light sky blue", "87cefa"),
+    ("light slate gray", "778899"),
+    ("light steel blue", "b0c4de"),
+    ("light yellow", "ffffe0"),
+    ("lime", "00ff00"),
+    ("lime green", "32cd32"),
+    ("linen", "faf0e6"),
+    ("maroon", "800000"),
+    ("medium aquamarine", "66cdaa"),
+    ("medium blue", "0000cd"),
+    ("medium orchid", "ba55d3"),
+    ("medium purple", "9370db"),
+    ("medium sea green", "3cb371"),
+    ("medium slate blue", "7b68ee"),
+    ("medium spring green", "00fa9a"),
+    ("medium turquoise", "48d1cc"),
+    ("medium violet red", "c71585"),
+    ("midnight blue", "191970"),
+    ("mint cream", "f5fffa"),
+    ("misty rose", "ffe4e1"),
+    ("moccasin", "ffe4b5"),
+    ("navajo white", "ffdead"),
+    ("navy", "000080"),
+    ("old lace", "fdf5e6"),
+    ("olive", "808000"),
+    ("olive drab", "6b8e23"),
+    ("orange", "ffa500"),
+    ("orange red", "ff4500"),
+    ("orchid", "da70d6"),
+    ("pale goldenrod", "eee8aa"),
+    ("pale green", "98fb98"),
+    ("pale turquoise", "afeeee"),
+    ("pale violet red", "db7093"),
+    ("papaya whip", "ffefd5"),
+    ("peach puff", "ffdab9"),
+    ("peru", "cd853f"),
+    ("pink", "ffc0cb"),
+    ("plum", "dda0dd"),
+    ("powder blue", "b0e0e6"),
+    ("purple", "800080"),
+    ("rebecca purple", "663399"),
+    ("red", "ff0000"),
+    ("rosy brown", "bc8f8f"),
+    ("royal blue", "4169e1"),
+    ("saddle brown", "8b4513"),
+    ("salmon", "fa8072"),
+    ("sandy brown", "f4a460"),
+    ("sea green", "2e8b57"),
+    ("seashell", "fff5ee"),
+    ("sienna", "a0522d"),
+    ("silver", "c0c0c0"),
+    ("sky blue", "87ceeb"),
+    ("slate blue", "6a5acd"),
+    ("slate gray", "708090"),
+    ("snow", "fffafa"),
+    ("spring green", "00ff7f"),
+    ("steel blue", "4682b4"),
+    ("tan", "d2b48c"),
+    ("teal", "008080"),
+    ("thistle", "d8bfd8"),
+    ("tomato", "ff6347"),
+    ("turquoise", "40e0d0"),
+    ("violet", "ee82ee"),
+    ("wheat", "f5deb3"),
+    ("white", "ffffff"),
+    ("white smoke", "f5f5f5"),
+    ("yellow", "ffff00"),
+    ("yellow green", "9acd32"),
+)
+
+
+def hex_to_lab(color_hex):
+    """
+    Converts a hex color into CIELAB, where euclidean distance roughly
+        matches how different two colors look
+        Params:
+            color_hex (str): a 6 digit hex color, ex. "ff0000"
+        Returns:
+            (L, a, b) (tuple(float)): the color in CIELAB (D65 white point)
+    """
+    rgb = []
+    for i in (0, 2, 4):
+        channel = int(color_hex[i : i + 2], 16) / 255
+        # undo the sRGB gamma
+        if channel <= 0.04045:
+            channel /= 12.92
+        else:
+            channel = ((channel + 0.055) / 1.055) ** 2.4
+        rgb.append(channel)
+    r, g, b = rgb
+    xyz = (
+        (0.4124 * r + 0.3576 * g + 0.1805 * b) / 0.95047,
+        (0.2126 * r + 0.7152 * g + 0.0722 * b) / 1.0,
+        (0.0193 * r + 0.1192 * g + 0.9505 * b) / 1.08883,
+    )
+    fx, fy, fz = (
+        t ** (1 / 3) if t > 216 / 24389 else (24389 / 27 * t + 16) / 116 for t in xyz
+    )
+    return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+
+@lru_cache(maxsize=1)
+def get_palette_lab():
+    """
+    Converts the bundled palette into CIELAB once, on first use
+        Returns:
+            (tuple): (name, (L, a, b)) pairs for each color in PALETTE
+    """
+    return tuple((name, hex_to_lab(color_hex)) for name, color_hex in PALETTE)
+
+
+@lru_cache(maxsize=1024)
+def color_hex_to_name(color_hex):
+    """
+    Finds the name of the nearest bundled color, without any network access
+        Params:
+            color_hex (str): a 6 digit hex color, ex. "ff0000"
+        Returns:
+            (str): the name of the perceptually closest color, ex. "red"
+    """
+    lab = hex_to_lab(color_hex.lower())
+    best_name = None
+    best_dist = None
+    for name, (pl, pa, pb) in get_palette_lab():
+        dist = (lab[0] - pl) ** 2 + (lab[1] - pa) ** 2 + (lab[2] - pb) ** 2
+        if best_dist is None or dist < best_dist:
+            best_name = name
+            best_dist = dist
+    return best_name
+
+
+def color_hex_to_desc(color_hex):
+    """
+    Looks up a color description on colorhexa.com (needs network access)
+        Params:
+            color_hex (str): a 6 digit hex color, ex. "ff0000"
+        Returns:
+            (str): colorhexa's description of the color
+    """
+    # only imported here, so that offline lookups never pay for them
+    import requests
+    from bs4 import BeautifulSoup
+
+    url = f"https://www.colorhexa.com/{color_hex}"
+    with span(f"GET {url}", "network") as sp:
+        res = requests.get(url, timeout=5)
+        sp.set(status_code=res.status_code)
+    res.raise_for_status()
+    soup = BeautifulSoup(res.text, features="html.parser")
+    color = soup.select(".color-description p strong").pop().get_text()
+    return color.lower()
+
+
+def color_hexes_to_names(color_hexes, remote=None):
+    """
+    Resolves the names of many colors in one batch, each distinct color once
+        Params:
+            color_hexes (iterable(str)): 6 digit hex colors, duplicates are fine
+            remote (bool): also look up colorhexa.com descriptions,
+                defaults to $LGMPM_REMOTE_COLORS being set to 1
+        Returns:
+            names (dict): each distinct hex color mapped to its name
+    """
+    if remote is None:
+        remote = os.environ.get("LGMPM_REMOTE_COLORS") == "1"
+    names = {}
+    for color_hex in color_hexes:
+        if not color_hex or color_hex in names:
+            continue
+        names[color_hex] = color_hex_to_name(color_hex)
+        if remote:
+            # the remote description is only an enrichment,
+            #   so keep the offline name if the lookup fails
+            #       and stop asking once it does (ex. no network)
+            try:
+                names[color_hex] = color_hex_to_desc(color_hex)
+            except Exception:
+                remote = False
+    return names
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# daemon.py - keeps lgmpm resident and serves commands over a Unix socket
+
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+from pathlib import Path
+
+from tracing import span
+from utils import mouse_arg_parser
+
+
+def get_socket_fp():
+    """
+    Returns the Path of the daemon's Unix socket
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "lgmpm.sock"
+    return Path("/tmp") / f"lgmpm-{os.getuid()}.sock"
+
+
+def send_command(argv, socket_fp=None, timeout=30):
+    """
+    Forwards CLI arguments to a running daemon and waits for its output
+        Params:
+            argv (list(str)): the CLI arguments, ex. ["--cycle"]
+            socket_fp (Path): the daemon socket, defaults to get_socket_fp()
+            timeout (float): seconds to wait for the daemon to answer
+        Returns:
+            (str): the output of the command, or None if no daemon is running
+    """
+    socket_fp = socket_fp or get_socket_fp()
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        try:
+            sock.connect(str(socket_fp))
+        except OSError:
+            # no socket, or a stale one left behind by a daemon that died
+            return None
+        try:
+            sock.sendall(json.dumps({"argv": argv}).encode())
+            sock.shutdown(socket.SHUT_WR)
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            return json.loads(b"".join(chunks))["output"]
+        except (OSError, ValueError, KeyError) as e:
+            # the daemon got the command, so don't run it a second time here
+            return f"Error: no answer from the lgmpm daemon: {e}\n"
+
+
+class ProfileServer:
+    """
+    A class that keeps the mouse state in memory between commands
+
+        Attributes:
+            handler (function): runs parsed CLI arguments, ex. lgmpm.run_command
+            cache (MiceCache): the loaded mice, reloaded on replug or when their
+                profiles are changed by something other than this daemon
+    """
+
+    def __init__(self, handler):
+        # only imported here, so that a client never has to load it
+        from mouse import MiceCache
+
+        self.handler = handler
+        self.cache = MiceCache()
+        return
+
+    def handle(self, argv):
+        """
+        Runs one forwarded command and captures what it prints
+            Params:
+                argv (list(str)): the CLI arguments sent by the client
+            Returns:
+                (str): everything the command printed
+        """
+        output = io.StringIO()
+        with span(f"handle {' '.join(argv)}", "daemon"):
+            with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+                try:
+                    args = mouse_arg_parser(argv)
+                except SystemExit:
+                    # argparse exits after --help or on bad arguments
+                    args = None
+                # NOTE a SystemExit from running the command (ex. SIGTERM)
+                #   isn't caught, so it still stops the daemon
+                if args is None:
+                    pass
+                elif args.daemon:
+                    print("The lgmpm daemon is already running")
+                else:
+                    try:
+                        self.handler(args, self.cache.get())
+                    except Exception as e:
+                        print("An exception occurred:")
+                        print(e)
+        # don't reload the profiles because of our own writes
+        self.cache.keep()
+        return output.getvalue()
+
+    def serve(self, socket_fp=None):
+        """
+        Listens on the Unix socket and handles one command at a time
+            Params:
+                socket_fp (Path): the socket to listen on, defaults to get_socket_fp()
+        """
+        socket_fp = socket_fp or get_socket_fp()
+        if send_command(["--daemon"], socket_fp) is not None:
+            print(f"An lgmpm daemon is already listening on {socket_fp}")
+            return
+        socket_fp.unlink(missing_ok=True)
+
+        # only imported here, since only the daemon itself handles signals
+        import signal
+
+        # exit cleanly (and remove the socket) when asked to stop
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as server:
+            server.bind(str(socket_fp))
+            os.chmod(socket_fp, 0o600)
+            server.listen()
+            print(f"lgmpm daemon listening on {socket_fp}")
+            try:
+                while True:
+                    conn, _ = server.accept()
+                    with conn:
+                        self.serve_connection(conn)
+            except KeyboardInterrupt:
+                pass
+            finally:
+                socket_fp.unlink(missing_ok=True)
+        return
+
+    def serve_connection(self, conn):
+        """
+        Reads one request from a client connection and sends back the output
+            Params:
+                conn (socket.socket): the accepted client connection
+        """
+        try:
+            chunks = []
+            while True:
+                chunk = conn.recv(65536)
+                if not chunk:
+                    break
+                chunks.append(chunk)
+            argv = json.loads(b"".join(chunks))["argv"]
+            output = self.handle(argv)
+            conn.sendall(json.dumps({"output": output}).encode())
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Dropped a bad request: {e}")
+        return
+
+
+def run_daemon(handler, socket_fp=None):
+    """
+    Runs the lgmpm daemon until it is interrupted
+        Params:
+            handler (function): runs parsed CLI arguments against a Mouse
+            socket_fp (Path): the socket to listen on, defaults to get_socket_fp()
+    """
+    ProfileServer(handler).serve(socket_fp)
+    return
@@ -0,0 +1,372 @@
+#!/usr/bin/env python3
+# dbusbackend.py - talks to ratbagd over D-Bus in-process, instead of running
+#   ratbagctl, picked with LGMPM_BACKEND=dbus, see backends.get_backend()
+
+import os
+import re
+
+from backends import DeviceBackendError, bounded, get_button_action
+from executor import (
+    COMMAND_TIMEOUT_S,
+    get_breaker,
+    get_env_seconds,
+    get_remaining,
+    is_transient,
+)
+from plan import SPECIAL_ACTIONS
+from tracing import span
+
+
+class DBusBackend:
+    """
+    A backend that talks to ratbagd over D-Bus (org.freedesktop.ratbag1)
+        in-process, over a single connection
+
+        Attributes:
+            bus (Gio.DBusConnection): the system bus, or the session bus
+                if $LGMPM_DBUS_BUS is 'session' (ex. for bench/fake_ratbagd.py)
+    """
+
+    name = "dbus"
+
+    SERVICE = "org.freedesktop.ratbag1"
+    MANAGER_PATH = "/org/freedesktop/ratbag1"
+
+    # libratbag's enums, as ratbagd exposes them
+    LED_MODES = ("off", "on", "cycle", "breathing")
+    ACTION_NONE, ACTION_BUTTON, ACTION_SPECIAL, ACTION_KEY, ACTION_MACRO = range(5)
+    MACRO_PRESS, MACRO_RELEASE, MACRO_WAIT = 1, 2, 3
+    SPECIAL_BASE = 1 << 30
+    SPECIALS = SPECIAL_ACTIONS
+
+    def __init__(self):
+        """
+        Connects to the bus ratbagd (or a stand-in) is on
+        """
+        try:
+            from gi.repository import Gio, GLib
+        except ImportError:
+            raise DeviceBackendError(
+                "The dbus backend needs PyGObject, see 'pip install PyGObject'"
+            )
+        self.Gio = Gio
+        self.GLib = GLib
+        bus_type = Gio.BusType.SYSTEM
+        if os.environ.get("LGMPM_DBUS_BUS") == "session":
+            bus_type = Gio.BusType.SESSION
+        try:
+            self.bus = Gio.bus_get_sync(bus_type, None)
+        except GLib.Error as e:
+            raise DeviceBackendError(f"Could not connect to D-Bus: {e.message}")
+        self.device_paths = {}
+        return
+
+    def _get_props(self, path, iface):
+        """
+        Reads all the properties of one ratbagd object in a single call
+            Params:
+                path (str): the object path
+                iface (str): the interface name, ex. "Profile"
+            Returns:
+                (dict): the unpacked properties
+        """
+        return self._call(
+            path, "org.freedesktop.DBus.Properties", "GetAll", ("(s)", (iface,))
+        )[0]
+
+    def _set_prop(self, path, iface, prop, signature, value):
+        """
+        Writes one property of a ratbagd object
+        """
+        GLib = self.GLib
+        args = (f"{self.SERVICE}.{iface}", prop, GLib.Variant(signature, value))
+        self._call(path, "org.freedesktop.DBus.Properties", "Set", ("(ssv)", args))
+        return
+
+    def _call(self, path, iface, method, args=None):
+        """
+        Calls a method on a ratbagd object and returns the unpacked reply, within
+            the deadline of the current operation, unless the breaker is open,
+                see executor.run_command()
+        """
+        GLib = self.GLib
+        Gio = self.Gio
+        if not iface.startswith("org."):
+            iface = f"{self.SERVICE}.{iface}"
+        breaker = get_breaker()
+        wait = breaker.get_wait()
+        if wait:
+            raise DeviceBackendError(
+                f"ratbagd {method} skipped, ratbagd failed {breaker.threshold}"
+                f" times in a row (trying again in {wait:.0f} s)"
+            )
+        timeout = get_env_seconds("LGMPM_TIMEOUT", COMMAND_TIMEOUT_S)
+        remaining = get_remaining()
+        if remaining is not None:
+            if remaining <= 0:
+                raise DeviceBackendError(f"ratbagd {method} skipped, out of time")
+            timeout = min(timeout, remaining)
+        params = GLib.Variant(*args) if args else None
+        try:
+            with span(f"{iface}.{method}", "dbus", path=path):
+                reply = self.bus.call_sync(
+                    self.SERVICE,
+                    path,
+                    iface,
+                    method,
+                    params,
+                    None,
+                    Gio.DBusCallFlags.NONE,
+                    # never the default of 25 s per call
+                    max(1, int(timeout * 1000)),
+                    None,
+                )
+        except GLib.Error as e:
+            # a call that timed out, or a ratbagd that is gone, counts towards
+            #   the breaker, an error ratbagd answered with doesn't
+            timed_out = e.matches(Gio.io_error_quark(), Gio.IOErrorEnum.TIMED_OUT)
+            breaker.record(not (timed_out or is_transient(1, e.message)))
+            raise DeviceBackendError(f"ratbagd {method} failed: {e.message}")
+        breaker.record(True)
+        return reply.unpack() if reply is not None else ()
+
+    @bounded
+    def list_devices(self):
+        """
+        Lists the connected mice ratbagd knows about, see RatbagctlBackend.list_devices()
+        """
+        devices = []
+        manager = self._get_props(self.MANAGER_PATH, "Manager")
+        for path in manager["Devices"]:
+            device = self._get_props(path, "Device")
+            model_mo = re.search(r"(G\d{3}|G Pro)", device["Name"])
+            if model_mo:
+                # NOTE the alias is the object name, ex. 'hidraw3', since only
+                #   ratbagctl makes up the 'sleeping-puppy' style names
+                alias = path.rsplit("/", 1)[-1]
+                self.device_paths[alias] = path
+                devices.append((alias, model_mo.group(1).lower()))
+        return devices
+
+    def _get_device_path(self, alias):
+        """
+        Returns the object path of the ratbagd device behind an alias
+        """
+        if alias not in self.device_paths:
+            self.list_devices()
+        try:
+            return self.device_paths[alias]
+        except KeyError:
+            raise DeviceBackendError(f"No ratbagd device '{alias}'")
+
+    def _get_active_profile(self, alias):
+        """
+        Returns the object path and properties of the active onboard profile
+        """
+        device = self._get_props(self._get_device_path(alias), "Device")
+        profiles = [
+            (path, self._get_props(path, "Profile")) for path in device["Profiles"]
+        ]
+        for path, props in profiles:
+            if props.get("IsActive"):
+                return (path, props)
+        return profiles[0]
+
+    @bounded
+    def get_device_name(self, alias):
+        """
+        Returns the 'long form' name of the mouse, as ratbagd reports it
+        """
+        return self._get_props(self._get_device_path(alias), "Device")["Name"]
+
+    @bounded
+    def snapshot(self, alias):
+        """
+        Reads the settings of the active onboard profile, see RatbagctlBackend.snapshot()
+        """
+        _, profile = self._get_active_profile(alias)
+        resolutions = []
+        default_resolution = 0
+        for idx, path in enumerate(profile["Resolutions"]):
+            res = self._get_props(path, "Resolution")
+            dpi = res["Resolution"]
+            # (x, y) on mice with separate x/y resolutions
+            if isinstance(dpi, tuple):
+                dpi = dpi[0]
+            resolutions.append(0 if res.get("IsDisabled") else dpi)
+            if res.get("IsDefault"):
+                default_resolution = idx
+        buttons = [
+            self._mapping_to_button(self._get_props(path, "Button")["Mapping"])
+            for path in profile["Buttons"]
+        ]
+        leds = []
+        for path in profile["Leds"]:
+            led = self._get_props(path, "Led")
+            leds.append(
+                {
+                    "mode": self.LED_MODES[led["Mode"]],
+                    "color": "".join(f"{c:02x}" for c in led["Color"]),
+                    "duration": led.get("EffectDuration") or None,
+                    "brightness": led.get("Brightness", 255),
+                }
+            )
+        return {
+            "report_rate": profile["ReportRate"],
+            "resolutions": resolutions,
+            "default_resolution": default_resolution,
+            "buttons": buttons,
+            "leds": leds,
+        }
+
+    @bounded
+    def apply(self, alias, commands):
+        """
+        Writes the settings over D-Bus and commits them once, see RatbagctlBackend.apply()
+        """
+        profile_path, profile = self._get_active_profile(alias)
+        for words in commands:
+            if words[:2] == ["rate", "set"]:
+                self._set_prop(
+                    profile_path, "Profile", "ReportRate", "u", int(words[2])
+                )
+            elif words[:3] == ["resolution", "default", "set"]:
+                res_path = profile["Resolutions"][int(words[3])]
+                self._call(res_path, "Resolution", "SetDefault")
+                # a profile switch starts on the default resolution
+                self._call(res_path, "Resolution", "SetActive")
+            elif words[0] == "resolution" and words[2:4] == ["dpi", "set"]:
+                self._set_dpi(profile["Resolutions"][int(words[1])], int(words[4]))
+            elif words[:2] == ["dpi", "set"]:
+                for res_path in profile["Resolutions"]:
+                    if self._get_props(res_path, "Resolution").get("IsActive"):
+                        self._set_dpi(res_path, int(words[2]))
+            elif words[0] == "button" and words[2:4] == ["action", "set"]:
+                btn_path = profile["Buttons"][int(words[1])]
+                mapping = self._button_to_mapping(get_button_action(words[4:]))
+                self._set_prop(btn_path, "Button", "Mapping", "(uv)", mapping)
+            elif words[0] == "led" and words[2] == "set":
+                self._set_led(profile["Leds"][int(words[1])], words[3:])
+            else:
+                raise DeviceBackendError(f"Unknown setting '{' '.join(words)}'")
+        # send the whole profile at once
+        self._call(self._get_device_path(alias), "Device", "Commit")
+        return
+
+    def _set_dpi(self, res_path, dpi):
+        """
+        Sets the dpi of one resolution, keeping its (x, y) or single-value shape
+        """
+        current = self._get_props(res_path, "Resolution")["Resolution"]
+        if isinstance(current, tuple):
+            self._set_prop(res_path, "Resolution", "Resolution", "(uu)", (dpi, dpi))
+        else:
+            self._set_prop(res_path, "Resolution", "Resolution", "u", dpi)
+        return
+
+    def _set_led(self, led_path, words):
+        """
+        Sets the LED properties given as ratbagctl-style 'key value' words
+        """
+        for key, value in zip(words[0::2], words[1::2]):
+            if key == "mode":
+                self._set_prop(
+                    led_path, "Led", "Mode", "u", self.LED_MODES.index(value)
+                )
+            elif key == "color":
+                rgb = tuple(int(value[i : i + 2], 16) for i in (0, 2, 4))
+                self._set_prop(led_path, "Led", "Color", "(uuu)", rgb)
+            elif key == "duration":
+                self._set_prop(led_path, "Led", "EffectDuration", "u", int(value))
+            elif key == "brightness":
+                self._set_prop(led_path, "Led", "Brightness", "u", int(value))
+        return
+
+    def _mapping_to_button(self, mapping):
+        """
+        Converts a ratbagd button mapping into lgmpm's 'command-ified' action
+            Params:
+                mapping (tuple): (action type, value) as unpacked from D-Bus
+            Returns:
+                (str): ex. 'button 1', 'resolution-cycle-up', or 'KEY_A'
+        """
+        action_type, value = mapping
+        if action_type == self.ACTION_BUTTON:
+            return f"button {value}"
+        if action_type == self.ACTION_SPECIAL:
+            idx = value - self.SPECIAL_BASE
+            return self.SPECIALS[idx] if 0 <= idx < len(self.SPECIALS) else "unknown"
+        if action_type == self.ACTION_KEY:
+            return self._key_name(value)
+        if action_type == self.ACTION_MACRO:
+            events = []
+            for event_type, event_value in value:
+                if event_type == self.MACRO_WAIT:
+                    events.append(f"t{event_value}")
+                elif event_type == self.MACRO_PRESS:
+                    events.append(f"+{self._key_name(event_value)}")
+                elif event_type == self.MACRO_RELEASE:
+                    events.append(f"-{self._key_name(event_value)}")
+            return " ".join(events)
+        return "none"
+
+    def _button_to_mapping(self, btn):
+        """
+        Converts lgmpm's 'command-ified' action into a ratbagd button mapping
+            Params:
+                btn (str): ex. 'button 1', 'resolution-cycle-up', or 'KEY_A'
+            Returns:
+                (tuple): (action type, GLib.Variant value)
+        """
+        GLib = self.GLib
+        words = btn.split()
+        if words[0] == "button":
+            return (self.ACTION_BUTTON, GLib.Variant("u", int(words[1])))
+        if words[0] in self.SPECIALS:
+            special = self.SPECIAL_BASE + self.SPECIALS.index(words[0])
+            return (self.ACTION_SPECIAL, GLib.Variant("u", special))
+        if words[0] == "none":
+            return (self.ACTION_NONE, GLib.Variant("u", 0))
+        events = []
+        for word in words:
+            if word.startswith("t"):
+                events.append((self.MACRO_WAIT, int(word[1:])))
+            elif word.startswith("+"):
+                events.append((self.MACRO_PRESS, self._key_code(word[1:])))
+            elif word.startswith("-"):
+                events.append((self.MACRO_RELEASE, self._key_code(word[1:])))
+            else:
+                events.append((self.MACRO_PRESS, self._key_code(word)))
+                events.append((self.MACRO_RELEASE, self._key_code(word)))
+        return (self.ACTION_MACRO, GLib.Variant("a(uu)", events))
+
+    @staticmethod
+    def _key_name(code):
+        """
+        Returns the evdev name of a key code, ex. 30 -> 'KEY_A'
+        """
+        try:
+            from evdev import ecodes
+        except ImportError:
+            raise DeviceBackendError(
+                "Reading macros over D-Bus needs python-evdev, see 'pip install evdev'"
+            )
+        name = ecodes.KEY.get(code, f"KEY_{code}")
+        # some codes have aliases, ex. ['KEY_MUTE', 'KEY_MIN_INTERESTING']
+        return name[0] if isinstance(name, list) else name
+
+    @staticmethod
+    def _key_code(name):
+        """
+        Returns the evdev code of a key name, ex. 'KEY_A' -> 30
+        """
+        try:
+            from evdev import ecodes
+        except ImportError:
+            raise DeviceBackendError(
+                "Writing macros over D-Bus needs python-evdev, see 'pip install evdev'"
+            )
+        try:
+            return ecodes.ecodes[name]
+        except KeyError:
+            raise DeviceBackendError(f"Unknown key '{name}'")
@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+# drift.py - notices when Piper or an onboard profile button changed a mouse
+#   behind lgmpm's back, so its last active profile no longer describes it,
+#       and logs it, writes the profile back, or saves the new settings
+#
+#   usage: lgmpm.py --drift [log|restore|record]
+#       each poll reads every mouse once (a single 'ratbagctl <alias> info',
+#           or no subprocess at all with LGMPM_BACKEND=dbus) and compares
+#               its fingerprint to the last active profile's
+
+import os
+import signal
+import sys
+import time
+
+from locks import FileLock
+from mouseprofile import MouseProfile
+from store import get_fingerprint
+
+DRIFT_POLICIES = ("log", "restore", "record")
+# seconds between polls, see $LGMPM_DRIFT_INTERVAL
+DRIFT_INTERVAL_S = 5.0
+# the share of one CPU the polls may use, subprocesses included, see
+#   $LGMPM_DRIFT_CPU (in percent), the interval is stretched to stay under it
+DRIFT_CPU_BUDGET = 0.01
+# polls in a row that must see the same drift before it is acted on,
+#   so a profile being edited in Piper isn't saved halfway through
+DRIFT_CONFIRM = 2
+
+
+def get_env_number(name, default):
+    """
+    Returns a number from an environment variable, or default if it isn't set
+        or isn't a number
+    """
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+def get_cpu_time():
+    """
+    Returns the CPU seconds used by this process and its finished subprocesses
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+class DriftWatcher:
+    """
+    A class that polls the mice and handles the ones whose settings drifted
+        away from their last active profile
+
+        Attributes:
+            get_mice (function): returns the loaded Mice, ex. MiceCache.get
+            policy (str): what to do about a drift, one of DRIFT_POLICIES
+            interval (float): the shortest time between polls, in seconds
+            cpu_budget (float): the share of one CPU the polls may use
+            confirm (int): polls in a row that must see the same drift
+            dry_run (bool): only print what restore or record would do
+            seen (dict): each mouse alias mapped to (fingerprint, polls in a row)
+                of the drifted settings it has
+            handled (dict): each mouse alias mapped to the drifted fingerprint
+                that was already acted on, so it is never acted on twice
+            poll_cpu (float): the average CPU seconds of a poll, or None
+    """
+
+    def __init__(
+        self,
+        get_mice,
+        policy="log",
+        interval=None,
+        cpu_budget=None,
+        confirm=DRIFT_CONFIRM,
+        dry_run=False,
+    ):
+        self.get_mice = get_mice
+        self.policy = policy
+        if interval is None:
+            interval = get_env_number("LGMPM_DRIFT_INTERVAL", DRIFT_INTERVAL_S)
+        self.interval = interval
+        if cpu_budget is None:
+            cpu_budget = get_env_number("LGMPM_DRIFT_CPU", DRIFT_CPU_BUDGET * 100) / 100
+        self.cpu_budget = cpu_budget
+        self.confirm = confirm
+        self.dry_run = dry_run
+        self.seen = {}
+        self.handled = {}
+        self.poll_cpu = None
+        return
+
+    def poll(self):
+        """
+        Reads every mouse once and handles the drifts that were confirmed
+            Returns:
+                handled (list(str)): the alias of each mouse acted on
+        """
+        handled = []
+        mice = self.get_mice()
+        for mouse in mice.mice:
+            for device in mouse.devices:
+                if self.check(mice, mouse, device):
+                    handled.append(device.alias)
+        return handled
+
+    def check(self, mice, mouse, device):
+        """
+        Compares one mouse to its last active profile
+            Params:
+                mice (Mice): every loaded mouse
+                mouse (Mouse): the model the device belongs to
+                device (DeviceIdentity): the mouse to read
+            Returns:
+                (bool): True if a drift was acted on
+        """
+        expected = mouse.profiles.get(mouse.last_active_profile)
+        if expected is None:
+            # ex. the last active profile was deleted, there's nothing to drift from
+            return False
+        # skip the poll while another lgmpm.py writes to this model, since a
+        #   half-written mouse would look like a drift, but only probe the
+        #       lock, so no writer ever waits on a poll reading the mouse
+        # NOTE a write that starts during the read is caught by DRIFT_CONFIRM
+        lock = FileLock(mouse.store.lock_path)
+        if not lock.acquire(blocking=False):
+            return False
+        lock.release()
+        current = MouseProfile(name="current", identity=device)
+
+        fingerprint = current.get_fingerprint()
+        if fingerprint == get_fingerprint(expected):
+            self.seen.pop(device.alias, None)
+            self.handled.pop(device.alias, None)
+            return False
+        seen_fp, count = self.seen.get(device.alias, (None, 0))
+        count = count + 1 if seen_fp == fingerprint else 1
+        self.seen[device.alias] = (fingerprint, count)
+        if count < self.confirm or self.handled.get(device.alias) == fingerprint:
+            return False
+        self.handled[device.alias] = fingerprint
+        self.handle(mice, mouse, device, current)
+        return True
+
+    def handle(self, mice, mouse, device, current):
+        """
+        Logs a confirmed drift and acts on it according to the policy
+            Params:
+                mice (Mice): every loaded mouse
+                mouse (Mouse): the model the device belongs to
+                device (DeviceIdentity): the mouse that drifted
+                current (MouseProfile): the settings it has now
+        """
+        names = mouse.find_profiles(current)
+        drift_str = f"{device.alias} ({mouse.model.upper()}) no longer runs"
+        drift_str += f" '{mouse.last_active_profile}'"
+        if names:
+            drift_str += f", it matches stored profile '{names[0]}'"
+        else:
+            drift_str += ", it has settings that aren't stored"
+        print(f"{time.strftime('%H:%M:%S')} {drift_str}")
+
+        if self.policy == "restore":
+            print(f"  writing '{mouse.last_active_profile}' back")
+            # NOTE writes every mouse of the model, the others are only diffed
+            mice.set_profiles(
+                {mouse.model: mouse.last_active_profile}, dry_run=self.dry_run
+            )
+        elif self.policy == "record":
+            self.record(mouse, current, names)
+        return
+
+    def record(self, mouse, current, names):
+        """
+        Makes the drifted settings the last active profile, saving them as a
+            new profile if no stored profile has them
+        """
+        if names:
+            profile_name = names[0]
+        else:
+            profile_name = time.strftime("drift-%Y%m%d-%H%M%S")
+            if not mouse.check_profile(current):
+                return
+        if self.dry_run:
+            print(f"  would make '{profile_name}' the last active profile")
+            return
+        with mouse.locked():
+            if profile_name not in mouse.profiles:
+                current.name = profile_name
+                mouse.profiles[profile_name] = current.__dict__
+                mouse.last_active_profile = profile_name
+                mouse.save_profile(profile_name)
+                print(f"  saved as new profile '{profile_name}'")
+            else:
+                mouse.last_active_profile = profile_name
+                mouse.save_active()
+                print(f"  made '{profile_name}' the last active profile")
+        return
+
+    def get_wait(self):
+        """
+        Returns the seconds from the start of one poll to the next, the interval
+            stretched so the average poll stays under the CPU budget
+        """
+        if not self.poll_cpu or self.cpu_budget <= 0:
+            return self.interval
+        return max(self.interval, self.poll_cpu / self.cpu_budget)
+
+    def run(self):
+        """
+        Polls until interrupted
+        """
+        # exit cleanly when asked to stop
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        stretched = False
+        try:
+            while True:
+                start = time.monotonic()
+                start_cpu = get_cpu_time()
+                try:
+                    self.poll()
+                except Exception as e:
+                    # ex. the mouse was unplugged, try again on the next poll
+                    print(f"Could not check for drift: {e}")
+                cost = get_cpu_time() - start_cpu
+                # a moving average, so one slow poll doesn't stretch the interval
+                self.poll_cpu = (
+                    cost if self.poll_cpu is None else 0.8 * self.poll_cpu + 0.2 * cost
+                )
+                wait = self.get_wait()
+                if wait > self.interval and not stretched:
+                    print(
+                        f"A poll costs {self.poll_cpu * 1000:.0f} ms of CPU, polling"
+                        f" every {wait:.1f} s to stay under"
+                        f" {self.cpu_budget * 100:g}% of a CPU"
+                    )
+                stretched = wait > self.interval
+                time.sleep(max(0.0, start + wait - time.monotonic()))
+        except KeyboardInterrupt:
+            pass
+        return
+
+
+def run_drift(policy="log", dry_run=False):
+    """
+    Runs the drift watcher until it is interrupted
+        Params:
+            policy (str): what to do about a drift, one of DRIFT_POLICIES
+            dry_run (bool): only print what restore or record would do
+    """
+    # only imported here, like in the daemon, so other commands never load it
+    from mouse import MiceCache
+
+    cache = MiceCache()
+    watcher = DriftWatcher(cache.get, policy=policy, dry_run=dry_run)
+    print(
+        f"Checking for drift every {watcher.interval:g} s (policy: {policy}),"
+        f" within {watcher.cpu_budget * 100:g}% of a CPU"
+    )
+    watcher.run()
+    return
@@ -0,0 +1,387 @@
+#!/usr/bin/env python3
+# executor.py - runs a plan of commands directly (no shell, no temp files)
+#   and reports how each one went, or runs independent jobs side by side
+#
+#   every command is bounded: each try has a timeout, the operation it is part
+#       of has a deadline, transient ratbagd errors are retried a few times,
+#           and once ratbagd keeps failing, calls fail fast for a while
+
+import os
+import re
+import threading
+import time
+from pathlib import Path
+
+from tracing import span
+
+# seconds a single ratbagctl call may take, see $LGMPM_TIMEOUT
+COMMAND_TIMEOUT_S = 5.0
+# seconds all the calls of one operation, ex. reading the mouse, may take altogether
+OPERATION_DEADLINE_S = 15.0
+# how many times a transient failure is retried, and the first wait before it
+RETRIES = 2
+RETRY_BACKOFF_S = 0.25
+# failed calls in a row that open the circuit breaker, and for how long
+BREAKER_THRESHOLD = 3
+BREAKER_COOLDOWN_S = 30.0
+
+# errors that mean ratbagd is busy, restarting, or hung (ex. after a resume
+#   from suspend), rather than that the call itself was wrong
+TRANSIENT_RE = re.compile(
+    r"org\.freedesktop\.DBus\.Error\.(?:NoReply|ServiceUnknown|Timeout|TimedOut"
+    r"|Disconnected|NameHasNoOwner)|Unable to connect to ratbagd"
+)
+
+
+class CommandResult:
+    """
+    A class representing the outcome of one command of a plan
+
+        Attributes:
+            argv (list(str)): the command that was run, ex. ["ratbagctl", "list"]
+            returncode (int): the exit status, or None if it could not be started
+            duration (float): how long the command took, in seconds
+            output (str): the decoded stdout and stderr of the command
+            attempts (int): how many times it was tried, see run_command()
+    """
+
+    def __init__(self, argv, returncode, duration, output, attempts=1):
+        self.argv = argv
+        self.returncode = returncode
+        self.duration = duration
+        self.output = output
+        self.attempts = attempts
+        return
+
+    @property
+    def ok(self):
+        return self.returncode == 0
+
+    def __str__(self):
+        status = "ok" if self.ok else f"failed ({self.returncode})"
+        if self.attempts > 1:
+            status += f" after {self.attempts} tries"
+        result_str = f"{' '.join(self.argv)}: {status} in {self.duration * 1000:.0f} ms"
+        if not self.ok and self.output.strip():
+            result_str += f"\n    {self.output.strip()}"
+        return result_str
+
+
+class CommandError(Exception):
+    """
+    Raised when a read could not be run at all, ex. it timed out or was skipped
+
+        Attributes:
+            result (CommandResult): the last try of the command
+    """
+
+    def __init__(self, result):
+        super().__init__(f"'{' '.join(result.argv)}' {result.output}")
+        self.result = result
+        return
+
+
+def get_env_seconds(name, default):
+    """
+    Returns a duration in seconds from an environment variable, or default
+        if it isn't set or isn't a number
+    """
+    try:
+        return float(os.environ.get(name) or default)
+    except ValueError:
+        return default
+
+
+class CircuitBreaker:
+    """
+    A class that stops calling ratbagd for a while once it failed several times
+        in a row, so a hung ratbagd fails every lgmpm.py call fast instead of
+            blocking each one until it times out
+
+        Attributes:
+            path (Path): the state file shared by every lgmpm process,
+                only there while calls are failing
+            threshold (int): failed calls in a row that open the breaker
+            cooldown (float): seconds after the last failure before calls
+                are let through again
+    """
+
+    def __init__(self, path, threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN_S):
+        self.path = path
+        self.threshold = threshold
+        self.cooldown = cooldown
+        return
+
+    def _read(self):
+        """
+        Returns the failures in a row and the time of the last one
+        """
+        # only imported here, so that importing lgmpm doesn't compile it
+        import json
+
+        try:
+            with open(self.path, "r") as jf:
+                state = json.load(jf)
+            return int(state["failures"]), float(state["last_failure"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0, 0.0
+
+    def get_wait(self):
+        """
+        Returns the seconds until calls are let through again, 0 while closed
+        """
+        failures, last_failure = self._read()
+        if failures < self.threshold:
+            return 0.0
+        # once the cooldown is over, the next call is tried, and a single
+        #   failure opens the breaker again
+        return max(0.0, last_failure + self.cooldown - time.time())
+
+    def record(self, ok):
+        """
+        Counts the outcome of a call that reached (or should have reached) ratbagd
+            Params:
+                ok (bool): ratbagd answered, even if it was an error
+        """
+        import json
+
+        failures, _ = self._read()
+        try:
+            if ok:
+                if failures:
+                    self.path.unlink(missing_ok=True)
+                return
+            state = {"failures": failures + 1, "last_failure": time.time()}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_fp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            with open(tmp_fp, "w") as jf:
+                json.dump(state, jf)
+            os.replace(tmp_fp, self.path)
+        except OSError:
+            # never fail a call because its outcome could not be recorded
+            pass
+        return
+
+
+def get_breaker_fp():
+    """
+    Returns the Path of the circuit breaker's state file, next to the daemon's socket
+    """
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        return Path(runtime_dir) / "lgmpm.breaker.json"
+    return Path("/tmp") / f"lgmpm-{os.getuid()}.breaker.json"
+
+
+_breaker = None
+
+
+def get_breaker():
+    """
+    Returns the circuit breaker every ratbagctl call goes through
+    """
+    global _breaker
+    if _breaker is None:
+        _breaker = CircuitBreaker(get_breaker_fp())
+    return _breaker
+
+
+# the deadline of the operation running in each thread, see Deadline
+_local = threading.local()
+
+
+class Deadline:
+    """
+    A context manager bounding how long all the commands run inside it may
+        take altogether, ex. every read of a snapshot, nested ones keep the
+            earliest deadline
+
+        Attributes:
+            seconds (float): the time allowed, defaults to $LGMPM_DEADLINE
+                or OPERATION_DEADLINE_S
+    """
+
+    def __init__(self, seconds=None):
+        if seconds is None:
+            seconds = get_env_seconds("LGMPM_DEADLINE", OPERATION_DEADLINE_S)
+        self.seconds = seconds
+        self._outer = None
+        return
+
+    def __enter__(self):
+        self._outer = getattr(_local, "expires", None)
+        expires = time.monotonic() + self.seconds
+        _local.expires = expires if self._outer is None else min(self._outer, expires)
+        return self
+
+    def __exit__(self, *exc_info):
+        _local.expires = self._outer
+        return False
+
+
+def get_remaining():
+    """
+    Returns the seconds left before the current deadline, None if there is none
+    """
+    expires = getattr(_local, "expires", None)
+    return None if expires is None else expires - time.monotonic()
+
+
+def is_transient(returncode, output):
+    """
+    Returns True if a failed call is worth retrying, ex. ratbagd didn't answer
+        Params:
+            returncode (int): the exit status, None if the call timed out
+            output (str): everything the command printed, stderr included
+    """
+    if returncode == 0:
+        return False
+    return returncode is None or bool(TRANSIENT_RE.search(output))
+
+
+def _run_once(argv, timeout, merge_stderr):
+    """
+    Tries a command once, see run_command()
+        Returns:
+            (tuple): the CommandResult, and whether it failed transiently
+    """
+    # only imported here, so that importing lgmpm doesn't pay for it
+    import subprocess
+
+    start = time.perf_counter()
+    with span(" ".join(argv), "subprocess") as sp:
+        try:
+            proc = subprocess.run(
+                argv,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+                timeout=timeout,
+            )
+            returncode = proc.returncode
+            output = proc.stdout.decode(errors="replace")
+            errors = output if merge_stderr else proc.stderr.decode(errors="replace")
+            transient = is_transient(returncode, errors)
+        except subprocess.TimeoutExpired:
+            # subprocess.run() already killed it
+            returncode = None
+            output = f"timed out after {timeout:.1f} s"
+            transient = True
+        except OSError as e:
+            # ex. ratbagctl is not installed, which no retry will fix
+            returncode = None
+            output = str(e)
+            transient = False
+        sp.set(exit_code=returncode, transient=transient)
+    result = CommandResult(argv, returncode, time.perf_counter() - start, output)
+    return result, transient
+
+
+def run_command(argv, timeout=None, merge_stderr=True):
+    """
+    Runs one command, retrying it with backoff while ratbagd is busy, within
+        the deadline of the current operation, unless the breaker is open
+        Params:
+            argv (list(str)): the command to run, ex. ["ratbagctl", "list"]
+            timeout (float): seconds each try may take, defaults to
+                $LGMPM_TIMEOUT or COMMAND_TIMEOUT_S
+            merge_stderr (bool): keep stderr in the output, or drop it
+        Returns:
+            (CommandResult): the last try, with a returncode of None if the
+                command could not be started, timed out, or was skipped
+    """
+    breaker = get_breaker()
+    if timeout is None:
+        timeout = get_env_seconds("LGMPM_TIMEOUT", COMMAND_TIMEOUT_S)
+    backoff = RETRY_BACKOFF_S
+    attempts = 0
+    while True:
+        wait = breaker.get_wait()
+        if wait:
+            output = (
+                f"skipped, ratbagd failed {breaker.threshold} times in a row"
+                f" (trying again in {wait:.0f} s)"
+            )
+            return CommandResult(argv, None, 0.0, output, attempts)
+        remaining = get_remaining()
+        if remaining is not None and remaining <= 0:
+            return CommandResult(argv, None, 0.0, "skipped, out of time", attempts)
+        try_timeout = timeout if remaining is None else min(timeout, remaining)
+        result, transient = _run_once(argv, try_timeout, merge_stderr)
+        attempts += 1
+        result.attempts = attempts
+        if result.returncode is not None or transient:
+            breaker.record(not transient)
+        if not transient or attempts > RETRIES:
+            return result
+        remaining = get_remaining()
+        if remaining is not None and remaining <= backoff:
+            return result
+        time.sleep(backoff)
+        backoff *= 2
+
+
+def run_plan(plan):
+    """
+    Runs each command of a plan in order, stopping at the first failure
+        Params:
+            plan (list(list(str))): the commands to run, as argument vectors
+        Returns:
+            results (list(CommandResult)): the result of every command that ran,
+                the last one is the failure if not all of them are ok
+    """
+    results = []
+    for argv in plan:
+        results.append(run_command(argv))
+        if not results[-1].ok:
+            break
+    return results
+
+
+class JobResult:
+    """
+    A class representing the outcome of one job run by run_parallel()
+
+        Attributes:
+            value: whatever the job returned, or None if it raised
+            error (Exception): the exception the job raised, or None
+            duration (float): how long the job took, in seconds
+    """
+
+    def __init__(self, value, error, duration):
+        self.value = value
+        self.error = error
+        self.duration = duration
+        return
+
+    @property
+    def ok(self):
+        return self.error is None
+
+
+def run_parallel(jobs, max_workers=None):
+    """
+    Runs independent jobs at the same time, ex. writing a profile to several mice,
+        so they take as long as the slowest job instead of all of them together
+        Params:
+            jobs (list(function)): the jobs to run, each called without arguments
+            max_workers (int): the most jobs to run at once, defaults to all of them
+        Returns:
+            results (list(JobResult)): the result of each job, in the order of jobs
+    """
+
+    def timed(job):
+        start = time.perf_counter()
+        try:
+            return JobResult(job(), None, time.perf_counter() - start)
+        except Exception as e:
+            return JobResult(None, e, time.perf_counter() - start)
+
+    if len(jobs) <= 1:
+        # no need to start a thread for a single mouse
+        return [timed(job) for job in jobs]
+
+    # only imported here, since a single mouse never needs it
+    from concurrent.futures import ThreadPoolExecutor
+
+    with ThreadPoolExecutor(max_workers=max_workers or len(jobs)) as pool:
+        return list(pool.map(timed, jobs))
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# export.py - shows or exports every stored profile of every mouse model,
+#   straight from the models dir, without touching a mouse
+#
+#   usage: lgmpm.py --show --all
+#          lgmpm.py --export json|csv > profiles.json
+#       profiles are read and written one at a time, so memory stays flat
+#           however many profiles and model files there are
+
+import csv
+import json
+import sys
+
+from plan import get_led_words
+from store import ProfileStoreError, get_fingerprint, get_store, get_stored_models
+
+# the fields of each exported profile, in order
+EXPORT_FIELDS = (
+    "model",
+    "name",
+    "active",
+    "fingerprint",
+    "report_rate",
+    "resolutions",
+    "default_resolution",
+    "buttons",
+    "leds",
+)
+
+
+def iter_stored_profiles(warn=True):
+    """
+    Yields every stored profile, one model file after another
+        Params:
+            warn (bool): print which model files could not be read
+        Returns:
+            (generator(tuple)): (model, last active profile name, profile name,
+                settings) of each profile, sorted by model and name
+    """
+    for model in get_stored_models():
+        store = get_store(model)
+        try:
+            last_active_profile = store.load_active()
+            for name, settings in store.iter_profiles():
+                yield (model, last_active_profile, name, settings)
+        except ProfileStoreError as e:
+            # keep going, so one broken file doesn't hide the other models
+            if warn:
+                print(f"Skipping {model.upper()}: {e}", file=sys.stderr)
+    return
+
+
+def get_export_row(model, last_active_profile, name, settings):
+    """
+    Builds the exported fields of a profile, see EXPORT_FIELDS
+    """
+    return {
+        "model": model,
+        "name": name,
+        "active": name == last_active_profile,
+        "fingerprint": get_fingerprint(settings),
+        "report_rate": settings.get("report_rate"),
+        "resolutions": settings.get("resolutions", []),
+        "default_resolution": settings.get("default_resolution"),
+        "buttons": settings.get("buttons", []),
+        "leds": settings.get("leds", []),
+    }
+
+
+def export_profiles(fmt, out=None):
+    """
+    Writes every stored profile as a json array or csv rows, one profile
+        at a time, so the output streams as the model files are read
+        Params:
+            fmt (str): "json" or "csv"
+            out (file): where to write, sys.stdout by default
+        Returns:
+            count (int): how many profiles were exported
+    """
+    out = out or sys.stdout
+    count = 0
+    if fmt == "csv":
+        writer = csv.DictWriter(out, fieldnames=EXPORT_FIELDS)
+        writer.writeheader()
+    else:
+        out.write("[")
+    for profile in iter_stored_profiles():
+        row = get_export_row(*profile)
+        if fmt == "csv":
+            # lists are joined with '; ', ex. '400; 800; 1600', and each
+            #   LED is written the way ratbagctl takes it, ex. 'mode on color ff0000'
+            row["resolutions"] = "; ".join(str(dpi) for dpi in row["resolutions"])
+            row["buttons"] = "; ".join(row["buttons"])
+            row["leds"] = "; ".join(" ".join(get_led_words(led)) for led in row["leds"])
+            writer.writerow(row)
+        else:
+            out.write(("," if count else "") + "\n  " + json.dumps(row))
+        count += 1
+    if fmt != "csv":
+        out.write("\n]\n" if count else "]\n")
+    out.flush()
+    return count
+
+
+def show_all_profiles():
+    """
+    Displays every stored profile of every model, see MouseProfile.show()
+        Returns:
+            count (int): how many profiles were shown
+    """
+    # only imported here, since exports don't need it
+    from colors import color_hexes_to_names
+    from mouseprofile import MouseProfile
+
+    # a first pass only collects the LED colors and counts, so every color
+    #   name is resolved in one batch before anything is printed
+    colors = set()
+    counts = {}
+    for model, _, _, settings in iter_stored_profiles():
+        counts[model] = counts.get(model, 0) + 1
+        colors.update(led.get("color") for led in settings.get("leds", []))
+    color_names = color_hexes_to_names(sorted(color for color in colors if color))
+
+    shown_model = None
+    for model, last_active_profile, name, settings in iter_stored_profiles(warn=False):
+        if model != shown_model:
+            if shown_model is not None:
+                print()
+            print(
+                f"{model.upper()}: {counts.get(model, 0)} profile(s),"
+                f" last active '{last_active_profile}'"
+            )
+            shown_model = model
+        mp = MouseProfile(name=name, attrs=dict(settings, name=name))
+        mp.show(color_names)
+    if shown_model is None:
+        print("No stored profiles found")
+    return sum(counts.values())
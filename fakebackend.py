@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+# fakebackend.py - an in-memory mouse for tests and benchmarks,
+#   picked with LGMPM_BACKEND=fake, see backends.get_backend()
+
+import copy
+import json
+from pathlib import Path
+
+from backends import DeviceBackendError, get_button_action
+from locks import FileLock
+from store import atomic_write
+
+
+class FakeBackend:
+    """
+    An in-memory backend that stands in for a mouse in tests and benchmarks
+
+        Attributes:
+            devices (dict): each alias mapped to its model, name, and settings
+            calls (list(tuple)): every (method, alias) call made, in order
+            state_path (Path): a json file the fake mice are kept in, so that
+                several processes share them, or None to keep them in memory
+    """
+
+    name = "fake"
+
+    DEFAULT_SETTINGS = {
+        "report_rate": 1000,
+        "resolutions": [400, 800, 1600, 3200, 0],
+        "default_resolution": 1,
+        "buttons": [
+            "button 1",
+            "button 2",
+            "button 3",
+            "button 4",
+            "button 5",
+            "resolution-cycle-up",
+        ],
+        "leds": [
+            {
+                "mode": "breathing",
+                "color": "0000ff",
+                "duration": 10000,
+                "brightness": 255,
+            },
+            {"mode": "on", "color": "ff0000", "duration": None, "brightness": 255},
+        ],
+    }
+
+    def __init__(self, devices=None, state_path=None):
+        """
+        Sets up the fake mice
+            Params:
+                devices (dict): alias mapped to a dict with the model, name, and
+                    optionally any settings, defaults to a single G403
+                state_path (Path): share the fake mice through this json file,
+                    it is created from devices if it doesn't exist yet
+        """
+        if devices is None:
+            devices = {"sleeping-puppy": {"model": "g403"}}
+        self.devices = {}
+        for alias, device in devices.items():
+            settings = copy.deepcopy(self.DEFAULT_SETTINGS)
+            settings.update(copy.deepcopy(device))
+            settings.setdefault("name", f"Logitech {settings['model'].upper()}")
+            settings.setdefault("applies", 0)
+            self.devices[alias] = settings
+        self.calls = []
+        self.state_path = Path(state_path) if state_path else None
+        if self.state_path is not None:
+            with self._state_lock():
+                if self.state_path.exists():
+                    self._load_state()
+                else:
+                    atomic_write(self.state_path, json.dumps(self.devices))
+        return
+
+    def _state_lock(self):
+        """
+        Returns a lock guarding the shared state file
+        """
+        return FileLock(self.state_path.with_name(self.state_path.name + ".lock"))
+
+    def _load_state(self):
+        """
+        Picks up changes other processes made to the shared fake mice
+        """
+        if self.state_path is not None:
+            self.devices = json.loads(self.state_path.read_text())
+        return
+
+    def list_devices(self):
+        """
+        Returns (alias, model) of each fake mouse, see RatbagctlBackend.list_devices()
+        """
+        self.calls.append(("list_devices", None))
+        self._load_state()
+        return [(alias, device["model"]) for alias, device in self.devices.items()]
+
+    def get_device_name(self, alias):
+        """
+        Returns the 'long form' name of the fake mouse
+        """
+        self.calls.append(("get_device_name", alias))
+        return self.devices[alias]["name"]
+
+    def snapshot(self, alias):
+        """
+        Returns a copy of the fake mouse's settings, see RatbagctlBackend.snapshot()
+        """
+        self.calls.append(("snapshot", alias))
+        self._load_state()
+        device = self.devices[alias]
+        return copy.deepcopy(
+            {
+                attr: device[attr]
+                for attr in (
+                    "report_rate",
+                    "resolutions",
+                    "default_resolution",
+                    "buttons",
+                    "leds",
+                )
+            }
+        )
+
+    def apply(self, alias, commands):
+        """
+        Applies the settings to the fake mouse, all or nothing, see RatbagctlBackend.apply()
+        """
+        self.calls.append(("apply", alias))
+        if self.state_path is None:
+            self._apply(alias, commands)
+        else:
+            with self._state_lock():
+                self._load_state()
+                self._apply(alias, commands)
+                atomic_write(self.state_path, json.dumps(self.devices))
+        return
+
+    def _apply(self, alias, commands):
+        """
+        Applies the settings to one fake mouse, all or nothing
+        """
+        # work on a copy, so a bad command leaves the mouse untouched
+        #   just like ratbagctl's --nocommit
+        device = copy.deepcopy(self.devices[alias])
+        for words in commands:
+            apply_command(device, words)
+        device["applies"] += 1
+        self.devices[alias] = device
+        return
+
+
+def apply_command(settings, words):
+    """
+    Applies one ratbagctl-style setting to a dict of mouse settings
+        Params:
+            settings (dict): report_rate, resolutions, default_resolution,
+                buttons, and leds, changed in place
+            words (list(str)): the setting, ex. ["led", "0", "set", "mode", "on"]
+    """
+    try:
+        if words[:2] == ["rate", "set"]:
+            settings["report_rate"] = int(words[2])
+        elif words[:3] == ["resolution", "default", "set"]:
+            settings["default_resolution"] = int(words[3])
+        elif words[0] == "resolution" and words[2:4] == ["dpi", "set"]:
+            settings["resolutions"][int(words[1])] = int(words[4])
+        elif words[:2] == ["dpi", "set"]:
+            # sets the active resolution, which is the default after a profile switch
+            settings["resolutions"][settings["default_resolution"]] = int(words[2])
+        elif words[0] == "button" and words[2:4] == ["action", "set"]:
+            settings["buttons"][int(words[1])] = get_button_action(words[4:])
+        elif words[0] == "led" and words[2] == "set":
+            led = settings["leds"][int(words[1])]
+            for key, value in zip(words[3::2], words[4::2]):
+                led[key] = int(value) if key in ("duration", "brightness") else value
+        else:
+            raise DeviceBackendError(f"Unknown setting '{' '.join(words)}'")
+    except (IndexError, ValueError) as e:
+        raise DeviceBackendError(f"Invalid setting '{' '.join(words)}': {e}")
+    return
@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+# history.py - keeps every saved version of each profile in an append-only
+#   log, models/{model}.history.jsonl, so an old tuning can be brought back
+#
+#   each line is one version of one profile: the first version (and every
+#       HISTORY_CHECKPOINT-th after it) keeps the whole profile, the others
+#           only the settings that changed, ex. one resolution or LED color
+#
+#   usage: lgmpm.py <profile_name> --history
+#          lgmpm.py <profile_name> --diff 3 [5]
+#          lgmpm.py <profile_name> --rollback 3
+
+import copy
+import json
+import os
+import time
+
+# a version is rebuilt from at most this many lines of the log,
+#   since every HISTORY_CHECKPOINT-th version is saved whole
+HISTORY_CHECKPOINT = 16
+# no spaces in the log's json, since most lines are only a few settings
+LOG_SEPARATORS = (",", ":")
+# how every line of the log starts, followed by its profile name
+LOG_PREFIX = '{"profile":'
+
+
+def get_delta(old, new, path=()):
+    """
+    Finds the settings that differ between two versions of a profile
+        Params:
+            old (dict): the previous version
+            new (dict): the next version
+            path (tuple): the keys/indices leading to old and new, used when recursing
+        Returns:
+            delta (list(list)): [path, value] to set a value, or [path] to remove
+                a key, ex. [[["resolutions", 1], 1200], [["leds", 0, "color"], "00ff00"]]
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        delta = []
+        for key, value in new.items():
+            if key in old:
+                delta += get_delta(old[key], value, path + (key,))
+            else:
+                delta.append([list(path + (key,)), value])
+        delta += [[list(path + (key,))] for key in old if key not in new]
+        return delta
+    if isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        delta = []
+        for idx, (old_value, new_value) in enumerate(zip(old, new)):
+            delta += get_delta(old_value, new_value, path + (idx,))
+        return delta
+    if old != new:
+        # ex. a resolution was added, so the whole list is kept
+        return [[list(path), new]]
+    return []
+
+
+def apply_delta(settings, delta):
+    """
+    Builds the next version of a profile, see get_delta()
+        Params:
+            settings (dict): the previous version, left untouched
+            delta (list(list)): the changes from get_delta()
+        Returns:
+            (dict): the next version
+    """
+    settings = copy.deepcopy(settings)
+    for change in delta:
+        path = change[0]
+        if not path:
+            settings = copy.deepcopy(change[1])
+            continue
+        parent = settings
+        for key in path[:-1]:
+            parent = parent[key]
+        if len(change) == 1:
+            del parent[path[-1]]
+        else:
+            parent[path[-1]] = copy.deepcopy(change[1])
+    return settings
+
+
+def get_path_str(path):
+    """
+    Turns a delta path into a readable setting name, ex. 'leds[0].color'
+    """
+    path_str = ""
+    for key in path:
+        path_str += f"[{key}]" if isinstance(key, int) else f".{key}"
+    return path_str.lstrip(".")
+
+
+def get_changes(old, new):
+    """
+    Describes the settings that differ between two versions of a profile
+        Returns:
+            (list(str)): ex. ["resolutions[1]: 800 -> 1200"]
+    """
+    changes = []
+    for change in get_delta(old, new):
+        path = change[0]
+        old_value = old
+        for key in path:
+            try:
+                old_value = old_value[key]
+            except (IndexError, KeyError, TypeError):
+                old_value = None
+                break
+        new_value = change[1] if len(change) > 1 else None
+        changes.append(f"{get_path_str(path)}: {old_value} -> {new_value}")
+    return changes
+
+
+class ProfileHistory:
+    """
+    A class keeping the saved versions of a model's profiles
+
+        Attributes:
+            path (Path): the append-only log, one json line per version
+    """
+
+    def __init__(self, path):
+        self.path = path
+        return
+
+    def iter_records(self, profile_names=None):
+        """
+        Yields the lines of the log, oldest first
+            Params:
+                profile_names (iterable(str)): only yield the versions of these
+                    profiles, every profile's if not passed
+            Returns:
+                (generator(dict)): each with the profile name, version, and time,
+                    and either its settings, a delta, or deleted
+        """
+        names = None if profile_names is None else set(profile_names)
+        decoder = json.JSONDecoder()
+        try:
+            with open(self.path) as log_file:
+                for line in log_file:
+                    if names is not None:
+                        # every line starts with its profile name, see record(),
+                        #   so only the name of another profile's line is parsed
+                        if not line.startswith(LOG_PREFIX):
+                            continue
+                        try:
+                            name, _ = decoder.raw_decode(line, len(LOG_PREFIX))
+                        except ValueError:
+                            continue
+                        if name not in names:
+                            continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # ex. the last line, if lgmpm was killed while appending it
+                        continue
+        except FileNotFoundError:
+            pass
+        return
+
+    def get_heads(self, profile_names):
+        """
+        Rebuilds the latest version of some profiles, from their last full copy
+            Params:
+                profile_names (iterable(str)): the profiles to rebuild
+            Returns:
+                (dict): each profile name in the log mapped to a dict with its
+                    version, settings (None once deleted), and the versions since
+                        the last full copy (chain)
+        """
+        # the deltas since the last full copy are only applied at the end,
+        #   so a save never replays more than HISTORY_CHECKPOINT - 1 of them
+        bases = {}
+        for record in self.iter_records(profile_names):
+            base = bases.setdefault(record["profile"], {"settings": None, "deltas": []})
+            base["version"] = record["version"]
+            if "settings" in record:
+                base["settings"] = record["settings"]
+                base["deltas"] = []
+            elif "delta" in record and base["settings"] is not None:
+                base["deltas"].append(record["delta"])
+            else:
+                base["settings"] = None
+                base["deltas"] = []
+        heads = {}
+        for name, base in bases.items():
+            settings = base["settings"]
+            for delta in base["deltas"]:
+                settings = apply_delta(settings, delta)
+            heads[name] = {
+                "version": base["version"],
+                "settings": settings,
+                "chain": len(base["deltas"]),
+            }
+        return heads
+
+    def record(self, profiles, changed=(), deleted=()):
+        """
+        Appends a version for each profile that was saved with new settings,
+            see JsonProfileStore.save_profiles()
+            Params:
+                profiles (dict): every profile name mapped to its settings
+                changed (iterable(str)): the names of the profiles that changed
+                deleted (iterable(str)): the names of the profiles that were removed
+            Returns:
+                (int): how many versions were added
+        """
+        changed = sorted(changed)
+        deleted = sorted(deleted)
+        heads = self.get_heads(changed + deleted)
+        now = int(time.time())
+        lines = []
+        for name in changed:
+            head = heads.get(name, {"version": 0, "settings": None, "chain": 0})
+            settings = profiles[name]
+            if settings == head["settings"]:
+                # ex. every profile is saved again, but only one changed
+                continue
+            record = {"profile": name, "version": head["version"] + 1, "time": now}
+            delta = None
+            if head["settings"] is not None and head["chain"] + 1 < HISTORY_CHECKPOINT:
+                delta = get_delta(head["settings"], settings)
+            # a delta that is larger than the profile itself isn't worth it
+            if delta is not None and len(json.dumps(delta)) < len(json.dumps(settings)):
+                record["delta"] = delta
+            else:
+                record["settings"] = settings
+            lines.append(json.dumps(record, separators=LOG_SEPARATORS))
+        for name in deleted:
+            head = heads.get(name)
+            if head is None or head["settings"] is None:
+                continue
+            record = {"profile": name, "version": head["version"] + 1, "time": now}
+            record["deleted"] = True
+            lines.append(json.dumps(record, separators=LOG_SEPARATORS))
+        if lines:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            text = "\n".join(lines) + "\n"
+            # appended in one write, so the versions of one save stay together
+            with open(self.path, "ab+") as log_file:
+                # start on a new line if the last append was cut short
+                if log_file.seek(0, os.SEEK_END) > 0:
+                    log_file.seek(-1, os.SEEK_END)
+                    if log_file.read(1) != b"\n":
+                        text = "\n" + text
+                log_file.write(text.encode())
+                log_file.flush()
+                os.fsync(log_file.fileno())
+        return len(lines)
+
+    def get_versions(self, profile_name):
+        """
+        Rebuilds every version of a profile, oldest first
+            Returns:
+                (list(tuple)): (record, settings) of each version, settings
+                    being None for a deletion
+        """
+        versions = []
+        settings = None
+        for record in self.iter_records([profile_name]):
+            if "settings" in record:
+                settings = record["settings"]
+            elif "delta" in record and settings is not None:
+                settings = apply_delta(settings, record["delta"])
+            else:
+                settings = None
+            versions.append((record, settings))
+        return versions
+
+    def get_version(self, profile_name, version):
+        """
+        Rebuilds one version of a profile from the nearest full copy before it,
+            applying at most HISTORY_CHECKPOINT - 1 deltas
+            Params:
+                profile_name (str): the name of the profile
+                version (int): the version to rebuild, see get_versions()
+            Returns:
+                (dict): the settings of the version, None if it was a deletion
+            Raises:
+                KeyError: if the profile has no such version
+        """
+        base = None
+        deltas = []
+        found = False
+        for record in self.iter_records([profile_name]):
+            if record["version"] > version:
+                break
+            if "settings" in record:
+                base = record["settings"]
+                deltas = []
+            elif "delta" in record:
+                deltas.append(record["delta"])
+            else:
+                base = None
+                deltas = []
+            found = record["version"] == version
+        if not found:
+            raise KeyError(version)
+        if base is None:
+            return None
+        for delta in deltas:
+            base = apply_delta(base, delta)
+        return base
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+# hotplug.py - writes the last active profile back whenever a mouse is
+#   (re)plugged or its receiver resets, since it comes back with its
+#       onboard settings
+#
+#   usage: lgmpm.py --hotplug
+#       listens for kernel uevents of hidraw devices on a netlink socket,
+#           so nothing is polled (or run) while no device comes or goes
+
+import signal
+import socket
+import sys
+import time
+
+from backends import DeviceBackendError
+from identity import get_hidraw_parts
+
+NETLINK_KOBJECT_UEVENT = 15
+# the multicast group of the kernel's own uevents (udev re-sends them on group 2)
+UEVENT_KERNEL_GROUP = 1
+# seconds without a new uevent before a plug event is handled, so the hidraw
+#   nodes of every interface (and ratbagd) are there, ex. 3 for a receiver
+SETTLE_S = 1.5
+# how often a restore is tried again while ratbagd doesn't list the mouse yet
+RESTORE_TRIES = 3
+# seconds between sysfs scans when netlink can't be used, ex. in a container
+POLL_S = 2.0
+
+
+def parse_uevent(data):
+    """
+    Parses a kernel uevent, ex. b'add@/devices/...\\0ACTION=add\\0SUBSYSTEM=hidraw\\0'
+        Returns:
+            (dict): each KEY=value of the event, empty if it isn't a uevent
+    """
+    fields = {}
+    for field in data.split(b"\0")[1:]:
+        key, sep, value = field.partition(b"=")
+        if sep:
+            fields[key.decode(errors="replace")] = value.decode(errors="replace")
+    return fields
+
+
+def open_uevent_socket():
+    """
+    Subscribes to the kernel's uevents
+        Returns:
+            (socket.socket): a netlink socket, or None if netlink can't be used
+    """
+    try:
+        sock = socket.socket(
+            socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT
+        )
+        sock.bind((0, UEVENT_KERNEL_GROUP))
+    except (AttributeError, OSError):
+        # AF_NETLINK only exists on linux
+        return None
+    return sock
+
+
+class PlugRestorer:
+    """
+    A class that writes each mouse's last active profile once per plug event
+
+        Attributes:
+            get_mice (function): returns the loaded Mice, ex. MiceCache.get
+            sysfs_hidraw (Path): the sysfs hidraw class dir, ex. a fake tree in tests
+            dev_root (Path): the dir holding the hidraw device nodes
+            settle (float): seconds without a uevent before a plug is handled
+            dry_run (bool): only print the settings that would be written
+            plugged (set(str)): the hidraw devices already handled,
+                see identity.get_hidraw_parts()
+            pending (float): when the last uevent arrived, None while settled
+            tries (int): failed restores of the current plug event
+    """
+
+    def __init__(
+        self,
+        get_mice,
+        sysfs_hidraw=None,
+        dev_root=None,
+        settle=SETTLE_S,
+        dry_run=False,
+    ):
+        self.get_mice = get_mice
+        self.sysfs_hidraw = sysfs_hidraw
+        self.dev_root = dev_root
+        self.settle = settle
+        self.dry_run = dry_run
+        # the mice plugged in before the restorer started keep their settings
+        self.plugged = set(get_hidraw_parts(sysfs_hidraw, dev_root))
+        self.pending = None
+        self.tries = 0
+        return
+
+    def notify(self, now=None):
+        """
+        Records that a hidraw device came or went, restarting the settle time
+            Params:
+                now (float): the time.monotonic() time, ex. a fake clock in tests
+        """
+        self.pending = time.monotonic() if now is None else now
+        return
+
+    def get_timeout(self, now=None):
+        """
+        Returns the seconds until a pending plug event settles, None if there is none
+        """
+        if self.pending is None:
+            return None
+        now = time.monotonic() if now is None else now
+        return max(0.0, self.pending + self.settle - now)
+
+    def tick(self, now=None):
+        """
+        Handles the pending plug event once it has settled
+            Params:
+                now (float): the time.monotonic() time, ex. a fake clock in tests
+            Returns:
+                (bool): True if the profiles were written back
+        """
+        now = time.monotonic() if now is None else now
+        if self.pending is None or now - self.pending < self.settle:
+            return False
+        current = set(get_hidraw_parts(self.sysfs_hidraw, self.dev_root))
+        new = current - self.plugged
+        if not new:
+            # ex. a mouse was unplugged
+            self.pending = None
+            self.plugged = current
+            return False
+        last_try = self.tries + 1 >= RESTORE_TRIES
+        # a ctime of 0 means udev hasn't made the device node yet
+        node_missing = any(part.endswith(":0") for part in new)
+        restored = (last_try or not node_missing) and self.restore()
+        if not restored and not last_try:
+            # try again once another settle time is over,
+            #   the new devices stay unhandled until then
+            self.tries += 1
+            self.plugged &= current
+            self.pending = now
+            return False
+        if not restored:
+            print(f"Gave up restoring the profiles after {RESTORE_TRIES} tries")
+        self.pending = None
+        self.tries = 0
+        self.plugged = current
+        return restored and not self.dry_run
+
+    def restore(self):
+        """
+        Writes each connected mouse's last active profile back to it
+            Returns:
+                (bool): False if the mice could not be loaded or written yet
+        """
+        try:
+            mice = self.get_mice()
+        except DeviceBackendError as e:
+            # ex. ratbagd hasn't picked the mouse up yet
+            print(f"A mouse was plugged in, but it can't be read yet: {e}")
+            return False
+        profile_names = {mouse.model: mouse.last_active_profile for mouse in mice.mice}
+        profiles_str = ", ".join(
+            f"{model.upper()} '{name}'" for model, name in profile_names.items()
+        )
+        print(f"A mouse was plugged in, restoring {profiles_str}")
+        try:
+            return mice.set_profiles(profile_names, dry_run=self.dry_run)
+        except DeviceBackendError as e:
+            print(f"Could not restore the profiles yet: {e}")
+            return False
+
+    def run(self):
+        """
+        Listens for hidraw uevents until interrupted
+        """
+        # only imported here, since no other command waits on a socket
+        import select
+
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        sock = open_uevent_socket()
+        if sock is None:
+            print(f"Can't listen for uevents, checking sysfs every {POLL_S:.0f} s")
+        seen = set(self.plugged)
+        try:
+            while True:
+                if sock is None:
+                    time.sleep(POLL_S)
+                    current = set(get_hidraw_parts(self.sysfs_hidraw, self.dev_root))
+                    if current != seen:
+                        seen = current
+                        self.notify()
+                else:
+                    readable, _, _ = select.select([sock], [], [], self.get_timeout())
+                    if readable:
+                        event = parse_uevent(sock.recv(16384))
+                        action = event.get("ACTION")
+                        if event.get("SUBSYSTEM") == "hidraw" and action in (
+                            "add",
+                            "remove",
+                        ):
+                            self.notify()
+                self.tick()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if sock is not None:
+                sock.close()
+        return
+
+
+def run_hotplug(dry_run=False):
+    """
+    Runs the hotplug restorer until it is interrupted
+        Params:
+            dry_run (bool): only print the settings that would be written
+    """
+    # only imported here, like in the daemon, so other commands never load it
+    from mouse import MiceCache
+
+    cache = MiceCache()
+    print("Restoring the last active profile whenever a mouse is plugged in")
+    PlugRestorer(cache.get, dry_run=dry_run).run()
+    return
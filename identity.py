@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# identity.py - resolves (and caches) which mice ratbagctl is talking to
+
+import json
+import os
+import time
+from pathlib import Path
+
+from backends import DeviceBackendError, get_backend
+
+LOGITECH_HID_VENDOR = "0000046D"
+SYSFS_HIDRAW = Path("/sys/class/hidraw")
+DEV_ROOT = Path("/dev")
+
+
+class DeviceIdentity:
+    """
+    A class representing a connected mouse, resolved once per invocation
+
+        Attributes:
+            alias (str): the ratbagctl 'short name' of the mouse, ex. 'dancing-puppy'
+            model (str): a short version of the mouse model, ex. 'g403'
+            key (str): the sysfs/hidraw identity of the plugged-in device(s),
+                or None if it could not be read
+    """
+
+    def __init__(self, alias, model, key=None):
+        self.alias = alias
+        self.model = model
+        self.key = key
+        return
+
+    def __repr__(self):
+        return f"DeviceIdentity({self.alias!r}, {self.model!r})"
+
+
+def get_hidraw_parts(sysfs_hidraw=None, dev_root=None):
+    """
+    Lists the plugged-in Logitech hidraw devices, each one a different string
+        every time it is (re)plugged
+        Params:
+            sysfs_hidraw (Path): the sysfs hidraw class dir, ex. /sys/class/hidraw
+            dev_root (Path): the dir holding the hidraw device nodes, ex. /dev
+        Returns:
+            parts (list(str)): 'hidrawN:HID_ID:HID_UNIQ:ctime' of each device,
+                with a ctime of 0 if its device node isn't there (yet)
+    """
+    sysfs_hidraw = sysfs_hidraw or SYSFS_HIDRAW
+    dev_root = dev_root or DEV_ROOT
+    parts = []
+    try:
+        hidraw_dirs = sorted(sysfs_hidraw.iterdir())
+    except OSError:
+        return parts
+    for hidraw_dir in hidraw_dirs:
+        try:
+            uevent = (hidraw_dir / "device" / "uevent").read_text()
+        except OSError:
+            continue
+        hid_id = ""
+        hid_uniq = ""
+        for line in uevent.splitlines():
+            if line.startswith("HID_ID="):
+                hid_id = line.split("=", 1)[1].upper()
+            elif line.startswith("HID_UNIQ="):
+                hid_uniq = line.split("=", 1)[1]
+        if LOGITECH_HID_VENDOR not in hid_id:
+            continue
+        # the device node is recreated on every replug/receiver reset,
+        #   so its ctime tells two plug events of the same mouse apart
+        try:
+            ctime = (dev_root / hidraw_dir.name).stat().st_ctime_ns
+        except OSError:
+            ctime = 0
+        parts.append(f"{hidraw_dir.name}:{hid_id}:{hid_uniq}:{ctime}")
+    return parts
+
+
+def get_hidraw_key(sysfs_hidraw=None, dev_root=None):
+    """
+    Builds a key that changes whenever a Logitech HID device is (re)plugged
+        Params:
+            sysfs_hidraw (Path): the sysfs hidraw class dir, ex. /sys/class/hidraw
+            dev_root (Path): the dir holding the hidraw device nodes, ex. /dev
+        Returns:
+            key (str): the joined HID ids and device node ctimes,
+                or None if no Logitech hidraw device was found
+    """
+    parts = get_hidraw_parts(sysfs_hidraw, dev_root)
+    if not parts:
+        return None
+    return "|".join(parts)
+
+
+def get_cache_fp():
+    """
+    Returns the Path of the on-disk identity cache
+    """
+    cache_root = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_root) / "lgmpm" / "identity.json"
+
+
+def get_cache_ttl():
+    """
+    Returns the identity cache TTL in seconds, from $LGMPM_IDENTITY_TTL
+        (0 disables the on-disk cache)
+    """
+    try:
+        return float(os.environ.get("LGMPM_IDENTITY_TTL", 3600))
+    except ValueError:
+        return 3600.0
+
+
+def read_cached_identities(key, cache_fp=None, ttl=None):
+    """
+    Loads the cached identities if they were stored for the same plug event
+        Params:
+            key (str): the current hidraw key, see get_hidraw_key()
+            cache_fp (Path): the cache file, defaults to get_cache_fp()
+            ttl (float): max age of the cache in seconds, defaults to get_cache_ttl()
+        Returns:
+            (list(DeviceIdentity)): the cached identities, or None on a miss
+    """
+    cache_fp = cache_fp or get_cache_fp()
+    ttl = get_cache_ttl() if ttl is None else ttl
+    if key is None or ttl <= 0:
+        return None
+    try:
+        with open(cache_fp, "r") as jf:
+            cached = json.load(jf)
+        if cached["key"] != key or time.time() - cached["time"] > ttl:
+            return None
+        return [DeviceIdentity(alias, model, key) for alias, model in cached["devices"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        # includes caches written before every mouse was stored
+        return None
+
+
+def write_cached_identities(identities, cache_fp=None):
+    """
+    Stores the identities on disk, keyed by their hidraw key
+        Params:
+            identities (list(DeviceIdentity)): the identities to store
+            cache_fp (Path): the cache file, defaults to get_cache_fp()
+    """
+    cache_fp = cache_fp or get_cache_fp()
+    key = identities[0].key
+    if key is None or get_cache_ttl() <= 0:
+        return
+    cached = {
+        "key": key,
+        "devices": [[identity.alias, identity.model] for identity in identities],
+        "time": time.time(),
+    }
+    try:
+        cache_fp.parent.mkdir(parents=True, exist_ok=True)
+        tmp_fp = cache_fp.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_fp, "w") as jf:
+            json.dump(cached, jf)
+        os.replace(tmp_fp, cache_fp)
+    except OSError:
+        # the cache is only an optimization, so never fail on it
+        pass
+    return
+
+
+_identities = None
+
+
+def get_identities(refresh=False):
+    """
+    Resolves every connected mouse once per process, using the disk cache
+        while the same devices stay plugged in
+        Params:
+            refresh (bool): ignore the in-memory and on-disk caches
+        Returns:
+            (list(DeviceIdentity)): the identity of each connected mouse,
+                in the order the backend lists them
+    """
+    global _identities
+    backend = get_backend()
+    key = get_hidraw_key()
+    # aliases are only meaningful to the backend that made them up
+    if key is not None:
+        key = f"{backend.name}|{key}"
+    if not refresh:
+        # a replug changes the key, so even a long-lived process re-resolves
+        if _identities is not None and _identities[0].key == key:
+            return _identities
+        cached = read_cached_identities(key)
+        if cached:
+            _identities = cached
+            return _identities
+    devices = backend.list_devices()
+    if not devices:
+        raise DeviceBackendError("No supported Logitech G mouse found")
+    _identities = [DeviceIdentity(alias, model, key) for alias, model in devices]
+    write_cached_identities(_identities)
+    return _identities
+
+
+def get_identity(refresh=False):
+    """
+    Resolves the first connected mouse, see get_identities()
+    """
+    return get_identities(refresh)[0]
@@ -2,55 +2,290 @@
 # lgmpm.py - Logitech G Mouse Profile Manager - manages profiles for Logitech G
 #   mice with ratbagctl
 
+import os
 import sys
 
-from mouse import Mouse
-from utils import mouse_arg_parser, print_help_msg
+from daemon import run_daemon, send_command
+from tracing import span, start_tracing
+from utils import COMMAND_FLAGS, get_flags_set, mouse_arg_parser, print_help_msg
 
 
-def main():
-
-    args = mouse_arg_parser()
-
+def run_command(args, mice=None):
+    """
+    Runs the command selected by the parsed CLI arguments
+        Params:
+            args (argparse.Namespace): the parsed CLI arguments
+            mice (Mice): the connected mice to run the command on, loaded if not passed
+        Returns:
+            (bool): False if the command failed, after printing why
+    """
     # show an error if more than one flag is set
-    flag_count = list(args.__dict__.values()).count(True)
-    if flag_count > 1:
-        print(f"Error: multiple flags received: {", ".join(sys.argv[1:])}")
+    flags_set = get_flags_set(args)
+    if len(flags_set) > 1:
+        flags_str = ", ".join(f"--{flag}" for flag in flags_set)
+        print(f"Error: multiple flags received: {flags_str}")
         print("Please try again with only one flag")
         print_help_msg()
-        return
+        return False
 
-    mouse = Mouse()
+    if args.all and not args.show:
+        print("Error: --all only works with --show")
+        print_help_msg()
+        return False
+
+    if args.diff and len(args.diff) > 2:
+        print("Error: --diff takes one or two versions")
+        print_help_msg()
+        return False
+
+    if args.export or args.all:
+        # only imported here, these read the models dir and never the mouse
+        from export import export_profiles, show_all_profiles
+
+        if args.export:
+            export_profiles(args.export)
+        else:
+            show_all_profiles()
+        return True
+
+    if mice is None:
+        # only imported here, so that commands forwarded to the daemon
+        #   never load the profile/device modules, see bench/importtime.py
+        from mouse import Mice
+
+        # NOTE Mice() resolves the identities from the on-disk cache while the
+        #   same mice stay plugged in, so --list never runs ratbagctl then
+        mice = Mice()
 
     if args.active:
-        mouse.set_active_profile(args.profile_name)
+        ok = mice.set_active_profile(args.profile_name, dry_run=args.dry_run)
 
     # TODO --cycle, --list, and --new do not need a profile_name as an arg
     #   so should this throw an error if the user provides one?
     #       currently works fine without any handling
     elif args.cycle:
-        mouse.cycle_profile()
+        ok = mice.cycle_profile(dry_run=args.dry_run)
 
     elif args.delete:
-        mouse.delete_profile(args.profile_name)
+        ok = mice.delete_profile(args.profile_name)
+
+    elif args.detect:
+        ok = mice.detect_profile()
 
     elif args.list:
-        mouse.list_profiles()
+        ok = mice.list_profiles()
 
     elif args.new:
-        mouse.add_new_profile(args.profile_name)
+        ok = mice.add_new_profile(args.profile_name)
 
     elif args.show:
-        mouse.show_profile(args.profile_name)
+        ok = mice.show_profile(args.profile_name)
 
     elif args.update:
-        mouse.update_profile(args.profile_name)
+        ok = mice.update_profile(args.profile_name)
+
+    elif args.history:
+        ok = mice.list_history(args.profile_name)
+
+    elif args.diff:
+        ok = mice.diff_versions(args.profile_name, args.diff)
+
+    elif args.rollback is not None:
+        ok = mice.rollback_profile(
+            args.profile_name, args.rollback, dry_run=args.dry_run
+        )
 
     else:
         # if no flags are set, show a message
         print("No flag(s) set")
         print_help_msg()
+        ok = False
+
+    return ok
+
+
+# the lines of a batch that save what the commands so far have changed
+BATCH_CHECKPOINTS = ("checkpoint", "flush", "save")
+
+# flags that only make sense on the command line, not on a line of a batch
+BATCH_ONLY_CLI = ("batch", "daemon", "drift", "hotplug", "trace", "watch")
+
+
+def parse_batch_line(line):
+    """
+    Turns one line of a batch into CLI arguments
+        Params:
+            line (str): ex. "new gaming", "--active gaming --dry-run"
+        Returns:
+            (argparse.Namespace): the parsed arguments
+    """
+    # only imported here, since only a batch needs it
+    import shlex
+
+    argv = shlex.split(line)
+    # the leading '--' is optional, ex. 'new gaming' or '--new gaming'
+    if not argv[0].startswith("-"):
+        argv[0] = f"--{argv[0]}"
+    try:
+        args = mouse_arg_parser(argv)
+    except SystemExit:
+        # argparse already printed what is wrong with the line
+        raise ValueError(f"could not parse '{line}'")
+    for flag in get_flags_set(args, BATCH_ONLY_CLI):
+        raise ValueError(f"--{flag} can't be used in a batch")
+    return args
+
+
+def run_batch(lines, mice=None):
+    """
+    Runs one command per line against the same loaded mice, in order, and
+        saves the profiles at checkpoint lines and once at the end
+        Params:
+            lines (iterable(str)): the commands, blank lines and '#' comments are skipped
+            mice (Mice): the connected mice to run the commands on, loaded if not passed
+        Returns:
+            (int): how many lines failed
+    """
+    import contextlib
+    import io
+    import time
+
+    if mice is None:
+        from mouse import Mice
+
+        mice = Mice()
+
+    ran = 0
+    failed = 0
+    with mice.batched():
+        for line_no, line in enumerate(lines, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            start = time.perf_counter()
+            output = io.StringIO()
+            status = "ok"
+            with span(f"batch line {line_no}: {line}", "batch"):
+                try:
+                    if line in BATCH_CHECKPOINTS:
+                        mice.flush()
+                    else:
+                        with contextlib.redirect_stdout(
+                            output
+                        ), contextlib.redirect_stderr(output):
+                            ok = run_command(parse_batch_line(line), mice)
+                        if not ok:
+                            # ex. a profile that doesn't exist, its output says why
+                            status = "failed"
+                except Exception as e:
+                    status = f"error: {e}"
+            if status != "ok":
+                failed += 1
+            ran += 1
+            duration_ms = (time.perf_counter() - start) * 1000
+            print(f"line {line_no} '{line}': {status} in {duration_ms:.0f} ms")
+            for output_line in output.getvalue().splitlines():
+                print(f"    {output_line}")
+        # the profiles are saved as the batch ends
+        start = time.perf_counter()
+    print(
+        f"Ran {ran} line(s), {failed} failed, saved in"
+        f" {(time.perf_counter() - start) * 1000:.0f} ms"
+    )
+    return failed
+
+
+def main():
+
+    args = mouse_arg_parser()
+    start_tracing(args.trace or os.environ.get("LGMPM_TRACE"))
+
+    if args.daemon:
+        run_daemon(run_command)
+        return
+
+    if args.watch:
+        flags_set = get_flags_set(args, COMMAND_FLAGS + ("batch", "drift", "hotplug"))
+        if flags_set:
+            print(f"Error: --watch can't be combined with --{flags_set[0]}")
+            print_help_msg()
+            sys.exit(2)
+        # only imported here, since only the watcher needs it
+        from watcher import run_watcher
+
+        run_watcher(None if args.watch is True else args.watch, dry_run=args.dry_run)
+        return
+
+    if args.hotplug:
+        flags_set = get_flags_set(args, COMMAND_FLAGS + ("batch", "drift"))
+        if flags_set:
+            print(f"Error: --hotplug can't be combined with --{flags_set[0]}")
+            print_help_msg()
+            sys.exit(2)
+        # only imported here, since only the hotplug restorer needs it
+        from hotplug import run_hotplug
+
+        run_hotplug(dry_run=args.dry_run)
+        return
+
+    if args.drift:
+        flags_set = get_flags_set(args, COMMAND_FLAGS + ("batch",))
+        if flags_set:
+            print(f"Error: --drift can't be combined with --{flags_set[0]}")
+            print_help_msg()
+            sys.exit(2)
+        # only imported here, since only the drift watcher needs it
+        from drift import run_drift
+
+        run_drift(args.drift, dry_run=args.dry_run)
+        return
+
+    if args.batch:
+        flags_set = get_flags_set(args)
+        if flags_set:
+            print(f"Error: --batch can't be combined with --{flags_set[0]}")
+            print_help_msg()
+            sys.exit(2)
+        # NOTE a batch always runs in this process, since the daemon
+        #   can't read this process's stdin (or its relative paths)
+        if args.batch == "-":
+            failed = run_batch(sys.stdin)
+        else:
+            with open(args.batch) as batch_file:
+                failed = run_batch(batch_file)
+        sys.exit(1 if failed else 0)
+
+    # exports stream straight to stdout, the daemon would only send
+    #   back everything at once
+    if args.export or args.all:
+        try:
+            run_command(args)
+        except BrokenPipeError:
+            # ex. piped into head, which stopped reading early
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+            sys.exit(1)
+        return
+
+    # hand the command to a running daemon, if there is one,
+    #   otherwise run it in this process
+    with span("forward to the lgmpm daemon", "daemon") as sp:
+        output = send_command(sys.argv[1:])
+        sp.set(answered=output is not None)
+    if output is not None:
+        print(output, end="")
+        return
+
+    try:
+        run_command(args)
+    except Exception as e:
+        # only imported here, run_command() has loaded it by the time it raises
+        from backends import DeviceBackendError
 
+        if not isinstance(e, DeviceBackendError):
+            raise
+        # ex. no mouse is connected, or ratbagd stopped answering
+        print(f"Error: {e}")
+        sys.exit(1)
     return
 
 
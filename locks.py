@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# locks.py - advisory file locks and a shared press counter, so several
+#   lgmpm.py processes can change the same mouse without losing updates
+
+import fcntl
+import os
+
+
+class FileLock:
+    """
+    A class wrapping an advisory flock() on a lock file
+
+        Attributes:
+            path (Path): the lock file, created if it doesn't exist
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._fd = None
+        return
+
+    def acquire(self, blocking=True):
+        """
+        Takes the lock
+            Params:
+                blocking (bool): wait for the lock if another process holds it
+            Returns:
+                (bool): True if the lock was taken
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(
+                fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+            )
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+
+    def release(self):
+        """
+        Gives the lock back, if it is held
+        """
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        return
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+        return False
+
+
+def update_counter(path, func):
+    """
+    Reads, changes, and writes back a number stored in a file, under a lock
+        Params:
+            path (Path): the counter file, created if it doesn't exist
+            func (function): takes the current value, returns the new one
+        Returns:
+            (int): the value before the change
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        raw = os.read(fd, 64).decode().strip()
+        value = int(raw) if raw.isdigit() else 0
+        new_value = func(value)
+        if new_value != value:
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, str(new_value).encode())
+    finally:
+        os.close(fd)
+    return value
+
+
+def add_to_counter(path, amount=1):
+    """
+    Adds to the counter in a file, see update_counter()
+    """
+    return update_counter(path, lambda value: value + amount)
+
+
+def take_counter(path):
+    """
+    Returns the counter in a file and resets it to 0, see update_counter()
+    """
+    return update_counter(path, lambda value: 0)
+
+
+def read_counter(path):
+    """
+    Returns the counter in a file without changing it, see update_counter()
+    """
+    return update_counter(path, lambda value: value)
@@ -1,16 +1,33 @@
 #!/usr/bin/env python3
-# mouse.py - a Python class representing a Logitech G mouse
+# mouse.py - Python classes representing the connected Logitech G mice
 
-import json
-from pathlib import Path
+import contextlib
+import functools
+import time
 
+from backends import get_backend
+from identity import get_identities, get_identity
+from locks import FileLock, add_to_counter, read_counter, take_counter
 from mouseprofile import MouseProfile
-from utils import (
-    get_bash_stdout,
-    print_help_msg,
-    print_list_msg,
-    get_mouse_alias_and_model,
-)
+from tracing import span
+from utils import print_help_msg, print_list_msg
+
+
+def get_next_profile_name(profiles, last_active_profile, steps=1):
+    """
+    Picks the name of the profile a number of steps after the last active one
+        Parameters:
+            profiles (dict): every stored profile name mapped to its settings
+            last_active_profile (str): the name of the last active profile
+            steps (int): how many profiles to move forward, sorted alphabetically
+        Returns:
+            (str): the name of the profile to run next
+    """
+    profile_list = sorted(profiles)
+    idx = -1
+    if last_active_profile in profile_list:
+        idx = profile_list.index(last_active_profile)
+    return profile_list[(idx + steps) % len(profile_list)]
 
 
 class Mouse:
@@ -18,190 +35,939 @@ class Mouse:
     A class to represent a Logitech G mouse
 
         Attributes:
+            identity (DeviceIdentity): the connected mouse, resolved once and shared
+            devices (list(DeviceIdentity)): every connected mouse of this model,
+                the first being identity
             alias (str): the ratbagctl 'short name' of the mouse, ex. 'dancing-puppy'
             model (str): a short version of the mouse model, ex. 'g403'
+            store (JsonProfileStore): where the profiles of this mouse model are saved
             model_json  (Path): a Path object that to the json file for a particular mouse model
             last_active_profile (str): the name of the last profile that was run from this program
             profiles (dict): a nested dict containing the data for each profile
+            pending (dict): the profiles changed but not yet saved by a batch,
+                None outside of a batch
     """
 
-    def __init__(self):
+    def __init__(self, identity=None, devices=None):
         """
         Loads the mouse model's profile data, or creates default if none exists
+            Parameters:
+                identity (DeviceIdentity): the connected mouse, resolved if not passed
+                devices (list(DeviceIdentity)): every connected mouse of the same
+                    model, profiles are written to all of them, defaults to identity
         """
-        alias, model = get_mouse_alias_and_model()
-        model_json_fp = Path(__file__).parent / "models" / f"{model}.json"
-        try:
-            with open(model_json_fp, "r") as jf:
-                mouse_data = json.load(jf)
+        # only imported here, so that importing lgmpm doesn't compile the stores
+        from store import ProfileStoreError, get_store
 
-        except (FileNotFoundError, json.decoder.JSONDecodeError):
+        identity = identity or get_identity()
+        alias = identity.alias
+        model = identity.model
+        store = get_store(model)
+        try:
+            last_active_profile, profiles = store.load()
 
-            model_json_fp.touch()
-            mp = MouseProfile()
-            mouse_data = {}
-            # since 'default' is the only profile that exists, set it as last active
-            last_active_profile = mp.name
-            mouse_data["last_active_profile"] = last_active_profile
-            # initialize a dict of profiles with 'default' being the only key
-            mouse_data["profiles"] = {}
-            mouse_data["profiles"][mp.name] = mp.__dict__
+        except FileNotFoundError:
+            last_active_profile, profiles = self._create_default(store, identity)
 
-            with open(model_json_fp, "w") as jf:
-                json.dump(mouse_data, jf, indent=2)
+        except ProfileStoreError as e:
+            # keep the unreadable file around instead of silently overwriting it
+            corrupt_fp = store.quarantine()
+            print(f"Warning: {e}")
+            print(f"It was moved to {corrupt_fp} and a new default profile was saved")
+            last_active_profile, profiles = self._create_default(store, identity)
 
+        self.identity = identity
+        self.devices = devices or [identity]
+        # the unsaved changes while a batch runs, see batched()
+        self.pending = None
         self.alias = alias
         self.model = model
-        self.model_json = model_json_fp
+        self.store = store
+        self.model_json = store.path
         # TODO need some handling for if the last active profile doesnt exist
         # TODO or if self.profiles is now blank
-        self.last_active_profile = mouse_data["last_active_profile"]
-        self.profiles = mouse_data["profiles"]
+        self.last_active_profile = last_active_profile
+        self.profiles = profiles
         return
 
+    @staticmethod
+    def _create_default(store, identity):
+        """
+        Saves the current mouse settings as the 'default' profile of a new store
+            Parameters:
+                store (JsonProfileStore): the empty store to save to
+                identity (DeviceIdentity): the connected mouse
+            Returns:
+                (last_active_profile, profiles) (tuple): as returned by store.load()
+        """
+        mp = MouseProfile(identity=identity)
+        # initialize a dict of profiles with 'default' being the only key
+        profiles = {mp.name: mp.__dict__}
+        store.save_profiles(profiles, changed=profiles)
+        # since 'default' is the only profile that exists, set it as last active
+        store.save_active(mp.name)
+        return (mp.name, profiles)
+
     def save_status(self):
         """
-        Saves the last active profile & other profiles to {model}.json
+        Saves the last active profile & other profiles to the store
+        """
+        if self.pending is not None:
+            self.pending["changed"].update(self.profiles)
+            self.pending["active"] = True
+            return
+        with span("Mouse.save_status", "store", model=self.model):
+            self.store.save_profiles(self.profiles, changed=self.profiles)
+            self.store.save_active(self.last_active_profile)
+        return
+
+    def save_active(self):
         """
-        mouse_data = {
-            "last_active_profile": self.last_active_profile,
-            "profiles": self.profiles,
-        }
-        with open(self.model_json, "w") as jf:
-            json.dump(mouse_data, jf, indent=2)
+        Saves only the last active profile, the profiles themselves are untouched
+        """
+        if self.pending is not None:
+            self.pending["active"] = True
+            return
+        with span("Mouse.save_active", "store", model=self.model):
+            self.store.save_active(self.last_active_profile)
         return
 
-    def set_active_profile(self, profile_name):
+    def save_profile(self, profile_name, deleted=False):
         """
-        Loads/writes the selected profile onto the mouse and updates the last active profile
+        Saves one added, updated, or deleted profile & the last active profile
             Parameters:
-                profile_name (str): the name of the profile to set active
+                profile_name (str): the name of the profile that changed
+                deleted (bool): the profile was removed from self.profiles
         """
-        try:
-            mp = MouseProfile(
-                name=profile_name,
-                attrs=self.profiles[profile_name],
-            )
-            mp.run()
-            self.save_status()
-        except KeyError:
-            print(f"No stored {self.model.upper()} profile '{profile_name}'")
-            print_list_msg()
-            print_help_msg()
+        if self.pending is not None:
+            # a profile that is added and deleted in the same batch is never saved
+            if deleted:
+                self.pending["changed"].discard(profile_name)
+                self.pending["deleted"].add(profile_name)
+            else:
+                self.pending["deleted"].discard(profile_name)
+                self.pending["changed"].add(profile_name)
+            self.pending["active"] = True
+            return
+        with span(
+            "Mouse.save_profile", "store", model=self.model, profile=profile_name
+        ):
+            if deleted:
+                self.store.save_profiles(self.profiles, deleted=[profile_name])
+            else:
+                self.store.save_profiles(self.profiles, changed=[profile_name])
+            self.store.save_active(self.last_active_profile)
         return
 
-    def cycle_profile(self):
+    def reload(self):
         """
-        Cycles through and runs the next profile from last active, sorted alphabetically
+        Re-reads the stored profiles, ex. after another process changed them
         """
-        # check to see if there is only one profile saved, since there should
-        #   always be at least one profile, or default, even if there was no
-        #       json file prior to first time setup
-        # NOTE the user could delete the default profile, so we will just show
-        #   whatever profile name is there
-        if len(self.profiles) == 1:
-            sole_profile_name = tuple(self.profiles.keys())[0]
-            print(f"Only 1 profile found: '{sole_profile_name}'")
-            print_help_msg()
+        self.last_active_profile, self.profiles = self.store.load()
+        return
 
-        else:
-            profile_list = sorted(list(self.profiles.keys()))
-            idx = profile_list.index(self.last_active_profile)
-            try:
-                next_profile = profile_list[idx + 1]
-            except IndexError:
-                next_profile = profile_list[0]
-            # run the new profile script with subprocess
-            #   and save the mouse status
+    @contextlib.contextmanager
+    def locked(self):
+        """
+        Holds the store's lock and reloads the profiles while it is held,
+            so changes made by other lgmpm.py processes are never lost
+        """
+        if self.pending is not None:
+            # a batch already holds the lock, and has unsaved changes to keep
+            yield
+            return
+        with FileLock(self.store.lock_path):
+            self.reload()
+            yield
+        return
+
+    @contextlib.contextmanager
+    def batched(self):
+        """
+        Holds the store's lock for a whole batch of commands, and only saves
+            the profiles they change on flush() and at the end of the batch
+        """
+        with FileLock(self.store.lock_path):
+            self.reload()
+            self.pending = {"changed": set(), "deleted": set(), "active": False}
             try:
-                mp = MouseProfile(
-                    name=next_profile,
-                    attrs=self.profiles[next_profile],
+                yield
+            finally:
+                # the mouse was already written to, so save even after an error
+                self.flush()
+                self.pending = None
+        return
+
+    def flush(self):
+        """
+        Saves every profile changed since the batch started or was last flushed
+        """
+        if not self.pending:
+            return
+        pending = self.pending
+        with span("Mouse.flush", "store", model=self.model):
+            if pending["changed"] or pending["deleted"]:
+                self.store.save_profiles(
+                    self.profiles,
+                    changed=sorted(pending["changed"]),
+                    deleted=sorted(pending["deleted"]),
                 )
-                mp.run()
-                self.last_active_profile = next_profile
-                self.save_status()
-            except Exception as e:
-                print("An exception occurred:")
-                print(e)
+            if pending["active"]:
+                self.store.save_active(self.last_active_profile)
+        self.pending = {"changed": set(), "deleted": set(), "active": False}
         return
 
+    def get_current_profile(self):
+        """
+        Snapshots the settings currently on the mouse
+            Returns:
+                (MouseProfile): the current settings of the mouse
+        """
+        return MouseProfile(name="current", identity=self.identity)
+
+    def get_next_profile(self, steps=1):
+        """
+        Picks the profile that is a number of steps after the last active one
+            Parameters:
+                steps (int): how many profiles to move forward, sorted alphabetically
+            Returns:
+                (MouseProfile): the profile to run next
+        """
+        next_profile = get_next_profile_name(
+            self.profiles, self.last_active_profile, steps
+        )
+        return MouseProfile(name=next_profile, attrs=self.profiles[next_profile])
+
     def delete_profile(self, profile_name):
         """
-        Deletes a profile from {model}.json
+        Deletes a profile from the store
             Parameters:
                 profile_name (str): the name of the profile to delete
+            Returns:
+                (bool): False if there is no such profile
         """
-        try:
-            del self.profiles[profile_name]
-            if self.last_active_profile == profile_name:
-                self.last_active_profile = "default"
-            self.save_status()
-            # TODO need some handling here for if there is no default profile
-            # TODO or if the user deletes the only profile
-        except KeyError:
-            print(f"The profile {profile_name} does not exist for this mouse.")
-            print_list_msg()
-            print_help_msg()
-        return
+        with self.locked():
+            try:
+                del self.profiles[profile_name]
+                if self.last_active_profile == profile_name:
+                    self.last_active_profile = "default"
+                self.save_profile(profile_name, deleted=True)
+                # TODO need some handling here for if there is no default profile
+                # TODO or if the user deletes the only profile
+            except KeyError:
+                print(f"The profile {profile_name} does not exist for this mouse.")
+                print_list_msg()
+                print_help_msg()
+                return False
+        return True
 
     def list_profiles(self):
         """
-        Lists all the saved profiles in {model}.json
+        Lists all the saved profiles of this mouse model, flagging duplicates
+            Returns:
+                (bool): always True, see Mice.list_profiles()
         """
+        same_as = {}
+        for names in self.store.get_fingerprint_index().values():
+            for name in names:
+                same_as[name] = [other for other in names if other != name]
         print(f"Found the following {self.model.upper()} profiles:")
         for idx, name in enumerate(sorted(self.profiles)):
-            print(f"  {idx + 1}. {name}")
+            profile_str = f"  {idx + 1}. {name}"
+            if same_as.get(name):
+                others = ", ".join(f"'{other}'" for other in same_as[name])
+                profile_str += f" (same settings as {others})"
+            print(profile_str)
         print_help_msg()
-        return
+        return True
+
+    def find_profiles(self, current):
+        """
+        Finds the stored profiles with the same settings as a snapshot
+            Parameters:
+                current (MouseProfile): the settings on the mouse
+            Returns:
+                (list(str)): the names of the matching profiles, sorted
+        """
+        return self.store.find_profiles(current.get_fingerprint())
 
     def add_new_profile(self, profile_name):
         """
         Adds a new profile to self.profiles
             Parameters:
                 profile_name (str): the name of the new profile to save
+            Returns:
+                (bool): False if the profile already exists or can't be written
         """
-        # show an error message if the profile already exists:
-        if profile_name in self.profiles.keys():
-            print(f"{self.model.upper()} profile '{profile_name}' already exists")
-            print("Update it with 'lgmpm.py --update'")
-            print_list_msg()
-            print_help_msg()
-        else:
-            new_profile = MouseProfile(name=profile_name)
+        with self.locked():
+            # show an error message if the profile already exists:
+            if profile_name in self.profiles.keys():
+                print(f"{self.model.upper()} profile '{profile_name}' already exists")
+                print("Update it with 'lgmpm.py --update'")
+                print_list_msg()
+                print_help_msg()
+                return False
+            new_profile = MouseProfile(name=profile_name, identity=self.identity)
+            if not self.check_profile(new_profile):
+                return False
             self.profiles[profile_name] = new_profile.__dict__
             self.last_active_profile = profile_name
-            self.save_status()
-        return
+            self.save_profile(profile_name)
+        return True
+
+    def check_profile(self, mp):
+        """
+        Makes sure a profile can be written to the mouse before it is saved
+            Parameters:
+                mp (MouseProfile): the profile to check
+            Returns:
+                (bool): False, after printing why, if a setting can't be written
+        """
+        from plan import InvalidProfileError
+
+        try:
+            mp.get_plan()
+        except InvalidProfileError as e:
+            print(f"Could not save {self.model.upper()} profile '{mp.name}': {e}")
+            return False
+        return True
 
     def show_profile(self, profile_name):
         """
         Displays the profile data similar to running 'ratbagctl {alias} info'
             Parameters:
                 profile_name (str): the name of the profile to show
+            Returns:
+                (bool): always True, a missing profile raises a KeyError
         """
         # get the 'long form' name of the mouse for display
         #   i.e. 'Logitech G403 Prodigy Gaming Mouse' instead of 'g403'
-        full_mouse_name = get_bash_stdout(f"ratbagctl {self.alias} name").strip()
+        full_mouse_name = get_backend().get_device_name(self.alias)
         profile_attrs = self.profiles[profile_name]
         mp = MouseProfile(name=profile_name, attrs=profile_attrs)
         print(f"{full_mouse_name} aka '{self.alias}'")
         mp.show()
-        return
+        return True
 
     def update_profile(self, profile_name):
         """
         Updates an existing saved profile with the current mouse settings
             Parameters:
                 profile_name (str): the name of the profile to update
+            Returns:
+                (bool): False if there is no such profile or it can't be written
+        """
+        with self.locked():
+            try:
+                updated_profile = MouseProfile(
+                    name=profile_name, identity=self.identity
+                )
+                if profile_name in self.profiles and not self.check_profile(
+                    updated_profile
+                ):
+                    return False
+                self.profiles[profile_name].update(updated_profile.__dict__)
+                self.last_active_profile = profile_name
+                self.save_profile(profile_name)
+            except KeyError:
+                print(f"Could not find {self.model.upper()} profile '{profile_name}'")
+                print_list_msg()
+                print_help_msg()
+                return False
+        return True
+
+    def list_history(self, profile_name):
+        """
+        Lists the saved versions of a profile, and what changed in each
+            Parameters:
+                profile_name (str): the name of the profile
+            Returns:
+                (bool): False if the profile has no saved versions
+        """
+        # only imported here, since only the history commands describe changes
+        from history import get_changes
+        from store import get_fingerprint
+
+        versions = self.store.get_history().get_versions(profile_name)
+        if not versions:
+            print(f"No saved versions of {self.model.upper()} profile '{profile_name}'")
+            print_list_msg()
+            return False
+        print(
+            f"Found {len(versions)} version(s) of {self.model.upper()}"
+            f" profile '{profile_name}':"
+        )
+        first_seen = {}
+        previous = None
+        for record, settings in versions:
+            version = record["version"]
+            time_str = time.strftime("%Y-%m-%d %H:%M", time.localtime(record["time"]))
+            if settings is None:
+                change_str = "deleted"
+            elif previous is None:
+                change_str = "added"
+            else:
+                changes = get_changes(previous, settings)
+                change_str = ", ".join(changes[:3])
+                if len(changes) > 3:
+                    change_str += f" (and {len(changes) - 3} more)"
+            if settings is not None:
+                fingerprint = get_fingerprint(settings)
+                if fingerprint in first_seen:
+                    change_str += f" (same settings as v{first_seen[fingerprint]})"
+                first_seen.setdefault(fingerprint, version)
+            print(f"  v{version}  {time_str}  {change_str}")
+            previous = settings
+        print(f"Roll back with 'lgmpm.py {profile_name} --rollback <version>'")
+        return True
+
+    def diff_versions(self, profile_name, old_version, new_version=None):
         """
+        Shows the settings that differ between two versions of a profile
+            Parameters:
+                profile_name (str): the name of the profile
+                old_version (int): the version to compare from
+                new_version (int): the version to compare to, the stored profile
+                    if not passed
+            Returns:
+                (bool): False if either version doesn't exist
+        """
+        from history import get_changes
+
+        history = self.store.get_history()
         try:
-            updated_profile = MouseProfile(name=profile_name)
-            self.profiles[profile_name].update(updated_profile.__dict__)
-            self.last_active_profile = profile_name
-            self.save_status()
+            old = history.get_version(profile_name, old_version)
+            if new_version is None:
+                new = self.profiles[profile_name]
+            else:
+                new = history.get_version(profile_name, new_version)
         except KeyError:
-            print(f"Could not find {self.model.upper()} profile '{profile_name}'")
-            print_list_msg()
+            print(
+                f"Could not find that version of {self.model.upper()} profile"
+                f" '{profile_name}'"
+            )
+            print(f"See 'lgmpm.py {profile_name} --history'")
+            return False
+        new_str = "the stored profile" if new_version is None else f"v{new_version}"
+        print(
+            f"{self.model.upper()} profile '{profile_name}',"
+            f" v{old_version} -> {new_str}:"
+        )
+        changes = get_changes(old or {}, new or {})
+        for change in changes:
+            print(f"  {change}")
+        if not changes:
+            print("  no differences")
+        return True
+
+    def get_profile_version(self, profile_name, version):
+        """
+        Rebuilds a saved version of a profile
+            Parameters:
+                profile_name (str): the name of the profile
+                version (int): the version to rebuild, see list_history()
+            Returns:
+                (MouseProfile): the version, or None after printing why it can't be
+        """
+        try:
+            settings = self.store.get_history().get_version(profile_name, version)
+        except KeyError:
+            print(
+                f"Could not find v{version} of {self.model.upper()}"
+                f" profile '{profile_name}'"
+            )
+            print(f"See 'lgmpm.py {profile_name} --history'")
+            return None
+        if settings is None:
+            print(
+                f"v{version} of {self.model.upper()} profile '{profile_name}'"
+                " is its deletion, pick an earlier version"
+            )
+            return None
+        return MouseProfile(name=profile_name, attrs=dict(settings, name=profile_name))
+
+
+def write_profiles(targets, dry_run=False):
+    """
+    Writes profiles to every device of their mice at the same time, and reports
+        how each device went
+        Parameters:
+            targets (list(tuple)): (Mouse, MouseProfile) pairs, the profile to write
+                to each of the mouse's devices
+            dry_run (bool): only print the settings that would be written
+        Returns:
+            written (list(bool)): for each target, True if all its devices were written
+    """
+    # only imported here, so that importing lgmpm doesn't import them
+    from executor import run_parallel
+    from plan import InvalidProfileError
+
+    jobs = []
+    written = [True] * len(targets)
+    for target_idx, (mouse, mp) in enumerate(targets):
+        # the plan was compiled and validated when the profile was saved
+        try:
+            plan = mouse.store.get_plan(mp.__dict__)
+        except InvalidProfileError as e:
+            print(f"Could not write profile '{mp.name}' to {mouse.model.upper()}: {e}")
+            written[target_idx] = False
+            continue
+        for device in mouse.devices:
+            jobs.append((target_idx, device, mp, plan))
+
+    def write(device, mp, plan):
+        lines = []
+        # each device is snapshot on its own, so only what differs is written
+        current = MouseProfile(name="current", identity=device)
+        ok = mp.run(
+            device, current=current, dry_run=dry_run, log=lines.append, plan=plan
+        )
+        return (ok, lines)
+
+    start = time.perf_counter()
+    results = run_parallel(
+        [functools.partial(write, device, mp, plan) for _, device, mp, plan in jobs]
+    )
+    total_ms = (time.perf_counter() - start) * 1000
+
+    for (target_idx, device, mp, _), result in zip(jobs, results):
+        ok, lines = result.value if result.ok else (False, [])
+        written[target_idx] = written[target_idx] and ok
+        if len(jobs) > 1:
+            # say which mouse each line is about
+            print(f"{device.alias} ({result.duration * 1000:.0f} ms):")
+            lines = [f"  {line}" for line in lines]
+        for line in lines:
+            print(line)
+        if not result.ok:
+            print("An exception occurred:")
+            print(result.error)
+    if len(jobs) > 1 and not dry_run:
+        slowest = max(zip(results, jobs), key=lambda pair: pair[0].duration)
+        print(
+            f"Wrote to {len(jobs)} mice in {total_ms:.0f} ms"
+            f" (slowest: {slowest[1][1].alias})"
+        )
+    return written
+
+
+class Mice:
+    """
+    A class to represent every connected Logitech G mouse, one Mouse per model
+
+        Attributes:
+            identities (list(DeviceIdentity)): every connected mouse
+            mice (list(Mouse)): one Mouse per model, sorted by model, so mice of
+                the same model share their profiles
+            batching (bool): a batch of commands holds the store locks, see batched()
+    """
+
+    def __init__(self, identities=None):
+        """
+        Loads the profile data of each connected mouse model
+            Parameters:
+                identities (list(DeviceIdentity)): the connected mice, resolved if not passed
+        """
+        identities = identities or get_identities()
+        devices_by_model = {}
+        for identity in identities:
+            devices_by_model.setdefault(identity.model, []).append(identity)
+        self.identities = identities
+        # NOTE always take the store locks in the same (sorted) order,
+        #   so two lgmpm.py processes can never wait on each other
+        self.mice = [
+            Mouse(devices[0], devices)
+            for _, devices in sorted(devices_by_model.items())
+        ]
+        self.batching = False
+        return
+
+    @contextlib.contextmanager
+    def batched(self):
+        """
+        Holds the store locks of every mouse model for a batch of commands,
+            and saves their changes at the end, see Mouse.batched()
+        """
+        with contextlib.ExitStack() as stack:
+            for mouse in self.mice:
+                stack.enter_context(mouse.batched())
+            self.batching = True
+            try:
+                yield
+            finally:
+                self.batching = False
+        return
+
+    def flush(self):
+        """
+        Saves the changes of a batch so far, see Mouse.flush()
+        """
+        for mouse in self.mice:
+            mouse.flush()
+        return
+
+    def reload(self):
+        """
+        Re-reads the stored profiles of every mouse model
+        """
+        for mouse in self.mice:
+            mouse.reload()
+        return
+
+    def set_active_profile(self, profile_name, dry_run=False):
+        """
+        Writes the selected profile to every mouse that has it saved, all at once,
+            and updates the last active profile of each
+            Parameters:
+                profile_name (str): the name of the profile to set active
+                dry_run (bool): only print the settings that would be written
+            Returns:
+                (bool): True if the profile was written to every mouse, see set_profiles()
+        """
+        return self.set_profiles(
+            {mouse.model: profile_name for mouse in self.mice}, dry_run
+        )
+
+    def set_profiles(self, profile_names, dry_run=False):
+        """
+        Writes a (possibly different) profile to each mouse model, all at once,
+            ex. to put back the profiles that were active before a switch
+            Parameters:
+                profile_names (dict): each mouse model mapped to the profile name to write
+                dry_run (bool): only print the settings that would be written
+            Returns:
+                (bool): False if no mouse has its profile, or a write failed
+        """
+        with contextlib.ExitStack() as stack:
+            targets = []
+            for mouse in self.mice:
+                stack.enter_context(mouse.locked())
+                profile_name = profile_names.get(mouse.model)
+                if profile_name is None:
+                    continue
+                if profile_name in mouse.profiles:
+                    mp = MouseProfile(
+                        name=profile_name, attrs=mouse.profiles[profile_name]
+                    )
+                    targets.append((mouse, mp))
+                else:
+                    print(f"No stored {mouse.model.upper()} profile '{profile_name}'")
+            if not targets:
+                print_list_msg()
+                print_help_msg()
+                return False
+            written = write_profiles(targets, dry_run=dry_run)
+            for (mouse, mp), ok in zip(targets, written):
+                if ok and not dry_run:
+                    mouse.last_active_profile = mp.name
+                    mouse.save_active()
+        return all(written)
+
+    def cycle_profile(self, dry_run=False):
+        """
+        Cycles every mouse to the next profile from its last active one, sorted
+            alphabetically, and writes them all at once
+            Parameters:
+                dry_run (bool): only print the settings that would be written
+            Returns:
+                (bool): False if no mouse has a profile to cycle to, or a write
+                    failed, True once the press is queued for another --cycle
+        """
+        # check to see if there is only one profile saved, since there should
+        #   always be at least one profile, or default, even if there was no
+        #       json file prior to first time setup
+        # NOTE the user could delete the default profile, so we will just show
+        #   whatever profile name is there
+        cyclable = []
+        for mouse in self.mice:
+            if len(mouse.profiles) == 1:
+                sole_profile_name = tuple(mouse.profiles.keys())[0]
+                print(f"Only 1 profile found: '{sole_profile_name}'")
+            else:
+                cyclable.append(mouse)
+        if not cyclable:
             print_help_msg()
+            return False
+
+        if dry_run:
+            targets = [(mouse, mouse.get_next_profile()) for mouse in cyclable]
+            return all(write_profiles(targets, dry_run=True))
+
+        if self.batching:
+            # the batch holds the locks, and runs its commands in order
+            return self._cycle_by(cyclable, [1] * len(cyclable))
+
+        # count this press, then write to the mice as the only cycler
+        #   presses that come in while a profile is being written are
+        #       picked up together afterwards, as one write
+        for mouse in cyclable:
+            add_to_counter(mouse.store.cycle_path)
+        ok = True
+        while any(read_counter(mouse.store.cycle_path) > 0 for mouse in cyclable):
+            with contextlib.ExitStack() as stack:
+                # NOTE only another --cycle takes the cycle lock, and it applies
+                #   every counted press before giving it back, so a press is
+                #       never left in the counter by anything else holding the
+                #           store lock, ex. --active or a --drift poll
+                for mouse in cyclable:
+                    cycle_lock = FileLock(mouse.store.cycle_lock_path)
+                    if not cycle_lock.acquire(blocking=False):
+                        break
+                    stack.callback(cycle_lock.release)
+                else:
+                    # wait for any other writer, then apply every counted press
+                    for mouse in cyclable:
+                        stack.enter_context(FileLock(mouse.store.lock_path))
+                    ok = self._cycle_pending(cyclable) and ok
+                    continue
+            # the --cycle holding the cycle lock will apply this press too
+            print("Another lgmpm.py --cycle is writing a profile, press queued")
+            break
+        return ok
+
+    @staticmethod
+    def _cycle_pending(mice):
+        """
+        Applies every counted --cycle press, while the store locks are held
+            Parameters:
+                mice (list(Mouse)): the mice to cycle
+            Returns:
+                (bool): False if any of the writes failed
+        """
+        ok = True
+        steps = [take_counter(mouse.store.cycle_path) for mouse in mice]
+        while any(steps):
+            for mouse, mouse_steps in zip(mice, steps):
+                if mouse_steps:
+                    # pick up what other processes saved in the meantime
+                    mouse.reload()
+            ok = Mice._cycle_by(mice, steps) and ok
+            steps = [take_counter(mouse.store.cycle_path) for mouse in mice]
+        return ok
+
+    @staticmethod
+    def _cycle_by(mice, steps):
+        """
+        Writes the profile a number of steps after the last active one to each mouse
+            Parameters:
+                mice (list(Mouse)): the mice to cycle
+                steps (list(int)): how many profiles to move each mouse forward
+            Returns:
+                (bool): False if a mouse could not be written
+        """
+        targets = []
+        for mouse, mouse_steps in zip(mice, steps):
+            if mouse_steps:
+                targets.append((mouse, mouse.get_next_profile(mouse_steps)))
+        written = write_profiles(targets)
+        for (mouse, mp), ok in zip(targets, written):
+            if ok:
+                mouse.last_active_profile = mp.name
+                mouse.save_active()
+        return all(written)
+
+    def detect_profile(self):
+        """
+        Finds which stored profile each mouse is running, from one snapshot of
+            each, and makes it the last active profile
+            Returns:
+                (bool): False if a mouse could not be read
+        """
+        from executor import run_parallel
+
+        jobs = [(mouse, device) for mouse in self.mice for device in mouse.devices]
+        results = run_parallel(
+            [
+                functools.partial(MouseProfile, name="current", identity=device)
+                for _, device in jobs
+            ]
+        )
+        detected = {}
+        for (mouse, device), result in zip(jobs, results):
+            device_str = f"{device.alias} ({mouse.model.upper()})"
+            if not result.ok:
+                print(f"Could not read {device_str}: {result.error}")
+                detected[mouse] = None
+                continue
+            names = mouse.find_profiles(result.value)
+            if names:
+                print(f"{device_str} is running profile '{names[0]}'")
+                if len(names) > 1:
+                    others = ", ".join(f"'{name}'" for name in names[1:])
+                    print(f"  (the same settings are also saved as {others})")
+            else:
+                print(f"{device_str} does not match any stored profile")
+                print("Save it with 'lgmpm.py --new <profile_name>'")
+            # only trust a match that every mouse of the model agrees on
+            if names and detected.get(mouse, names[0]) == names[0]:
+                detected[mouse] = names[0]
+            else:
+                detected[mouse] = None
+        for mouse, profile_name in detected.items():
+            if profile_name is not None and profile_name != mouse.last_active_profile:
+                with mouse.locked():
+                    mouse.last_active_profile = profile_name
+                    mouse.save_active()
+        return all(result.ok for result in results)
+
+    def delete_profile(self, profile_name):
+        """
+        Deletes a profile from the store of every mouse model
+            Returns:
+                (bool): False if it failed for any of them
+        """
+        ok = True
+        for mouse in self.mice:
+            ok = mouse.delete_profile(profile_name) and ok
+        return ok
+
+    def list_profiles(self):
+        """
+        Lists all the saved profiles of every mouse model
+            Returns:
+                (bool): False if it failed for any of them
+        """
+        ok = True
+        for mouse in self.mice:
+            ok = mouse.list_profiles() and ok
+        return ok
+
+    def add_new_profile(self, profile_name):
+        """
+        Saves the current settings of every mouse model as a new profile
+            Returns:
+                (bool): False if it failed for any of them
+        """
+        ok = True
+        for mouse in self.mice:
+            ok = mouse.add_new_profile(profile_name) and ok
+        return ok
+
+    def list_history(self, profile_name):
+        """
+        Lists the saved versions of a profile of every mouse model
+            Returns:
+                (bool): False if it failed for any of them
+        """
+        ok = True
+        for mouse in self.mice:
+            ok = mouse.list_history(profile_name) and ok
+        return ok
+
+    def diff_versions(self, profile_name, versions):
+        """
+        Shows what changed between two versions of a profile of every mouse model
+            Parameters:
+                profile_name (str): the name of the profile
+                versions (list(int)): one version to compare to the stored
+                    profile, or two versions to compare to each other
+            Returns:
+                (bool): False if it failed for any mouse model
+        """
+        ok = True
+        for mouse in self.mice:
+            ok = mouse.diff_versions(profile_name, *versions) and ok
+        return ok
+
+    def rollback_profile(self, profile_name, version, dry_run=False):
+        """
+        Writes a saved version of a profile to every mouse that has it, all at once,
+            and saves it back as the profile's latest version
+            Parameters:
+                profile_name (str): the name of the profile to roll back
+                version (int): the version to roll back to, see list_history()
+                dry_run (bool): only print the settings that would be written
+            Returns:
+                (bool): False if no mouse has that version, or a write failed
+        """
+        with contextlib.ExitStack() as stack:
+            targets = []
+            for mouse in self.mice:
+                stack.enter_context(mouse.locked())
+                mp = mouse.get_profile_version(profile_name, version)
+                if mp is not None:
+                    targets.append((mouse, mp))
+            if not targets:
+                return False
+            # each device gets the whole version in one write,
+            #   so it never runs a mix of the old and the new settings
+            written = write_profiles(targets, dry_run=dry_run)
+            for (mouse, mp), ok in zip(targets, written):
+                if ok and not dry_run:
+                    mouse.profiles[profile_name] = mp.__dict__
+                    mouse.last_active_profile = profile_name
+                    mouse.save_profile(profile_name)
+                    print(
+                        f"{mouse.model.upper()} profile '{profile_name}'"
+                        f" rolled back to v{version}"
+                    )
+        return all(written)
+
+    def show_profile(self, profile_name):
+        """
+        Displays a saved profile of every mouse model
+            Returns:
+                (bool): False if it failed for any of them
+        """
+        ok = True
+        for mouse in self.mice:
+            ok = mouse.show_profile(profile_name) and ok
+        return ok
+
+    def update_profile(self, profile_name):
+        """
+        Updates a saved profile of every mouse model with its current settings
+            Returns:
+                (bool): False if it failed for any of them
+        """
+        ok = True
+        for mouse in self.mice:
+            ok = mouse.update_profile(profile_name) and ok
+        return ok
+
+
+class MiceCache:
+    """
+    A class that keeps the loaded Mice between commands of a long-running
+        lgmpm, ex. the daemon or --watch, and reloads them when the mice are
+            replugged or their profiles are changed by another process
+
+        Attributes:
+            mice (Mice): the loaded mice, None until get() is first called
+            store_mtime (tuple): the mtime_ns of each profile store when they were last seen
+    """
+
+    def __init__(self):
+        self.mice = None
+        self.store_mtime = None
+        return
+
+    def get_store_mtime(self):
+        """
+        Returns the mtime_ns of each loaded mouse's profile store, or None
+        """
+        if self.mice is None:
+            return None
+        return tuple(mouse.store.get_mtime() for mouse in self.mice.mice)
+
+    def get(self):
+        """
+        Returns the loaded Mice, reloading them if the devices or their profiles changed
+        """
+        identities = get_identities()
+        if (
+            self.mice is None
+            or self.mice.identities is not identities
+            or self.get_store_mtime() != self.store_mtime
+        ):
+            self.mice = Mice(identities)
+            self.store_mtime = self.get_store_mtime()
+        return self.mice
+
+    def keep(self):
+        """
+        Remembers the profile stores as they are now, so that the writes of
+            the commands run on the cached Mice don't reload them
+        """
+        self.store_mtime = self.get_store_mtime()
         return
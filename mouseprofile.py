@@ -2,22 +2,9 @@
 # mouseprofile.py - a Python class representing a set of settings/profile
 #   for a Logitech G mouse
 
-import re
-import requests
-import subprocess
-import tempfile
-
-from bs4 import BeautifulSoup
-
-from utils import get_bash_stdout, get_mouse_alias_and_model
-
-
-def color_hex_to_desc(color_hex):
-    res = requests.get(f"https://www.colorhexa.com/{color_hex}")
-    res.raise_for_status()
-    soup = BeautifulSoup(res.text, features="html.parser")
-    color = soup.select(".color-description p strong").pop().get_text()
-    return color.lower()
+from backends import DeviceBackendError, get_backend
+from identity import get_identity
+from tracing import span
 
 
 class MouseProfile:
@@ -33,86 +20,26 @@ class MouseProfile:
             leds (list(dict)): list of dicts containing led properties
     """
 
-    def __init__(self, name="default", attrs={}):
+    def __init__(self, name="default", attrs={}, identity=None):
         """
         Sets up the MouseProfile, either with passed attrs or from current state
             Params:
                 name (str): the name of the profile to create
                 attrs (dict): a dictionary with the settings to keep
+                identity (DeviceIdentity): the connected mouse, resolved if not passed
         """
-        # if the user doesn't pass the attrs dict, get all of it from ratbagctl
+        # if the user doesn't pass the attrs dict, get all of it from the mouse
         if attrs == {}:
             self.name = name
             # NOTE don't set device as an attr because we don't want it in MouseProfile.__dict__
-            device = get_mouse_alias_and_model()[0]
+            device = (identity or get_identity()).alias
             # generate attrs using the current mouse settings
-            # start with polling rate
-            self.report_rate = int(get_bash_stdout(f"ratbagctl {device} rate get"))
-
-            # iterate over all the set resolutions and put them into a list
-            self.resolutions = []
-            res_idx = 0
-            res_re = re.compile(r"\d:\s(\d{,5})dpi.*")
-            while True:
-                res_out = get_bash_stdout(
-                    f"ratbagctl {device} resolution {res_idx} get"
-                )
-                res_mo = res_re.match(res_out)
-                if res_mo:
-                    self.resolutions.append(int(res_mo.group(1)))
-                    res_idx += 1
-                else:
-                    break
-
-            # ratbagctl uses the resolution index for the default dpi
-            #   so 'default_resolution' here is an index, not a dpi
-            self.default_resolution = int(
-                get_bash_stdout(f"ratbagctl {device} resolution default get")
-            )
-
-            # iterate over all the set buttons and get them into a list
-            #   use .replace() to get 'command-ified' keypresses
-            #       NOTE macro waits are written like 't300' (wait 300ms)
-            btn_ct = int(get_bash_stdout(f"ratbagctl {device} button count"))
-            self.buttons = []
-            btn_re = re.compile(r".*'(.*)'.*")
-            for i in range(btn_ct):
-                btn_out = get_bash_stdout(f"ratbagctl {device} button {i} get").strip()
-                btn_mo = btn_re.match(btn_out)
-                self.buttons.append(
-                    btn_mo.group(1)
-                    .replace("↕", "KEY_")
-                    .replace("↓", "+KEY_")
-                    .replace("↑", "-KEY_")
-                )
-
-            # iterate over all the set LEDs and get them into a list of dicts
-            #   we will later iterate over each dict and only set k-v pairs that exist
-            self.leds = []
-            led_idx = 0
-            led_re = re.compile(
-                r"LED: (\d), depth: rgb, mode: (on|off|cycle|breathing), color: (\w{6})|, duration: (\d{,5}), brightness: (\d{,3})"
-            )
-            while True:
-                led_out = get_bash_stdout(f"ratbagctl {device} led {led_idx} get")
-                led_mo = led_re.match(led_out)
-                if led_mo:
-                    mode, color, duration, brightness = led_mo.groups()[1:]
-                    # brightness will not always display out from ratbagctl
-                    # if this happens, just set max (255)
-                    if brightness is None:
-                        brightness = 255
-                    self.leds.append(
-                        {
-                            "mode": mode,
-                            "color": color,
-                            "duration": duration,
-                            "brightness": brightness,
-                        }
-                    )
-                    led_idx += 1
-                else:
-                    break
+            snapshot = get_backend().snapshot(device)
+            self.report_rate = snapshot["report_rate"]
+            self.resolutions = snapshot["resolutions"]
+            self.default_resolution = snapshot["default_resolution"]
+            self.buttons = snapshot["buttons"]
+            self.leds = snapshot["leds"]
         else:
             self.name = attrs["name"]
             self.report_rate = attrs["report_rate"]
@@ -123,65 +50,113 @@ class MouseProfile:
 
         return
 
-    def run(self):
+    def get_fingerprint(self):
         """
-        Writes the profile data to the connected mouse
+        Returns the hash of this profile's settings, see store.get_fingerprint()
         """
-        device, model = get_mouse_alias_and_model()
-
-        commands = []
-        # set the polling rate
-        commands.append(f"\nratbagctl --nocommit {device} rate set {self.report_rate}")
-        # set the resolutions
-        for idx, dpi in enumerate(self.resolutions):
-            commands.append(
-                f"\nratbagctl --nocommit {device} resolution {idx} dpi set {dpi}"
-            )
-        # set default resolution and dpi
-        commands.append(
-            f"\nratbagctl --nocommit {device} resolution default set {self.default_resolution}"
-        )
-        commands.append(
-            f"\nratbagctl --nocommit {device} dpi set {self.resolutions[self.default_resolution]}"
-        )
-
-        # set the buttons
-        for idx, btn in enumerate(self.buttons):
-            cmd = f"\nratbagctl --nocommit {device} button {idx} action set"
-            if btn.startswith(("-", "+", "KEY", "t")):
-                cmd += " macro "
-            cmd += " " + btn
-            commands.append(cmd)
+        # only imported here, so that importing lgmpm doesn't compile the stores
+        from store import get_fingerprint
 
-        # set the LEDs
-        for idx, led in enumerate(self.leds):
-            cmd = f"\nratbagctl --nocommit {device} led {idx} set"
-            for key, value in led.items():
-                if value:
-                    cmd += f" {key} {value}"
-            commands.append(cmd)
-
-        # remove '--nocommit' from the last line
-        #   this will send the whole profile at once
-        last_command = commands.pop()
-        last_command = last_command.replace(" --nocommit ", " ")
-        commands.append(last_command)
-        with tempfile.NamedTemporaryFile() as tmp:
-            tmp_sh = tmp.name + ".sh"
-            with open(tmp_sh, "w") as sh_file:
-                sh_file.writelines(commands)
-            try:
-                subprocess.run(["sh", tmp_sh])
-                print(f"Profile '{self.name}' successfully written to {model.upper()}")
-            except Exception as e:
-                print(f"An Exception occurred: {e}")
+        return get_fingerprint(self.__dict__)
 
-        return
+    def get_plan(self):
+        """
+        Validates and compiles this profile, see plan.compile_plan()
+            Raises:
+                InvalidProfileError: if a setting can't be written to the mouse
+        """
+        # only imported here, so that importing lgmpm doesn't compile the planner
+        from plan import compile_plan
+
+        return compile_plan(self.__dict__)
 
-    def show(self):
+    def get_commands(self, current=None, plan=None):
+        """
+        Picks the ratbagctl settings needed to write this profile
+            Params:
+                current (MouseProfile): the settings already on the mouse,
+                    if passed only the settings that differ are returned
+                plan (list(list)): this profile's compiled plan, ex. cached by
+                    the store, compiled here if not passed
+            Returns:
+                commands (list(list(str))): ratbagctl arguments after the device
+                    alias, ex. [["rate", "set", "1000"]]
+        """
+        plan = self.get_plan() if plan is None else plan
+        from plan import get_commands
+
+        return get_commands(plan, None if current is None else current.__dict__)
+
+    def run(self, identity=None, current=None, dry_run=False, log=print, plan=None):
+        """
+        Writes the profile data to the connected mouse
+            Params:
+                identity (DeviceIdentity): the connected mouse, resolved if not passed
+                current (MouseProfile): the settings already on the mouse,
+                    if passed only the settings that differ are written
+                dry_run (bool): only print the settings that would be written
+                log (function): called with each line of the report, print by
+                    default, ex. list.append while several mice are written at once
+                plan (list(list)): this profile's compiled plan, see get_commands()
+            Returns:
+                (bool): False if writing to the mouse failed
+        """
+        identity = identity or get_identity()
+        device = identity.alias
+        model = identity.model
+
+        with span(f"write profile '{self.name}' to {device}", "profile") as sp:
+            # the same fingerprint means there's nothing to write, so skip the diff
+            if (
+                current is not None
+                and current.get_fingerprint() == self.get_fingerprint()
+            ):
+                commands = []
+            else:
+                commands = self.get_commands(current, plan)
+            sp.set(commands=len(commands), dry_run=dry_run)
+            if dry_run:
+                log(f"Profile '{self.name}' would write {len(commands)} setting(s):")
+                for words in commands:
+                    log(f"  {' '.join(words)}")
+                return True
+            if not commands:
+                log(f"Profile '{self.name}' is already set on {model.upper()}")
+                return True
+
+            try:
+                results = get_backend().apply(device, commands) or []
+                success_str = (
+                    f"Profile '{self.name}' successfully written to {model.upper()}"
+                )
+                if results:
+                    total_ms = sum(result.duration for result in results) * 1000
+                    success_str += f" ({len(results)} command(s) in {total_ms:.0f} ms)"
+                log(success_str)
+            except DeviceBackendError as e:
+                log(f"Could not write profile '{self.name}' to {model.upper()}: {e}")
+                for result in e.results:
+                    log(f"  {result}")
+                sp.set(error=str(e))
+                return False
+
+            return True
+
+    def show(self, color_names=None):
         """
         Displays profile data similar to the output of 'ratbagctl {alias} info'
+            Params:
+                color_names (dict): hex colors already resolved to names,
+                    any LED color missing from it is resolved here in one batch
         """
+        # only imported here, since no other command needs color names
+        from colors import color_hexes_to_names
+        from plan import InvalidProfileError, get_button_words
+
+        color_names = dict(color_names or {})
+        missing = [led.get("color") for led in self.leds]
+        missing = [c for c in missing if c and c not in color_names]
+        color_names.update(color_hexes_to_names(missing))
         print(f"Profile: {self.name}")
         print(f"  Polling rate: {self.report_rate} Hz")
         print(f"  Resolutions:")
@@ -196,10 +171,16 @@ class MouseProfile:
         print(f"  Buttons:")
         for idx, btn in enumerate(self.buttons):
             btn_str = f"    button {idx}: "
-            if btn.startswith("button"):
-                btn_str += f"{btn}"
-            elif btn.startswith(("KEY_", "+", "-", "t")):
-                btn_str += f"macro {btn}"
+            try:
+                action = get_button_words(btn)
+            except InvalidProfileError:
+                action = ["invalid"]
+            if action is None:
+                btn_str += f"{btn} (can't be written)"
+            elif action[0] in ("macro", "invalid"):
+                btn_str += f"{action[0]} {btn}"
+            else:
+                btn_str += btn
             print(btn_str)
         print("  LEDs:")
         for idx, led in enumerate(self.leds):
@@ -208,7 +189,7 @@ class MouseProfile:
                 if val:
                     led_str = f"      {prop}: {val}"
                     if prop == "color":
-                        color_name = color_hex_to_desc(val)
+                        color_name = color_names[val]
                         led_str += f" '{color_name}'"
                     if prop == "brightness" and val == 255:
                         led_str += " (max)"
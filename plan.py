@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+# plan.py - compiles a profile into the ratbagctl settings that write it,
+#   validated once when the profile is saved instead of halfway through
+#       writing it to the mouse
+#
+#   a plan is a list of steps, [key, value, words], ex.
+#       ["rate", 1000, ["rate", "set", "1000"]]
+#           key names the setting, value is what the mouse has once it is
+#               written, and words are the ratbagctl arguments after the alias
+
+import re
+
+# bump when compile_plan() changes, so plans cached by an older lgmpm are rebuilt
+PLAN_VERSION = 1
+
+# the special actions a button can be mapped to, in libratbag's order
+SPECIAL_ACTIONS = (
+    "unknown",
+    "doubleclick",
+    "wheel-left",
+    "wheel-right",
+    "wheel-up",
+    "wheel-down",
+    "ratchet-mode-switch",
+    "resolution-cycle-up",
+    "resolution-cycle-down",
+    "resolution-up",
+    "resolution-down",
+    "resolution-alternate",
+    "resolution-default",
+    "profile-cycle-up",
+    "profile-cycle-down",
+    "profile-up",
+    "profile-down",
+    "second-mode",
+    "battery-level",
+)
+
+# the button mappings that can be read but not written, ex. of a disabled button
+UNWRITABLE_BUTTONS = ("none", "unknown")
+
+LED_MODES = ("off", "on", "cycle", "breathing")
+# the LED properties in the order ratbagctl takes them
+LED_KEYS = ("mode", "color", "duration", "brightness")
+
+BUTTON_RE = re.compile(r"^button ([1-9]\d*)$")
+# one event of a macro: press and release, press (+), release (-), or wait (t)
+MACRO_EVENT_RE = re.compile(r"^(?:[+-]?KEY_[A-Z0-9_]+|t\d+)$")
+COLOR_RE = re.compile(r"^[0-9a-fA-F]{6}$")
+
+
+class InvalidProfileError(Exception):
+    """
+    Raised when a profile has settings that can't be written to a mouse
+    """
+
+
+def get_button_words(btn):
+    """
+    Classifies a 'command-ified' button action
+        Params:
+            btn (str): ex. 'button 1', 'resolution-cycle-up', or '+KEY_A t300 -KEY_A'
+        Returns:
+            (list(str)): the arguments after 'button N action set', or None if
+                the action can't be written, ex. ["special", "resolution-cycle-up"]
+        Raises:
+            InvalidProfileError: if it is neither a button, a special action,
+                nor a macro
+    """
+    if btn in UNWRITABLE_BUTTONS:
+        return None
+    button_mo = BUTTON_RE.match(btn)
+    if button_mo:
+        return ["button", button_mo.group(1)]
+    if btn in SPECIAL_ACTIONS:
+        return ["special", btn]
+    events = btn.split()
+    bad_events = [event for event in events if not MACRO_EVENT_RE.match(event)]
+    if not events or bad_events:
+        bad_str = ""
+        if bad_events and bad_events[0] != btn:
+            bad_str = f" ('{bad_events[0]}' isn't a key or a wait)"
+        raise InvalidProfileError(
+            f"'{btn}' is not a button, special action, or macro{bad_str}"
+        )
+    return ["macro"] + events
+
+
+def get_led_words(led):
+    """
+    Returns the LED properties as ratbagctl arguments, skipping unset ones,
+        ex. ["mode", "on", "color", "ff0000"]
+    """
+    words = []
+    for key in LED_KEYS:
+        value = led.get(key)
+        if value:
+            words += [key, str(value)]
+    return words
+
+
+def validate_led(led):
+    """
+    Raises InvalidProfileError if an LED has a bad mode, color, or number
+    """
+    if led.get("mode") not in LED_MODES:
+        raise InvalidProfileError(
+            f"mode '{led.get('mode')}' is not one of {', '.join(LED_MODES)}"
+        )
+    color = led.get("color")
+    if color and not COLOR_RE.match(color):
+        raise InvalidProfileError(f"color '{color}' is not a hex color like 'ff0000'")
+    for key, limit in (("duration", 10000), ("brightness", 255)):
+        value = led.get(key)
+        if value is not None and not (isinstance(value, int) and 0 <= value <= limit):
+            raise InvalidProfileError(f"{key} '{value}' is not between 0 and {limit}")
+    return
+
+
+def compile_plan(settings):
+    """
+    Validates a profile and builds every step needed to write it
+        Params:
+            settings (dict): a stored profile or MouseProfile.__dict__
+        Returns:
+            plan (list(list)): the [key, value, words] of each setting
+        Raises:
+            InvalidProfileError: if any setting can't be written
+    """
+    try:
+        report_rate = settings["report_rate"]
+        resolutions = settings["resolutions"]
+        default_resolution = settings["default_resolution"]
+        buttons = settings["buttons"]
+        leds = settings["leds"]
+    except KeyError as e:
+        raise InvalidProfileError(f"the profile has no {e.args[0]}")
+    if not isinstance(report_rate, int) or report_rate <= 0:
+        raise InvalidProfileError(f"report rate '{report_rate}' is not a rate in Hz")
+    plan = [["rate", report_rate, ["rate", "set", str(report_rate)]]]
+
+    for idx, dpi in enumerate(resolutions):
+        if not isinstance(dpi, int) or dpi < 0:
+            raise InvalidProfileError(f"resolution {idx}: '{dpi}' is not a dpi")
+        plan.append(
+            [f"resolution {idx}", dpi, ["resolution", str(idx), "dpi", "set", str(dpi)]]
+        )
+    if not (
+        isinstance(default_resolution, int)
+        and 0 <= default_resolution < len(resolutions)
+    ):
+        raise InvalidProfileError(
+            f"default resolution {default_resolution} is not one of the"
+            f" {len(resolutions)} resolutions"
+        )
+    default_dpi = resolutions[default_resolution]
+    if not default_dpi:
+        raise InvalidProfileError(
+            f"default resolution {default_resolution} is disabled (0 dpi)"
+        )
+    plan.append(
+        [
+            "default",
+            default_resolution,
+            ["resolution", "default", "set", str(default_resolution)],
+        ]
+    )
+    # the active dpi follows the default after a profile switch, see get_values()
+    plan.append(
+        ["dpi", [default_resolution, default_dpi], ["dpi", "set", str(default_dpi)]]
+    )
+
+    for idx, btn in enumerate(buttons):
+        try:
+            action = get_button_words(btn)
+        except InvalidProfileError as e:
+            raise InvalidProfileError(f"button {idx}: {e}")
+        if action is not None:
+            plan.append(
+                [f"button {idx}", btn, ["button", str(idx), "action", "set"] + action]
+            )
+
+    for idx, led in enumerate(leds):
+        try:
+            validate_led(led)
+        except InvalidProfileError as e:
+            raise InvalidProfileError(f"led {idx}: {e}")
+        led_words = get_led_words(led)
+        plan.append([f"led {idx}", led_words, ["led", str(idx), "set"] + led_words])
+    return plan
+
+
+def get_values(settings, plan):
+    """
+    Reads what the mouse has for each setting of a plan, without validating,
+        so a snapshot of the mouse can be compared to a compiled plan
+        Params:
+            settings (dict): ex. MouseProfile.__dict__ of a snapshot
+            plan (list(list)): the plan the values are compared to
+        Returns:
+            (dict): each key of the plan mapped to the current value, or None
+    """
+    resolutions = settings["resolutions"]
+    values = {
+        "rate": settings["report_rate"],
+        "default": settings["default_resolution"],
+    }
+    for idx, dpi in enumerate(resolutions):
+        values[f"resolution {idx}"] = dpi
+    for idx, btn in enumerate(settings["buttons"]):
+        values[f"button {idx}"] = btn
+    for idx, led in enumerate(settings["leds"]):
+        values[f"led {idx}"] = get_led_words(led)
+    for key, value, _ in plan:
+        if key == "dpi":
+            # the dpi the mouse has at the default index the plan sets
+            values["dpi"] = [
+                settings["default_resolution"],
+                (resolutions[value[0] :] or [None])[0],
+            ]
+    return values
+
+
+def get_commands(plan, current=None):
+    """
+    Picks the steps of a plan that would change the mouse
+        Params:
+            plan (list(list)): as returned by compile_plan()
+            current (dict): the settings already on the mouse, every step
+                is returned if not passed
+        Returns:
+            commands (list(list(str))): the ratbagctl arguments of each
+                step, ex. [["rate", "set", "1000"]]
+    """
+    if current is None:
+        return [words for _, _, words in plan]
+    values = get_values(current, plan)
+    return [words for key, value, words in plan if values.get(key) != value]
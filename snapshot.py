@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# snapshot.py - parsers that turn ratbagctl output into MouseProfile settings
+
+import re
+
+# precompile every pattern once at import, they are reused for each line/field
+PROFILE_RE = re.compile(r"^Profile (\d+):(.*)$")
+COUNT_RE = re.compile(r"^\s*Number of (Buttons|Leds): (\d+)")
+RATE_RE = re.compile(r"^\s*Report Rate: (\d+)\s*Hz")
+RES_RE = re.compile(r"^\s*(\d+):\s(\d{,5})dpi(.*)$")
+BTN_RE = re.compile(r"^\s*Button: (\d+) is mapped to .*?'(.*)'")
+LED_RE = re.compile(
+    r"^\s*LED: (\d+), depth: \w+, mode: (on|off|cycle|breathing)"
+    r"(?:, color: (\w{6}))?"
+    r"(?:, duration: (\d{,5}))?"
+    r"(?:, brightness: (\d{,3}))?"
+)
+
+# the settings of a snapshot, in the order a backend returns them
+SNAPSHOT_ATTRS = ("report_rate", "resolutions", "default_resolution", "buttons", "leds")
+
+
+def parse_button(btn_out):
+    """
+    Converts ratbagctl's button mapping text into a 'command-ified' action
+        Params:
+            btn_out (str): the quoted mapping, ex. '↕A' or 'button 1'
+        Returns:
+            (str): the action as it would be passed to 'button N action set'
+    """
+    # NOTE macro waits are written like 't300' (wait 300ms)
+    return btn_out.replace("↕", "KEY_").replace("↓", "+KEY_").replace("↑", "-KEY_")
+
+
+def parse_led_groups(led_mo):
+    """
+    Builds an LED settings dict from a LED_RE match object
+        Params:
+            led_mo (re.Match): a match of LED_RE
+        Returns:
+            (dict): the mode, color, duration, and brightness of the LED
+    """
+    mode, color, duration, brightness = led_mo.groups()[1:]
+    return {
+        "mode": mode,
+        "color": color,
+        "duration": int(duration) if duration else None,
+        # brightness will not always display out from ratbagctl
+        # if this happens, just set max (255)
+        "brightness": int(brightness) if brightness else 255,
+    }
+
+
+def parse_info(info_out):
+    """
+    Parses the active profile out of a single 'ratbagctl {alias} info' call
+        Params:
+            info_out (str): the decoded stdout of 'ratbagctl {alias} info'
+        Returns:
+            snapshot (dict): any of report_rate, resolutions, default_resolution,
+                buttons, and leds that could be parsed; missing keys should
+                be queried individually
+    """
+    # ratbagctl prints every onboard profile, but the per-field commands
+    #   only read the active one, so keep the lines of the active profile
+    #       (or the first profile, if none is flagged as active)
+    sections = []
+    counts = {}
+    for line in info_out.splitlines():
+        count_mo = COUNT_RE.match(line)
+        profile_mo = PROFILE_RE.match(line)
+        if count_mo and not sections:
+            counts[count_mo.group(1).lower()] = int(count_mo.group(2))
+        elif profile_mo:
+            sections.append(("(active)" in profile_mo.group(2), []))
+        elif sections:
+            sections[-1][1].append(line)
+    if not sections:
+        return {}
+    active = [lines for is_active, lines in sections if is_active]
+    lines = active[0] if active else sections[0][1]
+
+    snapshot = {}
+    resolutions = {}
+    buttons = {}
+    leds = {}
+    for line in lines:
+        rate_mo = RATE_RE.match(line)
+        if rate_mo:
+            snapshot["report_rate"] = int(rate_mo.group(1))
+            continue
+        res_mo = RES_RE.match(line)
+        if res_mo:
+            res_idx = int(res_mo.group(1))
+            resolutions[res_idx] = int(res_mo.group(2) or 0)
+            if "(default)" in res_mo.group(3):
+                snapshot["default_resolution"] = res_idx
+            continue
+        btn_mo = BTN_RE.match(line)
+        if btn_mo:
+            buttons[int(btn_mo.group(1))] = parse_button(btn_mo.group(2))
+            continue
+        led_mo = LED_RE.match(line)
+        if led_mo:
+            leds[int(led_mo.group(1))] = parse_led_groups(led_mo)
+
+    # only trust a list if its indices are contiguous from 0 and agree with
+    #   the header count (when there is one), otherwise leave it for the
+    #       per-field fallback
+    for key, found, count in (
+        ("resolutions", resolutions, None),
+        ("buttons", buttons, counts.get("buttons")),
+        ("leds", leds, counts.get("leds")),
+    ):
+        if sorted(found) != list(range(len(found))):
+            continue
+        if (count is None and found) or count == len(found):
+            snapshot[key] = [found[idx] for idx in range(len(found))]
+
+    return snapshot
+
+
+def query_setting(attr):
+    """
+    Queries one setting of the mouse on its own, for whatever parse_info()
+        couldn't parse, as a generator so the sync and async backends share it
+            Params:
+                attr (str): one of SNAPSHOT_ATTRS, ex. "resolutions"
+            Yields:
+                calls (list(list(str))): the next ratbagctl calls, without
+                    'ratbagctl' and the alias, ex. [["rate", "get"]], which are
+                        answered by sending back a list of their outputs
+            Returns:
+                the setting, ex. [400, 800, 1600]
+    """
+    if attr == "report_rate":
+        (rate_out,) = yield [["rate", "get"]]
+        return int(rate_out)
+    if attr == "default_resolution":
+        # ratbagctl uses the resolution index for the default dpi
+        #   so 'default_resolution' here is an index, not a dpi
+        (default_out,) = yield [["resolution", "default", "get"]]
+        return int(default_out)
+    if attr == "buttons":
+        (count_out,) = yield [["button", "count"]]
+        btn_outs = yield [["button", str(i), "get"] for i in range(int(count_out))]
+        return [
+            parse_button(BTN_RE.match(btn_out.strip()).group(2)) for btn_out in btn_outs
+        ]
+    # the number of resolutions and LEDs is only known once one is missing,
+    #   so they are read one at a time until a read doesn't parse
+    if attr == "resolutions":
+        word, regex = "resolution", RES_RE
+    else:
+        word, regex = "led", LED_RE
+    values = []
+    while True:
+        (out,) = yield [[word, str(len(values)), "get"]]
+        mo = regex.match(out)
+        if not mo:
+            return values
+        values.append(
+            int(mo.group(2) or 0) if attr == "resolutions" else parse_led_groups(mo)
+        )
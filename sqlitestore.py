@@ -0,0 +1,272 @@
+#!/usr/bin/env python3
+# sqlitestore.py - a profile store for many profiles, one sqlite row per
+#   profile, picked with LGMPM_STORE=sqlite, see store.get_store()
+
+import json
+import os
+import time
+from pathlib import Path
+
+from plan import PLAN_VERSION, InvalidProfileError, compile_plan
+from store import (
+    JsonProfileStore,
+    ProfileStoreError,
+    get_fingerprint,
+    get_models_dir,
+)
+
+
+class SqliteProfileStore:
+    """
+    A class storing a model's profiles in models/{model}.sqlite3, one row per
+        profile, so saving a profile only writes that profile, with an
+            indexed fingerprint column and a table of compiled plans
+
+        Attributes:
+            path (Path): the sqlite database
+            history_path (Path): every saved version of each profile, shared
+                with the json store, see history.py
+            lock_path (Path): the lock file held while the profiles are changed
+            cycle_path (Path): the counter of --cycle presses not yet applied
+            cycle_lock_path (Path): the lock file held by the --cycle applying them
+    """
+
+    def __init__(self, model, models_dir=None):
+        models_dir = Path(models_dir or get_models_dir())
+        self.path = models_dir / f"{model}.sqlite3"
+        self.history_path = models_dir / f"{model}.history.jsonl"
+        self.lock_path = models_dir / f"{model}.lock"
+        self.cycle_path = models_dir / f"{model}.cycle"
+        self.cycle_lock_path = models_dir / f"{model}.cycle.lock"
+        self.legacy_json = JsonProfileStore(model, models_dir)
+        self._conn = None
+        return
+
+    def exists(self):
+        """
+        Returns True if profiles have been saved for this model
+        """
+        return self.path.exists() or self.legacy_json.exists()
+
+    def get_mtime(self):
+        """
+        Returns the mtime_ns of the database (or its write-ahead log), or None
+        """
+        mtimes = []
+        for fp in (self.path, self.path.with_name(self.path.name + "-wal")):
+            try:
+                mtimes.append(fp.stat().st_mtime_ns)
+            except OSError:
+                pass
+        return max(mtimes) if mtimes else None
+
+    def connect(self):
+        """
+        Opens (and if needed creates) the database, once per store
+        """
+        # only imported here, so that json stores never load it
+        import sqlite3
+
+        if self._conn is None:
+            is_new = not self.path.exists()
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._conn = sqlite3.connect(self.path)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            with self._conn:
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS profiles"
+                    " (name TEXT PRIMARY KEY, body TEXT, fingerprint TEXT)"
+                )
+                columns = [
+                    row[1] for row in self._conn.execute("PRAGMA table_info(profiles)")
+                ]
+                if "fingerprint" not in columns:
+                    # databases from before fingerprints, filled in by _fill_fingerprints()
+                    self._conn.execute(
+                        "ALTER TABLE profiles ADD COLUMN fingerprint TEXT"
+                    )
+                self._conn.execute(
+                    "CREATE INDEX IF NOT EXISTS profiles_fingerprint"
+                    " ON profiles (fingerprint)"
+                )
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+                )
+                self._conn.execute(
+                    "CREATE TABLE IF NOT EXISTS plans"
+                    " (fingerprint TEXT PRIMARY KEY, version INTEGER, plan TEXT)"
+                )
+            # carry over the profiles of an existing json store
+            if is_new and self.legacy_json.exists():
+                last_active_profile, profiles = self.legacy_json.load()
+                self.save_profiles(profiles, changed=profiles)
+                self.save_active(last_active_profile)
+        return self._conn
+
+    def load(self):
+        """
+        Reads the stored profiles, see JsonProfileStore.load()
+        """
+        import sqlite3
+
+        if not self.exists():
+            raise FileNotFoundError(self.path)
+        try:
+            conn = self.connect()
+            rows = conn.execute("SELECT name, body FROM profiles").fetchall()
+            active_row = conn.execute(
+                "SELECT value FROM meta WHERE key = 'last_active_profile'"
+            ).fetchone()
+        except sqlite3.DatabaseError as e:
+            raise ProfileStoreError(f"{self.path} is corrupted: {e}")
+        profiles = {name: json.loads(body) for name, body in rows}
+        last_active_profile = active_row[0] if active_row else "default"
+        return (last_active_profile, profiles)
+
+    def load_active(self):
+        """
+        Reads only the last active profile name, see load()
+        """
+        row = (
+            self.connect()
+            .execute("SELECT value FROM meta WHERE key = 'last_active_profile'")
+            .fetchone()
+        )
+        return row[0] if row else "default"
+
+    def iter_profiles(self):
+        """
+        Yields (name, settings) of each stored profile, sorted by name,
+            reading one row at a time
+        """
+        rows = self.connect().execute("SELECT name, body FROM profiles ORDER BY name")
+        for name, body in rows:
+            yield (name, json.loads(body))
+        return
+
+    def save_active(self, profile_name):
+        """
+        Saves only the last active profile name
+        """
+        with self.connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('last_active_profile', ?)",
+                (profile_name,),
+            )
+        return
+
+    def save_profiles(self, profiles, changed=(), deleted=()):
+        """
+        Saves only the changed and deleted profiles, in one transaction
+            Params:
+                profiles (dict): every profile name mapped to its settings
+                changed (iterable(str)): the names of the profiles that changed
+                deleted (iterable(str)): the names of the profiles that were removed
+        """
+        fingerprints = {name: get_fingerprint(profiles[name]) for name in changed}
+        plans = []
+        for name, fingerprint in fingerprints.items():
+            try:
+                plan = compile_plan(profiles[name])
+            except InvalidProfileError:
+                # compiled (and reported) again if it is ever written
+                continue
+            plans.append((fingerprint, PLAN_VERSION, json.dumps(plan)))
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO profiles VALUES (?, ?, ?)",
+                [
+                    (name, json.dumps(profiles[name]), fingerprint)
+                    for name, fingerprint in fingerprints.items()
+                ],
+            )
+            conn.executemany(
+                "DELETE FROM profiles WHERE name = ?", [(name,) for name in deleted]
+            )
+            conn.executemany("INSERT OR REPLACE INTO plans VALUES (?, ?, ?)", plans)
+            # drop the plans no profile has anymore
+            conn.execute(
+                "DELETE FROM plans WHERE fingerprint NOT IN"
+                " (SELECT fingerprint FROM profiles WHERE fingerprint IS NOT NULL)"
+            )
+        self.get_history().record(profiles, changed, deleted)
+        return
+
+    def get_history(self):
+        """
+        Returns the saved versions of this model's profiles, see history.ProfileHistory
+        """
+        from history import ProfileHistory
+
+        return ProfileHistory(self.history_path)
+
+    def get_plan(self, settings):
+        """
+        Returns the compiled plan of a profile, see JsonProfileStore.get_plan()
+        """
+        fingerprint = get_fingerprint(settings)
+        conn = self.connect()
+        row = conn.execute(
+            "SELECT plan FROM plans WHERE fingerprint = ? AND version = ?",
+            (fingerprint, PLAN_VERSION),
+        ).fetchone()
+        if row:
+            return json.loads(row[0])
+        plan = compile_plan(settings)
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO plans VALUES (?, ?, ?)",
+                (fingerprint, PLAN_VERSION, json.dumps(plan)),
+            )
+        return plan
+
+    def _fill_fingerprints(self):
+        """
+        Fingerprints any profile saved before the fingerprint column existed
+        """
+        conn = self.connect()
+        rows = conn.execute(
+            "SELECT name, body FROM profiles WHERE fingerprint IS NULL"
+        ).fetchall()
+        if rows:
+            with conn:
+                conn.executemany(
+                    "UPDATE profiles SET fingerprint = ? WHERE name = ?",
+                    [(get_fingerprint(json.loads(body)), name) for name, body in rows],
+                )
+        return conn
+
+    def get_fingerprint_index(self):
+        """
+        Returns each fingerprint mapped to the names of the profiles that have it
+        """
+        index = {}
+        rows = self._fill_fingerprints().execute(
+            "SELECT fingerprint, name FROM profiles ORDER BY name"
+        )
+        for fingerprint, name in rows:
+            index.setdefault(fingerprint, []).append(name)
+        return index
+
+    def find_profiles(self, fingerprint):
+        """
+        Returns the names of the stored profiles with a fingerprint, sorted
+        """
+        rows = self._fill_fingerprints().execute(
+            "SELECT name FROM profiles WHERE fingerprint = ? ORDER BY name",
+            (fingerprint,),
+        )
+        return [name for (name,) in rows]
+
+    def quarantine(self):
+        """
+        Moves an unreadable database aside, so a fresh one can be started
+            Returns:
+                (Path): where the unreadable database was moved to
+        """
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        corrupt_fp = self.path.with_name(f"{self.path.name}.corrupt-{int(time.time())}")
+        os.replace(self.path, corrupt_fp)
+        return corrupt_fp
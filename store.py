@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# store.py - where the profiles of each mouse model are saved
+#
+#   the hot 'last active profile' pointer is kept apart from the profile
+#       bodies, so switching profiles only rewrites a few bytes
+
+import json
+import os
+import time
+from pathlib import Path
+
+from plan import PLAN_VERSION, InvalidProfileError, compile_plan
+from tracing import span
+
+MODELS_DIR = Path(__file__).parent / "models"
+
+
+def get_models_dir():
+    """
+    Returns the dir the profiles are saved in, $LGMPM_MODELS_DIR or ./models
+    """
+    return Path(os.environ.get("LGMPM_MODELS_DIR") or MODELS_DIR)
+
+
+# the settings that make up a profile's fingerprint, its name is left out
+FINGERPRINT_ATTRS = (
+    "report_rate",
+    "resolutions",
+    "default_resolution",
+    "buttons",
+    "leds",
+)
+
+
+def get_fingerprint(settings):
+    """
+    Hashes the settings of a profile, so profiles (or a snapshot of the mouse)
+        with the same settings always get the same fingerprint
+        Params:
+            settings (dict): a stored profile or MouseProfile.__dict__
+        Returns:
+            (str): the hex digest of the canonical settings
+    """
+    # only imported here, since only some commands need a fingerprint
+    import hashlib
+
+    canonical = {attr: settings.get(attr) for attr in FINGERPRINT_ATTRS}
+    # unset LED properties are never written to the mouse,
+    #   see plan.get_led_words(), so they don't count either
+    canonical["leds"] = [
+        {key: value for key, value in led.items() if value}
+        for led in canonical["leds"] or []
+    ]
+    canonical_str = json.dumps(canonical, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canonical_str.encode()).hexdigest()
+
+
+class ProfileStoreError(Exception):
+    """
+    Raised when the stored profiles can't be read
+    """
+
+
+def atomic_write(fp, text):
+    """
+    Writes a file so that readers only ever see the old or the new contents,
+        even if the program is killed halfway through
+        Params:
+            fp (Path): the file to write
+            text (str): the new contents
+    """
+    fp.parent.mkdir(parents=True, exist_ok=True)
+    tmp_fp = fp.with_name(f".{fp.name}.{os.getpid()}.tmp")
+    with span(f"write {fp.name}", "io", path=str(fp), bytes=len(text)):
+        try:
+            with open(tmp_fp, "w") as tmp_file:
+                tmp_file.write(text)
+                tmp_file.flush()
+                os.fsync(tmp_file.fileno())
+            os.replace(tmp_fp, fp)
+        finally:
+            tmp_fp.unlink(missing_ok=True)
+    return
+
+
+class JsonProfileStore:
+    """
+    A class storing a model's profiles in models/{model}.json and its last
+        active profile in models/{model}.active
+
+        Attributes:
+            path (Path): the json file with the profile bodies
+            active_path (Path): the small file with the last active profile name
+            index_path (Path): each profile fingerprint mapped to the profile names
+            plans_path (Path): each profile fingerprint mapped to its compiled plan
+            history_path (Path): every saved version of each profile, see history.py
+            lock_path (Path): the lock file held while the profiles are changed
+            cycle_path (Path): the counter of --cycle presses not yet applied
+            cycle_lock_path (Path): the lock file held by the --cycle applying them
+    """
+
+    def __init__(self, model, models_dir=None):
+        models_dir = Path(models_dir or get_models_dir())
+        self.path = models_dir / f"{model}.json"
+        self.active_path = models_dir / f"{model}.active"
+        self.index_path = models_dir / f"{model}.index.json"
+        self.plans_path = models_dir / f"{model}.plans.json"
+        self.history_path = models_dir / f"{model}.history.jsonl"
+        self.lock_path = models_dir / f"{model}.lock"
+        self.cycle_path = models_dir / f"{model}.cycle"
+        self.cycle_lock_path = models_dir / f"{model}.cycle.lock"
+        return
+
+    def get_history(self):
+        """
+        Returns the saved versions of this model's profiles, see history.ProfileHistory
+        """
+        # only imported here, since only saving or rolling back a profile needs it
+        from history import ProfileHistory
+
+        return ProfileHistory(self.history_path)
+
+    def exists(self):
+        """
+        Returns True if profiles have been saved for this model
+        """
+        return self.path.exists()
+
+    def get_mtime(self):
+        """
+        Returns the latest mtime_ns of the store's files, or None if there are none
+        """
+        mtimes = []
+        for fp in (self.path, self.active_path):
+            try:
+                mtimes.append(fp.stat().st_mtime_ns)
+            except OSError:
+                pass
+        return max(mtimes) if mtimes else None
+
+    def load(self):
+        """
+        Reads the stored profiles
+            Returns:
+                (last_active_profile, profiles) (tuple): the last active profile
+                    name and a dict of each profile name mapped to its settings
+        """
+        try:
+            with open(self.path, "r") as jf:
+                mouse_data = json.load(jf)
+            profiles = mouse_data["profiles"]
+        except (json.decoder.JSONDecodeError, KeyError, TypeError) as e:
+            raise ProfileStoreError(f"{self.path} is corrupted: {e}")
+        try:
+            last_active_profile = self.active_path.read_text().strip()
+        except FileNotFoundError:
+            # files written before the pointer moved out keep it in the json
+            last_active_profile = mouse_data.get("last_active_profile", "default")
+        return (last_active_profile, profiles)
+
+    def load_active(self):
+        """
+        Reads only the last active profile name, see load()
+        """
+        try:
+            return self.active_path.read_text().strip()
+        except FileNotFoundError:
+            return self.load()[0]
+
+    def iter_profiles(self):
+        """
+        Yields (name, settings) of each stored profile, sorted by name
+        """
+        # NOTE a json file can only be parsed whole, so this model's profiles
+        #   stay in memory until the last one is yielded
+        _, profiles = self.load()
+        for name in sorted(profiles):
+            yield (name, profiles[name])
+        return
+
+    def save_active(self, profile_name):
+        """
+        Saves only the last active profile name
+        """
+        atomic_write(self.active_path, profile_name + "\n")
+        return
+
+    def save_profiles(self, profiles, changed=(), deleted=()):
+        """
+        Saves the profile bodies
+            Params:
+                profiles (dict): every profile name mapped to its settings
+                changed (iterable(str)): the names of the profiles that changed
+                deleted (iterable(str)): the names of the profiles that were removed
+        """
+        old_fingerprints = self._read_index(self._get_profiles_mtime())
+        # a json file can only be rewritten as a whole
+        atomic_write(self.path, json.dumps({"profiles": profiles}, indent=2))
+        # only fingerprint what changed, unless the index was already stale
+        fingerprints = {}
+        for fingerprint, names in (old_fingerprints or {}).items():
+            for name in names:
+                fingerprints[name] = fingerprint
+        for name in set(changed) | set(deleted):
+            fingerprints.pop(name, None)
+        for name, settings in profiles.items():
+            if name not in fingerprints:
+                fingerprints[name] = get_fingerprint(settings)
+        self._write_index(fingerprints)
+        self._save_plans(profiles, changed, fingerprints)
+        self.get_history().record(profiles, changed, deleted)
+        return
+
+    def _read_plans(self):
+        """
+        Reads the compiled plans, or an empty dict if they are missing or stale
+        """
+        try:
+            cache = json.loads(self.plans_path.read_text())
+            if cache["version"] == PLAN_VERSION:
+                return cache["plans"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return {}
+
+    def _write_plans(self, plans):
+        """
+        Saves the compiled plans, each fingerprint mapped to its plan
+        """
+        atomic_write(
+            self.plans_path, json.dumps({"version": PLAN_VERSION, "plans": plans})
+        )
+        return
+
+    def _save_plans(self, profiles, changed, fingerprints):
+        """
+        Compiles the changed profiles, and drops the plans no profile has anymore
+            Params:
+                profiles (dict): every profile name mapped to its settings
+                changed (iterable(str)): the names of the profiles that changed
+                fingerprints (dict): each profile name mapped to its fingerprint
+        """
+        old_plans = self._read_plans()
+        plans = {
+            fingerprint: plan
+            for fingerprint, plan in old_plans.items()
+            if fingerprint in fingerprints.values()
+        }
+        for name in changed:
+            if fingerprints[name] not in plans:
+                try:
+                    plans[fingerprints[name]] = compile_plan(profiles[name])
+                except InvalidProfileError:
+                    # compiled (and reported) again if it is ever written
+                    pass
+        if plans != old_plans:
+            self._write_plans(plans)
+        return
+
+    def get_plan(self, settings):
+        """
+        Returns the compiled plan of a profile, compiling and caching it if
+            it wasn't saved with the profile, ex. after a hand edit
+            Params:
+                settings (dict): a stored profile or MouseProfile.__dict__
+            Returns:
+                plan (list(list)): see plan.compile_plan()
+            Raises:
+                InvalidProfileError: if the profile can't be written
+        """
+        fingerprint = get_fingerprint(settings)
+        plans = self._read_plans()
+        if fingerprint not in plans:
+            plans[fingerprint] = compile_plan(settings)
+            self._write_plans(plans)
+        return plans[fingerprint]
+
+    def _get_profiles_mtime(self):
+        """
+        Returns the mtime_ns of the json file, or None if it doesn't exist
+        """
+        # NOTE the last active profile is kept in its own file,
+        #   so switching profiles doesn't make the index stale
+        try:
+            return self.path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _read_index(self, profiles_mtime):
+        """
+        Reads the fingerprint index, if it was written for the current json file
+            Returns:
+                (dict): each fingerprint mapped to a list of profile names, or None
+        """
+        try:
+            index = json.loads(self.index_path.read_text())
+            if index["profiles_mtime"] == profiles_mtime:
+                return index["fingerprints"]
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _write_index(self, fingerprints):
+        """
+        Saves the fingerprint index of the json file as it is now
+            Params:
+                fingerprints (dict): each profile name mapped to its fingerprint
+        """
+        index = {}
+        for name, fingerprint in sorted(fingerprints.items()):
+            index.setdefault(fingerprint, []).append(name)
+        atomic_write(
+            self.index_path,
+            json.dumps(
+                {"profiles_mtime": self._get_profiles_mtime(), "fingerprints": index}
+            ),
+        )
+        return index
+
+    def get_fingerprint_index(self):
+        """
+        Returns each fingerprint mapped to the names of the profiles that have it,
+            rebuilt if the profiles were changed by something other than lgmpm
+        """
+        index = self._read_index(self._get_profiles_mtime())
+        if index is None:
+            _, profiles = self.load()
+            index = self._write_index(
+                {name: get_fingerprint(settings) for name, settings in profiles.items()}
+            )
+        return index
+
+    def find_profiles(self, fingerprint):
+        """
+        Returns the names of the stored profiles with a fingerprint, sorted
+        """
+        return self.get_fingerprint_index().get(fingerprint, [])
+
+    def quarantine(self):
+        """
+        Moves an unreadable json file aside, so a fresh one can be started
+            Returns:
+                (Path): where the unreadable file was moved to
+        """
+        corrupt_fp = self.path.with_name(f"{self.path.name}.corrupt-{int(time.time())}")
+        os.replace(self.path, corrupt_fp)
+        return corrupt_fp
+
+
+STORES = ("json", "sqlite")
+
+
+def get_store(model):
+    """
+    Returns the profile store of a mouse model, picked by $LGMPM_STORE
+        ('json' by default, or 'sqlite')
+    """
+    name = os.environ.get("LGMPM_STORE", "json")
+    if name == "json":
+        return JsonProfileStore(model)
+    if name == "sqlite":
+        # only imported here, so that json stores never compile it
+        from sqlitestore import SqliteProfileStore
+
+        return SqliteProfileStore(model)
+    raise ProfileStoreError(
+        f"Unknown store '{name}', expected one of {', '.join(STORES)}"
+    )
+
+
+def get_stored_models():
+    """
+    Lists the mouse models with stored profiles in the models dir,
+        without any device access
+        Returns:
+            (list(str)): the model names, sorted, ex. ["g403", "g502"]
+    """
+    try:
+        entries = os.listdir(get_models_dir())
+    except OSError:
+        return []
+    models = set()
+    for entry in entries:
+        stem, _, suffix = entry.rpartition(".")
+        # skips ex. g403.index.json, temp files, and apps.json (the --watch rules)
+        if (
+            suffix in ("json", "sqlite3")
+            and "." not in stem
+            and stem not in ("", "apps")
+        ):
+            models.add(stem)
+    return sorted(model for model in models if get_store(model).exists())
@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# tracing.py - optional timing of every external call (ratbagctl, D-Bus,
+#   profile writes, color lookups), saved as a Chrome/Perfetto trace
+#
+#   enabled with 'lgmpm.py --trace <file>' or $LGMPM_TRACE=<file>, then open
+#       the file in https://ui.perfetto.dev or chrome://tracing
+
+import atexit
+import os
+import time
+from _thread import get_ident
+
+# the Trace being recorded, None while tracing is off
+_trace = None
+
+
+class Trace:
+    """
+    A class collecting trace events until they are saved
+
+        Attributes:
+            fp (str): the file the trace is saved to
+            origin (float): the perf_counter() time the process started at
+            events (list(dict)): the Chrome trace events recorded so far
+    """
+
+    def __init__(self, fp):
+        self.fp = fp
+        self.origin = time.perf_counter() - get_process_age()
+        self.events = []
+        return
+
+    def add(self, name, cat, start, end, args):
+        """
+        Records one finished span
+            Params:
+                name (str): what ran, ex. "ratbagctl sleeping-puppy info"
+                cat (str): the kind of call, ex. "subprocess"
+                start (float): the perf_counter() time it started at
+                end (float): the perf_counter() time it finished at
+                args (dict): details shown with the span, ex. the exit code
+        """
+        # list.append is atomic, so spans of parallel writes can be added as is
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                "ts": (start - self.origin) * 1e6,
+                "dur": (end - start) * 1e6,
+                "pid": os.getpid(),
+                "tid": get_ident(),
+                "args": args,
+            }
+        )
+        return
+
+    def save(self):
+        """
+        Writes the trace event json, see the Chrome 'Trace Event Format'
+        """
+        # only imported here, so tracing costs nothing until it is saved
+        import json
+
+        with open(self.fp, "w") as trace_file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, trace_file)
+        return
+
+
+class Span:
+    """
+    A class timing one call, as a context manager
+
+        Attributes:
+            args (dict): details shown with the span, add to them with set()
+    """
+
+    def __init__(self, trace, name, cat, args):
+        self.trace = trace
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = None
+        return
+
+    def set(self, **args):
+        """
+        Adds details to the span, ex. set(exit_code=0)
+        """
+        self.args.update(args)
+        return
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None:
+            self.args["error"] = repr(exc)
+        self.trace.add(self.name, self.cat, self.start, time.perf_counter(), self.args)
+        return False
+
+
+class NullSpan:
+    """
+    A class standing in for Span while tracing is off, it does nothing
+    """
+
+    def set(self, **args):
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def get_process_age():
+    """
+    Returns how many seconds ago this process was started, from /proc,
+        so the trace shows what python startup and imports cost
+    """
+    try:
+        with open("/proc/self/stat") as stat_file:
+            # the process name can contain spaces, so split after it
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as uptime_file:
+            uptime = float(uptime_file.read().split()[0])
+        start_time = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    return max(uptime - start_time, 0.0)
+
+
+def start_tracing(fp):
+    """
+    Starts recording spans, and saves them to fp when the program exits
+        Params:
+            fp (str): the trace file, tracing stays off if it is empty/None
+    """
+    global _trace
+    if not fp or _trace is not None:
+        return
+    _trace = Trace(fp)
+    # NOTE /proc only counts in clock ticks, so this is approximate
+    _trace.add(
+        "python startup and imports", "startup", _trace.origin, time.perf_counter(), {}
+    )
+    atexit.register(_trace.save)
+    return
+
+
+def span(name, cat="call", **args):
+    """
+    Times a call while tracing is on
+        Params:
+            name (str): what runs, ex. the command line
+            cat (str): the kind of call, ex. "subprocess" or "dbus"
+            args: details shown with the span
+        Returns:
+            (Span): a context manager, or the do-nothing NULL_SPAN when tracing is off
+    """
+    if _trace is None:
+        return NULL_SPAN
+    return Span(_trace, name, cat, args)
@@ -2,8 +2,6 @@
 # utils.py - helper function module for lgmpm.py
 
 import argparse
-import re
-import subprocess
 
 
 def get_bash_stdout(cmd_str):
@@ -13,31 +11,28 @@ def get_bash_stdout(cmd_str):
             cmd_str (str): a bash command, ex. "ratbagctl list"
         Returns:
             rbc_out (str): the decoded standard output (stdout) of cmd_str
+        Raises:
+            CommandError: if the command timed out, was skipped by the
+                circuit breaker, or could not be started
     """
+    # only imported here, so that parsing the arguments doesn't import it
+    from executor import CommandError, run_command
+
     cmd_lst = [c.strip() for c in cmd_str.split(" ")]
-    rbc_out = subprocess.run(cmd_lst, stdout=subprocess.PIPE).stdout.decode()
+    result = run_command(cmd_lst, merge_stderr=False)
+    if result.returncode is None:
+        raise CommandError(result)
+    # NOTE any other failure is just empty/unparsable output,
+    #   ex. when asking for one resolution past the last one
+    rbc_out = result.output
     return rbc_out
 
 
-def get_mouse_alias_and_model():
-    """
-    Parses the ratbagctl short name of the connected mouse and the mouse model
-        Returns:
-            (alias, model)
-            alias (str): the ratbagctl name of the mouse, ex. "sleeping-puppy"
-            model (str): the model short name/number of the mouse, ex. "G403"
-    """
-    rbc_out = get_bash_stdout("ratbagctl list")
-    mouse_re = re.compile(r"([a-z-]+):.*(G\d{3}|G Pro).*")
-    mouse_mo = mouse_re.match(rbc_out)
-    alias = mouse_mo.group(1).lower()
-    model = mouse_mo.group(2).lower()
-    return (alias, model)
-
-
-def mouse_arg_parser():
+def mouse_arg_parser(argv=None):
     """
     Uses argparse to parse CLI arguments passed to the program
+        Params:
+            argv (list(str)): the arguments to parse, defaults to sys.argv[1:]
         Returns:
             argparse.Namespace
     """
@@ -69,6 +64,11 @@ def mouse_arg_parser():
         help="delete <profile_name>",
         action="store_true",
     )
+    parser.add_argument(
+        "--detect",
+        help="find which stored profile the mouse is running right now",
+        action="store_true",
+    )
     parser.add_argument(
         "-l",
         "--list",
@@ -93,8 +93,105 @@ def mouse_arg_parser():
         help="update <profile_name> with the current mouse settings",
         action="store_true",
     )
+    parser.add_argument(
+        "--history",
+        help="list the saved versions of <profile_name> and what changed in each",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--diff",
+        metavar="VERSION",
+        nargs="+",
+        type=int,
+        help="show what changed in <profile_name> from one version to the stored"
+        " profile, or between two versions",
+    )
+    parser.add_argument(
+        "--rollback",
+        metavar="VERSION",
+        type=int,
+        help="write a saved version of <profile_name> to the mouse and make it"
+        " the latest version again",
+    )
+    parser.add_argument(
+        "--all",
+        help="with --show, show every stored profile of every model, without"
+        " reading the mouse",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--export",
+        choices=("json", "csv"),
+        help="print every stored profile of every model as json or csv,"
+        " without reading the mouse",
+    )
+    parser.add_argument(
+        "--dry-run",
+        help="with --active, --cycle, --rollback, --watch, --hotplug, or --drift,"
+        " only print the settings that would change",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--daemon",
+        help="stay resident and serve commands from other lgmpm.py calls",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch",
+        metavar="RULES_FILE",
+        nargs="?",
+        const=True,
+        help="switch profiles while the applications in RULES_FILE run"
+        " (default models/apps.json), and switch back when they exit",
+    )
+    parser.add_argument(
+        "--hotplug",
+        help="stay resident and write the last active profile back whenever a"
+        " mouse is plugged in again",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--drift",
+        metavar="POLICY",
+        nargs="?",
+        const="log",
+        choices=("log", "restore", "record"),
+        help="stay resident and notice when Piper or an onboard button changed a"
+        " mouse, then log it (default), restore the last active profile, or"
+        " record the new settings as a profile",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="run many commands in one go, one per line of FILE ('-' for stdin),"
+        " ex. 'new gaming' or 'active gaming'",
+    )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="save the timing of every external call as a Chrome/Perfetto trace"
+        " (or set $LGMPM_TRACE)",
+    )
+
+    return parser.parse_args(argv)
+
 
-    return parser.parse_args()
+# the flags that select what the program does, only one may be set at a time
+#   the rest (ex. --dry-run) modify how the selected command runs
+COMMAND_FLAGS = (
+    "active",
+    "cycle",
+    "delete",
+    "detect",
+    "diff",
+    "export",
+    "history",
+    "list",
+    "new",
+    "rollback",
+    "show",
+    "update",
+)
 
 
 def print_list_msg():
@@ -112,3 +209,22 @@ def print_help_msg():
     """
     print("See 'lgmpm.py --help' for help")
     return
+
+
+def get_flags_set(args, flags=COMMAND_FLAGS):
+    """
+    Returns the flags that were passed on the command line, in order
+        Params:
+            args (argparse.Namespace): the parsed CLI arguments
+            flags (tuple(str)): the flags to look at, ex. COMMAND_FLAGS
+        Returns:
+            (list(str)): ex. ["rollback"]
+    """
+    # NOTE a flag that takes a value is set even when the value is falsy,
+    #   ex. '--rollback 0'
+    flags_set = []
+    for flag in flags:
+        value = getattr(args, flag)
+        if value is not None and value is not False:
+            flags_set.append(flag)
+    return flags_set
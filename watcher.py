@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+# watcher.py - switches profiles automatically while a matching application
+#   runs, and puts the previous profiles back once it exits
+#
+#   usage: lgmpm.py --watch [RULES_FILE]
+#       RULES_FILE is json mapping executable names or glob patterns to
+#           stored profiles, ex. {"hl2_linux": "gaming", "*.exe": "wine"},
+#               models/apps.json by default
+
+import fnmatch
+import json
+import os
+import re
+import signal
+import sys
+import time
+
+from store import get_models_dir
+
+# characters that make a rule a glob pattern instead of an exact name
+GLOB_CHARS = "*?["
+
+
+def get_rules_fp():
+    """
+    Returns the Path of the default rules file, models/apps.json
+    """
+    return get_models_dir() / "apps.json"
+
+
+class AppRules:
+    """
+    A class matching process names to profiles, compiled once so that a new
+        process costs one dict lookup and at most one regex match
+
+        Attributes:
+            exact (dict): each exact (lower case) executable name mapped to its profile
+            patterns (list(tuple)): (glob pattern, profile) of the other rules, in order
+            pattern_re (re.Pattern): every glob pattern in a single regex, or None
+    """
+
+    def __init__(self, rules):
+        """
+        Compiles the rules
+            Params:
+                rules (dict): each executable name or glob pattern mapped to a
+                    profile name, exact names win over patterns, then the
+                        first matching pattern wins
+        """
+        self.exact = {}
+        self.patterns = []
+        for pattern, profile_name in rules.items():
+            pattern = pattern.lower()
+            if any(char in pattern for char in GLOB_CHARS):
+                self.patterns.append((pattern, profile_name))
+            else:
+                self.exact.setdefault(pattern, profile_name)
+        self.pattern_re = None
+        if self.patterns:
+            # one named group per pattern, the regex tries them in order
+            self.pattern_re = re.compile(
+                "|".join(
+                    f"(?P<r{idx}>{fnmatch.translate(pattern)})"
+                    for idx, (pattern, _) in enumerate(self.patterns)
+                )
+            )
+        # the same few names (ex. 'bash', 'chrome') start over and over
+        self._matches = {}
+        return
+
+    @classmethod
+    def load(cls, fp):
+        """
+        Reads the rules from a json file, see __init__()
+        """
+        with open(fp) as rules_file:
+            rules = json.load(rules_file)
+        if not isinstance(rules, dict):
+            raise ValueError(f"{fp} should map executable names to profile names")
+        return cls(rules)
+
+    def match(self, name):
+        """
+        Returns the profile of the rule matching an executable name, or None
+        """
+        name = name.lower()
+        if name not in self._matches:
+            profile_name = self.exact.get(name)
+            if profile_name is None and self.pattern_re is not None:
+                pattern_mo = self.pattern_re.match(name)
+                if pattern_mo:
+                    profile_name = self.patterns[int(pattern_mo.lastgroup[1:])][1]
+            self._matches[name] = profile_name
+        return self._matches[name]
+
+
+class ProcScanner:
+    """
+    A class that finds the processes started and exited since its last scan
+
+        Attributes:
+            proc_root (Path): the /proc tree, ex. a fake one in bench/watch_sim.py
+            known (set(str)): the pids seen in the last scan
+            young (dict): the pids that were new in the last scan mapped to their name
+    """
+
+    def __init__(self, proc_root="/proc"):
+        self.proc_root = str(proc_root)
+        self.known = set()
+        self.young = {}
+        return
+
+    def scan(self):
+        """
+        Lists /proc and only reads the names of pids that are new
+            Returns:
+                (started, exited) (tuple): a list of (pid, name) of each new (or
+                    renamed) process, and a list of the pids that are gone
+        """
+        pids = {
+            entry.name for entry in os.scandir(self.proc_root) if entry.name.isdigit()
+        }
+        started = []
+        young = {}
+        for pid in pids - self.known:
+            young[pid] = self.get_name(pid)
+            if young[pid]:
+                started.append((pid, young[pid]))
+        # a process caught between fork() and exec() still has its parent's
+        #   name, so the pids that were new last time are read once more
+        for pid, name in self.young.items():
+            if pid in pids:
+                new_name = self.get_name(pid)
+                if new_name and new_name != name:
+                    started.append((pid, new_name))
+        exited = list(self.known - pids)
+        self.known = pids
+        self.young = young
+        # NOTE a reused pid looks like the same process, but the kernel only
+        #   reuses a pid once it has cycled through all of them
+        return (started, exited)
+
+    def get_name(self, pid):
+        """
+        Returns the executable name of a process, or '' for kernel threads
+            and processes that are already gone
+        """
+        try:
+            with open(f"{self.proc_root}/{pid}/cmdline", "rb") as cmdline_file:
+                argv0 = (
+                    cmdline_file.read(4096).split(b"\0", 1)[0].decode(errors="replace")
+                )
+        except OSError:
+            return ""
+        # Wine and Proton games show up as ex. 'C:\Games\game.exe'
+        return re.split(r"[/\\]", argv0)[-1]
+
+
+class AppWatcher:
+    """
+    A class that switches the mice to the profile of the most recently
+        started matching application, and back to the previous profiles
+            once every matching application has exited
+
+        Attributes:
+            rules (AppRules): which executables select which profile
+            get_mice (function): returns the loaded Mice, ex. MiceCache.get
+            scanner (ProcScanner): finds started and exited processes
+            debounce (float): seconds a switch must stay wanted before the mice are
+                written, so short-lived processes never cause a write
+            dry_run (bool): only print the settings that would be written
+            running (dict): the pid of each matching process mapped to
+                (name, profile), in the order they started
+            previous (dict): each mouse model mapped to the profile it had
+                before the first switch, None while nothing is switched
+            applied (str): the profile the watcher switched to, or None
+            pending (tuple): (profile, since) of the switch waiting on the debounce
+    """
+
+    def __init__(self, rules, get_mice, proc_root="/proc", debounce=2.0, dry_run=False):
+        self.rules = rules
+        self.get_mice = get_mice
+        self.scanner = ProcScanner(proc_root)
+        self.debounce = debounce
+        self.dry_run = dry_run
+        self.running = {}
+        self.previous = None
+        self.applied = None
+        self.pending = (None, 0.0)
+        return
+
+    def get_wanted(self):
+        """
+        Returns (name, profile) of the newest matching process, or (None, None)
+        """
+        if not self.running:
+            return (None, None)
+        return self.running[next(reversed(self.running))]
+
+    def tick(self, now=None):
+        """
+        Scans for started and exited processes, and switches once the wanted
+            profile has stayed the same for the debounce time
+            Params:
+                now (float): the time.monotonic() time, ex. a fake clock in tests
+            Returns:
+                (bool): True if the mice were written
+        """
+        now = time.monotonic() if now is None else now
+        started, exited = self.scanner.scan()
+        for pid in exited:
+            self.running.pop(pid, None)
+        for pid, name in started:
+            profile_name = self.rules.match(name)
+            if profile_name is not None:
+                self.running[pid] = (name, profile_name)
+            else:
+                # ex. a forked launcher that exec()'d something else
+                self.running.pop(pid, None)
+
+        name, wanted = self.get_wanted()
+        if wanted != self.pending[0]:
+            self.pending = (wanted, now)
+        if wanted == self.applied or now - self.pending[1] < self.debounce:
+            return False
+        self.switch(wanted, name)
+        return True
+
+    def switch(self, profile_name, app_name=None):
+        """
+        Writes profile_name to the mice, or puts back the previous profiles
+            if it is None
+        """
+        mice = self.get_mice()
+        if profile_name is None:
+            previous_str = ", ".join(
+                f"{model.upper()} '{name}'" for model, name in self.previous.items()
+            )
+            print(f"No watched application is running, restoring {previous_str}")
+            mice.set_profiles(self.previous, dry_run=self.dry_run)
+            self.previous = None
+        else:
+            if self.previous is None:
+                self.previous = {
+                    mouse.model: mouse.last_active_profile for mouse in mice.mice
+                }
+            print(f"'{app_name}' is running, switching to '{profile_name}'")
+            mice.set_active_profile(profile_name, dry_run=self.dry_run)
+        self.applied = profile_name
+        return
+
+    def run(self, interval=1.0):
+        """
+        Watches until interrupted, then puts back the previous profiles
+            Params:
+                interval (float): seconds between scans of /proc
+        """
+        # exit cleanly (and restore the profiles) when asked to stop
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                try:
+                    self.tick()
+                except Exception as e:
+                    # ex. the mouse was unplugged, try again on the next scan
+                    print(f"Could not switch profiles: {e}")
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if self.applied is not None:
+                try:
+                    self.switch(None)
+                except Exception as e:
+                    print(f"Could not restore the previous profiles: {e}")
+        return
+
+
+def run_watcher(rules_fp=None, dry_run=False):
+    """
+    Runs the application watcher until it is interrupted
+        Params:
+            rules_fp (Path): the json rules file, defaults to get_rules_fp()
+            dry_run (bool): only print the settings that would be written
+    """
+    # only imported here, like in the daemon, so other commands never load it
+    from mouse import MiceCache
+
+    rules_fp = rules_fp or get_rules_fp()
+    try:
+        rules = AppRules.load(rules_fp)
+    except FileNotFoundError:
+        print(f'No rules file {rules_fp}, ex. {{"hl2_linux": "gaming"}}')
+        return
+    except ValueError as e:
+        print(f"Could not read the rules in {rules_fp}: {e}")
+        return
+    cache = MiceCache()
+    rule_ct = len(rules.exact) + len(rules.patterns)
+    print(f"Watching for {rule_ct} application(s) from {rules_fp}")
+    AppWatcher(rules, cache.get, dry_run=dry_run).run()
+    return